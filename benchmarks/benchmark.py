@@ -0,0 +1,104 @@
+"""Time splitting, parsing, every conversion stage and formatting on synthetic projects.
+
+Results are written as JSON, so runs of different releases can be compared:
+
+    uv run python benchmarks/benchmark.py -o before.json
+    uv run python benchmarks/benchmark.py -o after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import time
+from pathlib import Path
+
+from generate_pyproject import generate_pyproject
+
+import convert_poetry2uv as cp
+
+SHAPES = {
+    "small": {},
+    "dependencies-800": {"dependencies": 800, "groups": 0},
+    "groups-40": {"groups": 40},
+    "extras-50-sources-20": {"extras": 50, "sources": 20},
+    "tool-keys-2000": {"tool_keys": 2000},
+}
+
+
+def run_once(text: str, project_dir: Path) -> dict[str, float]:
+    """Convert text once, return the duration of every stage it went through.
+
+    Nested stages (the rules within "convert") are included as well as the
+    stage around them, "total" is the whole conversion.
+    """
+    cp.translate_constraint.cache_clear()
+    for validator in (cp.valid_requirement, cp.valid_marker, cp.valid_specifier):
+        validator.cache_clear()
+    timings: dict[str, float] = {}
+    with cp.profiling(memory=False) as records:
+        start = time.perf_counter()
+        cp.conversion_entry(text, project_dir)
+        timings["total"] = time.perf_counter() - start
+    for record in records:
+        timings[record["stage"]] = timings.get(record["stage"], 0) + record["duration"]
+    return timings
+
+
+def benchmark(shape: dict, repeat: int) -> dict[str, dict[str, float]]:
+    text = generate_pyproject(**shape)
+    with contextlib.redirect_stdout(io.StringIO()):
+        runs = [run_once(text, Path.cwd()) for _ in range(repeat)]
+    return {
+        name: {
+            "min": min(run.get(name, 0) for run in runs),
+            "median": statistics.median(run.get(name, 0) for run in runs),
+        }
+        for name in runs[0]
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    for shape, stages_ in results.items():
+        for name, timing in stages_.items():
+            if not (old := baseline.get(shape, {}).get(name)):
+                continue
+            ratio = timing["median"] / old["median"] if old["median"] else 0
+            slower = ratio > 1.2 and timing["median"] - old["median"] > 0.0005
+            marker = "  <-- slower" if slower else ""
+            print(f"{shape:24} {name:22} {ratio:6.2f}x{marker}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark convert_poetry2uv")
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--shape", choices=SHAPES, action="append")
+    parser.add_argument("--compare", type=Path, help="Results of a previous run")
+    args = parser.parse_args()
+
+    results = {}
+    for shape in args.shape or SHAPES:
+        results[shape] = benchmark(SHAPES[shape], args.repeat)
+        total = results[shape]["total"]["median"]
+        print(f"{shape:24} {total * 1000:9.2f} ms")
+    args.output.write_text(
+        json.dumps(
+            {
+                "python": platform.python_version(),
+                "converter": cp.converter_fingerprint(),
+                "repeat": args.repeat,
+                "results": results,
+            },
+            indent=2,
+        )
+        + "\n"
+    )
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text())["results"])
+
+
+if __name__ == "__main__":
+    main()
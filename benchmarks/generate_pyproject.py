@@ -0,0 +1,94 @@
+"""Generate synthetic poetry pyproject.toml files of a configurable shape."""
+
+import argparse
+import random
+
+CONSTRAINTS = ["*", "^{}.{}.{}", "~{}.{}", ">={}.{},<{}", "{}.{}.*", "=={}.{}.{}"]
+
+
+def _constraint(rng: random.Random) -> str:
+    template = rng.choice(CONSTRAINTS)
+    return template.format(*(rng.randint(0, 9) for _ in range(template.count("{}"))))
+
+
+def generate_pyproject(
+    dependencies: int = 20,
+    groups: int = 2,
+    extras: int = 1,
+    sources: int = 1,
+    tool_keys: int = 20,
+    seed: int = 0,
+) -> str:
+    """Return the text of a poetry pyproject.toml with the requested shape.
+
+    Args:
+        dependencies: number of dependencies in every dependency table.
+        groups: number of dependency groups, next to the main dependencies.
+        extras: number of extras, each with its own optional dependency.
+        sources: number of private sources, each used by one dependency.
+        tool_keys: number of keys in the [tool.ruff] table.
+        seed: seed for the random constraints.
+    """
+    rng = random.Random(seed)
+    lines = [
+        "[tool.poetry]",
+        'name = "generated"',
+        'version = "0.1.0"',
+        'description = "A generated project"',
+        'authors = ["First Last <first@example.com>", "<other@example.com>"]',
+        'license = "MIT"',
+        'readme = "README.md"',
+        "",
+        "[tool.poetry.dependencies]",
+        'python = "^3.12"',
+    ]
+    lines += [f'dep{i} = "{_constraint(rng)}"' for i in range(dependencies)]
+    lines += [
+        f'optional{i} = {{ version = "{_constraint(rng)}", optional = true }}'
+        for i in range(extras)
+    ]
+    lines += [
+        f'private{i} = {{ version = "{_constraint(rng)}", source = "source{i}" }}'
+        for i in range(sources)
+    ]
+    for group in range(groups):
+        lines += ["", f"[tool.poetry.group.group{group}.dependencies]"]
+        lines += [
+            f'group{group}-dep{i} = "{_constraint(rng)}"' for i in range(dependencies)
+        ]
+    if extras:
+        lines += ["", "[tool.poetry.extras]"]
+        lines += [f'extra{i} = ["optional{i}"]' for i in range(extras)]
+    for i in range(sources):
+        lines += [
+            "",
+            "[[tool.poetry.source]]",
+            f'name = "source{i}"',
+            f'url = "https://pypi{i}.example.com/simple"',
+            'priority = "explicit"',
+        ]
+    lines += [
+        "",
+        "[build-system]",
+        'requires = ["poetry-core>=1.0.0"]',
+        'build-backend = "poetry.core.masonry.api"',
+        "",
+        "[tool.ruff]",
+        "line-length = 100",
+    ]
+    lines += [
+        f'option{i} = ["value{i}", "other{i}"]  # comment {i}' for i in range(tool_keys)
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=generate_pyproject.__doc__)
+    for option in ("dependencies", "groups", "extras", "sources", "tool-keys", "seed"):
+        parser.add_argument(f"--{option}", type=int)
+    args = {k: v for k, v in vars(parser.parse_args()).items() if v is not None}
+    print(generate_pyproject(**args), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,268 +1,3724 @@
 #!/usr/bin/env python
-import argparse
-import re
-from pathlib import Path
+# Start-up time matters for single file runs: modules which are not needed to
+# parse the arguments or to recognise a non-poetry project are imported lazily.
+# That includes re, and typing, pathlib, json, glob and dataclasses, which all
+# import re themselves: regular expressions are compiled on first use, see
+# _regex, and the classes below are written without dataclasses.
+from __future__ import annotations
 
-import tomlkit as tk
+import contextlib
+import functools
+import importlib.util
+import io
+import itertools
+import os
+import sys
+import time
+from collections import Counter, namedtuple
+from collections.abc import Callable, Iterable, Iterator
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import argparse
+    import glob
+    import json
+    import re
+    import sqlite3
+    import threading
+    from pathlib import Path
+    from typing import Any
+
+    import tomlkit as tk
+
+
+def _lazy_import(name: str):
+    """Return the module, executing it on first attribute access."""
+    if module := sys.modules.get(name):
+        return module
+    if (spec := importlib.util.find_spec(name)) is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+if not TYPE_CHECKING:
+    tk = _lazy_import("tomlkit")
+    json = _lazy_import("json")
+    glob = _lazy_import("glob")
+
+
+@functools.cache
+def _regex(pattern: str) -> re.Pattern:
+    """Compile pattern on first use (flags go inline, e.g. "(?i)")."""
+    import re
+
+    return re.compile(pattern)
 
 
 def argparser() -> argparse.Namespace:
+    import argparse
+    from pathlib import Path
+
     parser = argparse.ArgumentParser(
         prog="convert_poetry2uv",
         description="Poetry to Uv pyproject conversion",
         epilog="It will move the original pyproject.toml to pyproject.toml.org",
     )
-    parser.add_argument("filename")
+    parser.add_argument(
+        "filename",
+        nargs="?",
+        help="pyproject.toml file ('-' for stdin), .tar.gz or .zip archive, "
+        "directory or glob pattern",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Additional files, directories or glob patterns (batch mode)",
+    )
     parser.add_argument(
         "-n",
         action="store_true",
         help="Do not modify pyproject.toml, instead create pyproject_temp_uv.toml",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--stdout",
+        action="store_true",
+        help="Write the converted pyproject.toml to stdout and nothing to disk "
+        "(implied when reading stdin)",
+    )
+    parser.add_argument(
+        "--project-dir",
+        type=Path,
+        metavar="DIR",
+        help="With --stdout, the directory to look for the license file in "
+        "(default: that of the file, or the current directory for stdin)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes in batch mode (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--io-concurrency",
+        type=int,
+        metavar="N",
+        help="In batch mode, keep up to N file reads and writes in flight while "
+        "the workers convert, for network file systems",
+    )
+    parser.add_argument(
+        "--archive-output",
+        type=Path,
+        metavar="DIR",
+        help="Write the projects converted in .tar(.gz) and .zip archives to "
+        "DIR/<archive name>/ instead of rewriting the archives",
+    )
+    parser.add_argument(
+        "--workspace",
+        action="store_true",
+        help="Make the directory given first the root of a uv workspace holding "
+        "all projects found, with path dependencies between them as workspace "
+        "sources",
+    )
+    parser.add_argument(
+        "--lock",
+        action="store_true",
+        help="Translate a sibling poetry.lock into uv.lock (uv_temp.lock with -n)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only report what a conversion would do, without writing anything",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Compare the dependencies, extras, groups, scripts and entry points of "
+        "converted projects (with -n: of pyproject_temp_uv.toml) with the original",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="FILE",
+        help="Write the duration and peak memory of every conversion stage as JSON",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="FILE",
+        help="Write the conversion stages as a Chrome trace-event file",
+    )
+    parser.add_argument(
+        "--log",
+        metavar="FILE",
+        help="Append one JSON line per processed file to FILE ('-' for stdout)",
+    )
+    parser.add_argument(
+        "--index-db",
+        type=Path,
+        metavar="FILE",
+        help="Record the dependencies of every converted project in the SQLite "
+        "database FILE, updating what earlier runs recorded",
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default="batch",
+        help="Sync every written file to disk ('always'), once at the end of the "
+        "run ('batch', default) or leave it to the OS ('never')",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use or update the conversion cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="Location of the conversion cache (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=100,
+        help="Maximum size of the conversion cache in MB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="Only convert projects whose pyproject.toml, poetry.lock or LICENSE "
+        "changed since the git REF, uncommitted changes included (use REF... to "
+        "start from the merge-base of REF and HEAD)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After converting, convert projects again whenever their pyproject.toml, "
+        "poetry.lock or LICENSE changes (implies -n)",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="With --watch, poll for changes instead of using inotify",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Answer JSON lines conversion requests on stdin (or --socket)",
+    )
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        help="Unix socket to serve conversion requests on, with --serve",
+    )
+    args = parser.parse_args()
+    if args.filename is None and args.since:
+        args.filename = "."
+    if args.io_concurrency and (
+        args.check or args.verify or args.profile or args.trace
+    ):
+        parser.error(
+            "--io-concurrency cannot be combined with --check, --verify, "
+            "--profile or --trace"
+        )
+    if args.filename is None and not args.serve:
+        parser.error("the following arguments are required: filename")
+    if args.workspace and not Path(args.filename or "").is_dir():
+        parser.error("--workspace needs a directory as the first path")
+    if args.index_db and (args.check or args.verify):
+        parser.error("--index-db cannot be combined with --check or --verify")
+    args.stdout = args.stdout or args.filename == "-"
+    if args.stdout and (
+        args.paths
+        or args.check
+        or args.verify
+        or args.lock
+        or args.watch
+        or args.since
+        or args.serve
+        or args.index_db
+    ):
+        parser.error(
+            "--stdout (and reading stdin) converts a single file and cannot be "
+            "combined with more paths, --check, --verify, --lock, --watch, "
+            "--since, --serve or --index-db"
+        )
+    return args
+
+
+# The active collect_warnings lists, with whether they echo the warnings.
+_warnings: list[tuple[list[str], bool]] = []
+
+
+def warn(message: str) -> None:
+    """Print a warning and record it for the result of the current project."""
+    if all(echo for _, echo in _warnings):
+        print(message)
+    for warnings, _ in _warnings:
+        warnings.append(message)
+
+
+@contextlib.contextmanager
+def collect_warnings(echo: bool = True) -> Iterator[list[str]]:
+    """Record the warnings of the block, without printing them unless echo."""
+    collector: tuple[list[str], bool] = ([], echo)
+    _warnings.append(collector)
+    try:
+        yield collector[0]
+    finally:
+        _warnings.remove(collector)
+
+
+class ConstraintError(ValueError):
+    """Raised when a poetry version constraint cannot be translated."""
+
+
+_OPERATOR_SPACE = r"(\^|~=|~|==|!=|<=|>=|<|>|=)\s+"
+_CLAUSE_SEPARATOR = r"\s*,\s*|\s+"
+_CLAUSE = (
+    r"^(?P<op>\^|~=|~|===|==|!=|<=|>=|<|>|=)?"
+    r"(?P<release>\d+(?:\.\d+)*)"
+    r"(?P<wildcard>\.\*)?"
+    r"(?P<suffix>(?:[-_.]?[a-zA-Z]+[-_.]?\d*)*(?:\+[a-zA-Z0-9.]+)?)$"
+)
+
+
+def _bump(release: str, index: int) -> str:
+    """Increment the release segment at index, zeroing (and keeping) the rest."""
+    parts = [int(x) for x in release.split(".")]
+    bumped = [*parts[:index], parts[index] + 1]
+    return ".".join(str(x) for x in bumped + [0] * (len(parts) - len(bumped)))
+
+
+def _version_key(version: str) -> tuple:
+    found = _regex(_CLAUSE).match(version)
+    release = [int(x) for x in found["release"].split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    return tuple(release), not found["suffix"], found["suffix"]
+
+
+def _clause_specifiers(clause: str) -> list[str]:
+    if clause == "*":
+        return []
+    if not (found := _regex(_CLAUSE).match(clause)):
+        raise ConstraintError(f"Unsupported version constraint: {clause!r}")
+    op, release, wildcard, suffix = found.group("op", "release", "wildcard", "suffix")
+    version = f"{release}{suffix}"
+    parts = release.count(".") + 1
+    if wildcard and (suffix or op not in (None, "=", "==", "!=", "~")):
+        raise ConstraintError(f"Unsupported wildcard constraint: {clause!r}")
+    if op == "^":
+        first_nonzero = next(
+            (i for i, x in enumerate(release.split(".")) if int(x)), parts - 1
+        )
+        return [f">={version}", f"<{_bump(release, first_nonzero)}"]
+    if op == "~":
+        return [f">={version}", f"<{_bump(release, min(1, parts - 1))}"]
+    if op in (None, "=", "=="):
+        return [f"=={version}{wildcard or ''}"]
+    if op == "!=":
+        return [f"!={version}{wildcard or ''}"]
+    return [f"{op}{version}"]
+
+
+def _tighter(bound: tuple | None, other: tuple | None, upper: bool) -> tuple | None:
+    """Return the tighter of two (version, inclusive) lower or upper bounds."""
+    if bound is None or other is None:
+        return other or bound
+    key, other_key = _version_key(bound[0]), _version_key(other[0])
+    if key == other_key:
+        return bound if not bound[1] else other
+    return other if (other_key < key) == upper else bound
+
+
+def _bounds(specifiers: list[str]) -> tuple:
+    """Return the (lower, lower_inclusive, upper, upper_inclusive) of a range.
+
+    The range is the intersection of the specifiers: the highest lower and the
+    lowest upper bound.
+    """
+    lower = upper = None
+    for specifier in specifiers:
+        found = _regex(_CLAUSE).match(specifier)
+        op, release = found["op"], found["release"]
+        version = f"{release}{found['suffix']}"
+        new_lower = new_upper = None
+        if op == "==" and found["wildcard"]:
+            new_lower, new_upper = (release, True), (_bump(release, -1), False)
+        elif op == "~=":
+            new_lower = (version, True)
+            new_upper = (_bump(release, max(0, release.count(".") - 1)), False)
+        else:
+            if op in (">=", ">", "=="):
+                new_lower = (version, op != ">")
+            if op in ("<=", "<", "=="):
+                new_upper = (version, op != "<")
+        lower = _tighter(lower, new_lower, upper=False)
+        upper = _tighter(upper, new_upper, upper=True)
+    return (*(lower or (None, False)), *(upper or (None, False)))
+
+
+def _union(branches: list[list[str]]) -> tuple[list[str], str | None]:
+    """Merge OR'ed ranges into a single range, as PEP 440 has no OR operator."""
+    if any(not branch for branch in branches):
+        return [], None
+    ranges = [_bounds(branch) for branch in branches]
+    warning = None
+    if any("!=" in specifier for branch in branches for specifier in branch):
+        warning = "exclusions are dropped"
+
+    ranges.sort(key=lambda r: (r[0] is not None, r[0] and _version_key(r[0])))
+    lower, lower_inclusive, upper, upper_inclusive = ranges[0]
+    for next_lower, _, next_upper, next_upper_inclusive in ranges[1:]:
+        if upper is None:
+            break
+        if next_lower is None or _version_key(next_lower) > _version_key(upper):
+            warning = "the gap between the alternatives is included"
+        if next_upper is None or _version_key(next_upper) > _version_key(upper):
+            upper, upper_inclusive = next_upper, next_upper_inclusive
+
+    if lower is not None and lower == upper:
+        return [f"=={lower}"], warning
+    specifiers = []
+    if lower is not None:
+        specifiers.append(f"{'>=' if lower_inclusive else '>'}{lower}")
+    if upper is not None:
+        specifiers.append(f"{'<=' if upper_inclusive else '<'}{upper}")
+    return specifiers, warning
+
+
+@functools.lru_cache(maxsize=4096)
+def translate_constraint(version: str) -> tuple[str, str | None]:
+    """Translate a poetry constraint into a PEP 440 specifier and optional warning.
+
+    Supports ``*``, caret, tilde, wildcard and comparison clauses, combined with
+    ``,`` (or whitespace) and ``||``. The same constraint strings show up over and
+    over across projects, so translations are memoized.
+    """
+    branches = []
+    for branch in version.split("||"):
+        branch = _regex(_OPERATOR_SPACE).sub(r"\1", branch.strip())
+        if not branch:
+            raise ConstraintError(f"Unsupported version constraint: {version!r}")
+        branches.append(
+            [
+                specifier
+                for clause in _regex(_CLAUSE_SEPARATOR).split(branch)
+                for specifier in _clause_specifiers(clause)
+            ]
+        )
+    if len(branches) == 1:
+        return ",".join(branches[0]), None
+    specifiers, warning = _union(branches)
+    if warning:
+        warning = (
+            f"Version {version!r} translated to {','.join(specifiers)!r}: {warning}"
+        )
+    return ",".join(specifiers), warning
 
 
 def version_conversion(version: str) -> str:
-    gt_tilde_version = re.compile(r"[\^~](\d.*)")
-    tilde_with_digits_and_star = re.compile(r"^~([\d\.]+)\.\*")
-    if version == "*":
-        return ""
-    elif found := tilde_with_digits_and_star.match(version):
-        return f">={found[1]}"
-    elif found := gt_tilde_version.match(version):
-        return f">={found[1]}"
-    else:
-        print(f"Well, this is an unexpected version\nVersion = {version}\n")
-        raise ValueError
-
-
-def authors_maintainers(new_toml: tk.TOMLDocument) -> None:
-    project = new_toml["project"]
-    user_email = re.compile(r"^([\w ]+) <([\w@.]+)>$")
-    only_email = re.compile(r"^<([\w@.]+)>$")
-    only_user = re.compile(r"^([\w ]+)$")
-
-    for key in ("authors", "maintainers"):
-        if authors := project.get(key):
-            if isinstance(authors, list):
-                new_authors = tk.array()
-                for author in authors:
-                    if found := user_email.match(author):
-                        name, email = found.groups()
-                        tb = tk.inline_table().add("name", name).add("email", email)
-                        new_authors.add_line(tb)
-                    elif found := only_email.match(author):
-                        email = found[1]
-                        new_authors.add_line(tk.inline_table().add("email", email))
-                    elif found := only_user.match(author):
-                        name = found[1]
-                        new_authors.add_line(tk.inline_table().add("name", name))
-                    else:
-                        print(f"Unknown author {key} format: {author}")
-
-                new_authors.add_line(indent="")
-                project[key] = new_authors
-
-
-def parse_packages(deps: dict) -> tuple[list[str], dict[str, str], dict[str, str]]:
+    specifier, warning = translate_constraint(version)
+    if warning:
+        warn(warning)
+    return specifier
+
+
+_USER_EMAIL = r"^([\w ]+) <([\w@.]+)>$"
+_ONLY_EMAIL = r"^<([\w@.]+)>$"
+_ONLY_USER = r"^([\w ]+)$"
+
+
+def people_array(key: str, people: list[str]) -> tk.Array:
+    """Convert poetry "name <email>" strings into PEP 621 author tables."""
+    new_people = tk.array()
+    for person in people:
+        if found := _regex(_USER_EMAIL).match(person):
+            name, email = found.groups()
+            new_people.add_line(tk.inline_table().add("name", name).add("email", email))
+        elif found := _regex(_ONLY_EMAIL).match(person):
+            new_people.add_line(tk.inline_table().add("email", found[1]))
+        elif found := _regex(_ONLY_USER).match(person):
+            new_people.add_line(tk.inline_table().add("name", found[1]))
+        else:
+            warn(f"Unknown author {key} format: {person}")
+    new_people.add_line(indent="")
+    return new_people
+
+
+GIT_REFERENCES = ("branch", "tag", "rev", "subdirectory")
+
+
+def is_workspace_dependency(name: str, version, workspace: Iterable[str]) -> bool:
+    """Tell whether a poetry dependency becomes a source on a workspace member."""
+    return (
+        isinstance(version, dict)
+        and "path" in version
+        and not {"git", "source"} & version.keys()
+        and normalize_name(name) in workspace
+    )
+
+
+def parse_packages(
+    deps: dict, workspace: Iterable[str] = ()
+) -> tuple[list[str], dict[str, str], dict[str, dict]]:
+    """Convert poetry dependencies into requirements, optional ones and sources.
+
+    Path dependencies on the packages in workspace, normalized names of the
+    members of a uv workspace, become workspace sources.
+    """
     uv_deps: list[str] = []
     uv_deps_optional: dict[str, str] = {}
-    uv_deps_source: dict[str, str] = {}
+    uv_deps_source: dict[str, dict] = {}
     for name, version in deps.items():
         if name == "python":
             continue
 
         if isinstance(version, dict):
+            if git := version.get("git"):
+                uv_deps_source[name] = {"git": git} | {
+                    key: version[key] for key in GIT_REFERENCES if key in version
+                }
+            elif source := version.get("source"):
+                uv_deps_source[name] = {"index": source}
+            elif kind := next((k for k in ("path", "url") if k in version), None):
+                if not is_workspace_dependency(name, version, workspace):
+                    warn(f"Dependency {name!r}: {kind} dependencies are not converted")
+                    continue
+                uv_deps_source[name] = {"workspace": True}
+            if "python" in version:
+                warn(f"Dependency {name!r}: the python restriction is not converted")
+
+            v = version_conversion(version.get("version", "*"))
+            if markers := version.get("markers"):
+                v = f"{v} ; {markers}"
             if extras := version.get("extras"):
-                v = version["version"]
+                if version.get("optional"):
+                    extra = f"[{','.join(extras)}]"
+                    uv_deps_optional[name] = f"{extra}{v}"
+                    continue
                 for i in extras:
                     extra = f"[{i}]"
-                    uv_deps.append(f"{name}{extra}{version_conversion(v)}")
+                    uv_deps.append(f"{name}{extra}{v}")
             elif version.get("optional"):
-                uv_deps_optional[name] = version_conversion(version["version"])
-            elif source := version.get("source"):
-                uv_deps_source[name] = source
-                uv_deps.append(f"{name}{version_conversion(version["version"])}")
+                uv_deps_optional[name] = v
+            else:
+                uv_deps.append(f"{name}{v}")
             continue
 
         uv_deps.append(f"{name}{version_conversion(version)}")
     return uv_deps, uv_deps_optional, uv_deps_source
 
 
-def group_dependencies(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
-    if not (groups := org_toml["tool"]["poetry"].get("group")):
-        return
-    for group, data in groups.items():
-        uv_deps, uv_deps_optional, uv_deps_source = parse_packages(
-            data.get("dependencies", {})
-        )
-        new_toml["dependency-groups"] = new_toml.get("dependency-groups", tk.table())
-        new_toml["dependency-groups"].add(group, uv_deps)
+def is_pypi(name: str, url: str = "") -> bool:
+    """Whether a package source is PyPI, the implicit default index of uv.
 
-        parse_uv_deps_optional(new_toml, org_toml, uv_deps_optional)
-        parse_uv_deps_sources(new_toml, org_toml, uv_deps_source)
+    Poetry reserves the name, a source called PyPI only sets its priority.
+    """
+    return name.lower() == "pypi" and not url
 
 
-def dependencies(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
-    if not (deps := org_toml["tool"]["poetry"].get("dependencies", {})):
-        return
+def index_sources(org_toml: tk.TOMLDocument) -> dict[str, dict]:
+    return {
+        source["name"]: source
+        for source in org_toml["tool"]["poetry"].get("source", [])
+    }
 
-    uv_deps, uv_deps_optional, uv_deps_source = parse_packages(deps)
-    new_toml["project"]["dependencies"] = tk.array()
-    if uv_deps:
-        for x in uv_deps:
-            new_toml["project"]["dependencies"].add_line(x)
-        new_toml["project"]["dependencies"].add_line(indent="")
-
-    parse_uv_deps_optional(new_toml, org_toml, uv_deps_optional)
-    parse_uv_deps_sources(new_toml, org_toml, uv_deps_source)
-
-
-def parse_uv_deps_sources(new_toml, org_toml, uv_deps_source) -> None:
-    if uv_deps_source:
-        if not new_toml.get("tool", {}).get("uv", {}).get("sources"):
-            new_toml["tool"] = {"uv": {"sources": tk.table()}}
-        for lib, source in uv_deps_source.items():
-            for entry in org_toml["tool"]["poetry"]["source"]:
-                if entry.get("name") == source:
-                    url = entry.get("url")
-                    break
-            new_toml["tool"]["uv"]["sources"].add(
-                lib, tk.inline_table().add("git", url)
-            )
+
+def uv_table(new_toml: tk.TOMLDocument, key: str):
+    """Return tool.uv.<key> of the new document, creating the tables as needed."""
+    if "tool" not in new_toml:
+        new_toml["tool"] = tk.table()
+    if "uv" not in new_toml["tool"]:
+        new_toml["tool"]["uv"] = tk.table()
+    if key not in new_toml["tool"]["uv"]:
+        new_toml["tool"]["uv"][key] = tk.aot() if key == "index" else tk.table()
+    return new_toml["tool"]["uv"][key]
 
 
-def parse_uv_deps_optional(
+def parse_uv_deps_sources(
     new_toml: tk.TOMLDocument,
     org_toml: tk.TOMLDocument,
-    uv_deps_optional: dict[str, str],
+    uv_deps_source: dict[str, dict],
 ) -> None:
-    if uv_deps_optional:
-        optional_deps = {
-            extra: [f"{x}{uv_deps_optional[x]}" for x in deps]
-            for extra, deps in org_toml["tool"]["poetry"].pop("extras", {}).items()
-        }
-        new_toml["project"]["optional-dependencies"] = new_toml["project"].get(
-            "optional-dependencies", {}
-        )
-        new_toml["project"]["optional-dependencies"].update(optional_deps)
-
-
-def tools(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
-    if org_toml["tool"]:
-        new_toml["tool"] = new_toml.get("tool", tk.table())
-        for tool, data in org_toml["tool"].items():
-            if tool == "poetry":
+    if not uv_deps_source:
+        return
+    sources = index_sources(org_toml)
+    tables = {}
+    for lib, source in uv_deps_source.items():
+        if index := source.get("index"):
+            url = sources.get(index, {}).get("url", "")
+            if is_pypi(index, url):
                 continue
-            new_toml["tool"][tool] = data
+            if index not in sources:
+                raise ValueError(f"Source {index!r} of {lib!r} is not defined")
+            if is_git_url(url):
+                source = {"git": url}
+        tables[lib] = tk.inline_table()
+        tables[lib].update(source)
+    if tables:
+        uv_sources = uv_table(new_toml, "sources")
+        for lib, table in tables.items():
+            uv_sources.add(lib, table)
 
 
-def poetry_plugins(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
-    if plugins := org_toml["tool"]["poetry"].get("plugins"):
-        new_toml["project"]["entry-points"] = new_toml["project"].get(
-            "entry-points", tk.table()
-        )
-        for plugin, data in plugins.items():
-            new_toml["project"]["entry-points"][plugin] = data
+def tools(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
+    for tool, data in org_toml["tool"].items():
+        if tool == "poetry":
+            continue
+        if "tool" not in new_toml:
+            new_toml["tool"] = tk.table()
+        if tool == "uv" and "uv" in new_toml["tool"]:
+            for key, value in data.items():
+                new_toml["tool"]["uv"].setdefault(key, value)
+            continue
+        new_toml["tool"][tool] = data
 
 
 def build_system(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
     if build := org_toml.get("build-system"):
         new_toml["build-system"] = org_toml["build-system"]
         if "poetry" in build.get("build-backend"):
-            print("Poetry build system detected. Replaced with hatchling")
+            warn("Poetry build system detected. Replaced with hatchling")
             new_toml["build-system"]["requires"] = ["hatchling"]
             new_toml["build-system"]["build-backend"] = "hatchling.build"
 
 
-def project_base(new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument) -> None:
-    project = new_toml["project"]
-
-    project.add("name", org_toml["tool"]["poetry"]["name"])
-    project.add("version", org_toml["tool"]["poetry"]["version"])
-    if description := org_toml["tool"]["poetry"].get("description"):
-        project.add("description", description)
-    if authors := org_toml["tool"]["poetry"].get("authors"):
-        project.add("authors", authors)
-    if maintainers := org_toml["tool"]["poetry"].get("maintainers"):
-        project.add("maintainers", maintainers)
-    if license := org_toml["tool"]["poetry"].get("license"):
-        project.add("license", license)
-    if readme := org_toml["tool"]["poetry"].get("readme"):
-        project.add("readme", readme)
-    if requirespython := org_toml["tool"]["poetry"].get("requires-python"):
-        project.add("requires-python", version_conversion(requirespython))
-    elif (
-        requirespython := org_toml["tool"]["poetry"]
-        .get("dependencies", {})
-        .get("python")
-    ):
-        project.add("requires-python", version_conversion(requirespython))
-    if keywords := org_toml["tool"]["poetry"].get("keywords"):
-        project.add("keywords", keywords)
-    if classifiers := org_toml["tool"]["poetry"].get("classifiers"):
-        project.add("classifiers", classifiers)
-    if urls := org_toml["tool"]["poetry"].get("urls"):
-        project.add("urls", urls)
-
-    if scripts := org_toml["tool"]["poetry"].get("scripts"):
-        project.add("scripts", scripts)
-
-    if dependencies := org_toml["tool"]["poetry"].get("dependencies"):
-        project.add("dependencies", dependencies)
-
-
-def project_license(new_toml: tk.TOMLDocument, project_dir: Path) -> None:
-    project = new_toml["project"]
-    if license := project.get("license"):
-        if project_dir.joinpath(license).exists():
-            project["license"] = tk.inline_table().add("file", license)
-        else:
-            project["license"] = tk.inline_table().add("text", license)
+def license_table(license: str, exists: bool) -> tk.InlineTable:
+    """Refer to the license file if it exists, otherwise use the license text."""
+    return tk.inline_table().add("file" if exists else "text", license)
 
 
-def poetry_section_specific(
-    new_toml: tk.TOMLDocument, org_toml: tk.TOMLDocument, dir: Path
-) -> None:
-    project_base(new_toml, org_toml)
-    project_license(new_toml, dir)
-    authors_maintainers(new_toml)
-    group_dependencies(new_toml, org_toml)
-    dependencies(new_toml, org_toml)
-    poetry_plugins(new_toml, org_toml)
+# The [project] keys in the order they are written, keys of custom rules follow.
+PROJECT_KEYS = (
+    "name",
+    "version",
+    "description",
+    "authors",
+    "maintainers",
+    "license",
+    "readme",
+    "requires-python",
+    "keywords",
+    "classifiers",
+    "dependencies",
+    "urls",
+    "scripts",
+    "optional-dependencies",
+    "entry-points",
+)
+_PROJECT_ORDER = {key: index for index, key in enumerate(PROJECT_KEYS)}
 
+REQUIRED_KEYS = ("name", "version")
+RULES: dict[str, Callable[[Conversion, str, Any], None]] = {}
 
-def main() -> None:
-    args = argparser()
-    project_file = Path(args.filename)
-    if not project_file.exists():
-        print(f"File {project_file} not found")
+
+def rule(*keys: str):
+    """Register the decorated function as the conversion of tool.poetry keys.
+
+    A rule is called as ``rule(conversion, key, value)`` for every registered key
+    present in the document, in a single pass in document order. Rules collect
+    their results in the Conversion, which writes them out once at the end.
+    Registering a key again replaces its rule, so a project can plug in its own
+    conversions without changing this module.
+    """
+
+    def register(func):
+        for key in keys:
+            RULES[key] = func
+        return func
+
+    return register
+
+
+class Conversion:
+    """The state of converting the tool.poetry section of one document."""
+
+    def __init__(
+        self,
+        new_toml: tk.TOMLDocument,
+        org_toml: tk.TOMLDocument,
+        project_dir: Path | str = ".",
+        files: frozenset[str] | None = None,
+        workspace: tuple[str, ...] = (),
+    ) -> None:
+        from pathlib import Path
+
+        self.new_toml = new_toml
+        self.org_toml = org_toml
+        self.project_dir = Path(project_dir)
+        self.files = files
+        self.workspace = workspace
+        self.project: dict = {}
+        self.groups: dict[str, list[str]] = {}
+        self.optional: dict[str, str] = {}
+        self.sources: dict[str, dict] = {}
+        self.indexes: list = []
+
+    @property
+    def poetry(self):
+        return self.org_toml["tool"]["poetry"]
+
+    def file_exists(self, name: str) -> bool:
+        """Whether project_dir holds name, from files when they are known.
+
+        files holds the names in project_dir, or for an archive the paths below
+        it of all members, which are then the only files there are.
+        """
+        if self.files is not None:
+            import posixpath
+
+            path = posixpath.normpath(name.replace(os.sep, "/"))
+            if path in self.files:
+                return True
+            if "/" not in path and path not in (".", ".."):
+                return False
+        return self.project_dir.joinpath(name).exists()
+
+    def run(self, keys: Iterable[str] | None = None) -> None:
+        """Apply the rules of keys (default: all) and write the results."""
+        selected = RULES.keys() if keys is None else set(keys)
+        poetry = self.poetry
+        for key in REQUIRED_KEYS:
+            if key in selected and key not in poetry:
+                raise ValueError(f"tool.poetry.{key} is missing")
+        items = list(poetry.items())
+        if "requires-python" not in poetry and (
+            python := poetry.get("dependencies", {}).get("python")
+        ):
+            items.append(("requires-python", python))
+        for key, value in items:
+            if key in selected and (convert := RULES.get(key)):
+                with stage(f"tool.poetry.{key}"):
+                    convert(self, key, value)
+        self.finish()
+
+    def finish(self) -> None:
+        if self.optional:
+            optional_deps = {}
+            for extra, deps in self.poetry.get("extras", {}).items():
+                if requirements := [
+                    f"{x}{self.optional[x]}" for x in deps if x in self.optional
+                ]:
+                    optional_deps[extra] = requirements
+            if optional_deps:
+                self.project["optional-dependencies"] = optional_deps
+        project = self.new_toml["project"]
+        for key in sorted(self.project, key=lambda k: _PROJECT_ORDER.get(k, 99)):
+            # Re-add rather than replace: a value put in the place of a table
+            # can end up below a subtable, where it would be read as part of it.
+            project.pop(key, None)
+            project.add(key, self.project[key])
+        if self.groups:
+            groups = self.new_toml.get("dependency-groups", tk.table())
+            for group, deps in self.groups.items():
+                groups[group] = deps
+            self.new_toml["dependency-groups"] = groups
+        parse_uv_deps_sources(self.new_toml, self.org_toml, self.sources)
+        for index in self.indexes:
+            uv_table(self.new_toml, "index").append(index)
+
+
+@rule(
+    "name",
+    "version",
+    "description",
+    "readme",
+    "keywords",
+    "classifiers",
+    "urls",
+    "scripts",
+)
+def copy_rule(conversion: Conversion, key: str, value) -> None:
+    conversion.project[key] = value
+
+
+@rule("authors", "maintainers")
+def people_rule(conversion: Conversion, key: str, value) -> None:
+    conversion.project[key] = (
+        people_array(key, value) if isinstance(value, list) else value
+    )
+
+
+@rule("license")
+def license_rule(conversion: Conversion, key: str, value) -> None:
+    conversion.project[key] = license_table(value, conversion.file_exists(value))
+
+
+@rule("requires-python")
+def requires_python_rule(conversion: Conversion, key: str, value) -> None:
+    conversion.project[key] = version_conversion(value)
+
+
+@rule("dependencies")
+def dependencies_rule(conversion: Conversion, key: str, value) -> None:
+    if not value:
         return
-    org_toml = tk.loads(project_file.read_text())
-    if not org_toml.get("tool", {}).get("poetry"):
-        print("Poetry section not found, are you certain this is a poetry project?")
+    uv_deps, uv_deps_optional, uv_deps_source = parse_packages(
+        value, conversion.workspace
+    )
+    array = tk.array()
+    if uv_deps:
+        for x in uv_deps:
+            array.add_line(x)
+        array.add_line(indent="")
+    conversion.project[key] = array
+    conversion.optional.update(uv_deps_optional)
+    conversion.sources.update(uv_deps_source)
+
+
+@rule("group")
+def group_rule(conversion: Conversion, key: str, value) -> None:
+    for group, data in value.items():
+        uv_deps, uv_deps_optional, uv_deps_source = parse_packages(
+            data.get("dependencies", {}), conversion.workspace
+        )
+        conversion.groups[group] = uv_deps
+        conversion.optional.update(uv_deps_optional)
+        conversion.sources.update(uv_deps_source)
+
+
+@rule("extras")
+def extras_rule(conversion: Conversion, key: str, value) -> None:
+    """The extras are written with the optional dependencies, in finish()."""
+
+
+@rule("plugins")
+def plugins_rule(conversion: Conversion, key: str, value) -> None:
+    entry_points = tk.table()
+    for plugin, data in value.items():
+        entry_points[plugin] = data
+    conversion.project["entry-points"] = entry_points
+
+
+# Poetry searches these sources after PyPI, uv searches every index before it.
+LATE_PRIORITIES = ("supplemental", "secondary")
+
+
+def disables_pypi(sources: Iterable[dict]) -> bool:
+    """Whether poetry leaves PyPI out: a default or primary source is given, not PyPI.
+
+    A source without a priority is a primary one, git sources are no indexes.
+    """
+    sources = [s for s in sources if not is_git_url(s.get("url", ""))]
+    return not any(
+        is_pypi(s.get("name", ""), s.get("url", "")) for s in sources
+    ) and any(s.get("priority", "primary") in ("default", "primary") for s in sources)
+
+
+@rule("source")
+def source_rule(conversion: Conversion, key: str, value) -> None:
+    """Add every poetry package source as a uv index, in the order of priority.
+
+    When poetry does not use PyPI, the last primary source becomes the default
+    index of uv, which replaces PyPI, unless there is a default source already.
+    """
+    indexes = []
+    for source in value:
+        url = source.get("url", "")
+        if is_git_url(url) or is_pypi(source["name"], url):
+            continue
+        index = tk.table().add("name", source["name"]).add("url", url)
+        match priority := source.get("priority", "primary"):
+            case "explicit":
+                index.add("explicit", True)
+            case "default":
+                index.add("default", True)
+            case _ if priority in LATE_PRIORITIES:
+                warn(
+                    f"Source {source['name']!r}: {priority} sources are searched "
+                    "before PyPI by uv"
+                )
+        indexes.append((priority, index))
+    if disables_pypi(value) and not any(p == "default" for p, _ in indexes):
+        primary = [index for p, index in indexes if p == "primary"]
+        primary[-1].add("default", True)
+    conversion.indexes.extend(index for _, index in indexes)
+
+
+# PEP 508 requirements and PEP 440 specifiers, checked before anything is written.
+_NAME = r"[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?"
+_RELEASE = r"v?(?:[0-9]+!)?[0-9]+(?:\.[0-9]+)*"
+_VERSION_TAIL = (
+    r"(?:[-_.]?(?:alpha|a|beta|b|preview|pre|c|rc)[-_.]?[0-9]*)?"
+    r"(?:-[0-9]+|[-_.]?(?:post|rev|r)[-_.]?[0-9]*)?"
+    r"(?:[-_.]?dev[-_.]?[0-9]*)?"
+)
+_LOCAL = r"(?:\+[A-Za-z0-9]+(?:[-_.][A-Za-z0-9]+)*)?"
+_SPEC = (
+    rf"(?:(?:==|!=)\s*(?:{_RELEASE}\.\*|{_RELEASE}{_VERSION_TAIL}{_LOCAL})"
+    rf"|~=\s*v?(?:[0-9]+!)?[0-9]+(?:\.[0-9]+)+{_VERSION_TAIL}"
+    rf"|(?:<=|>=|<|>)\s*{_RELEASE}{_VERSION_TAIL}"
+    r"|===\s*[^\s,;)]+)"
+)
+_SPECS = rf"{_SPEC}(?:\s*,\s*{_SPEC})*"
+_SPECIFIER_SET = rf"(?i)\s*(?:{_SPECS})?\s*"
+_PEP508 = (
+    r"(?i)"
+    rf"\s*{_NAME}\s*(?:\[\s*(?:{_NAME}(?:\s*,\s*{_NAME})*)?\s*\])?\s*"
+    rf"(?:@\s*\S+(?:\s+|$)|\(\s*{_SPECS}\s*\)\s*|{_SPECS}\s*)?"
+    r"(?:;(?P<marker>.*))?"
+)
+MARKER_VARIABLES = frozenset(
+    {
+        "python_version",
+        "python_full_version",
+        "os_name",
+        "sys_platform",
+        "platform_release",
+        "platform_system",
+        "platform_version",
+        "platform_machine",
+        "platform_python_implementation",
+        "implementation_name",
+        "implementation_version",
+        "extra",
+    }
+)
+_MARKER_TOKEN = (
+    r"\s*(?:(?P<op>===|==|!=|<=|>=|~=|<|>|not\s+in\b|in\b)|(?P<bool>and\b|or\b)"
+    r"""|(?P<paren>[()])|(?P<value>'[^']*'|"[^"]*"|[a-z_]+))"""
+)
+
+
+def _marker_tokens(marker: str) -> list[tuple[str, str]] | None:
+    tokens = []
+    pos = 0
+    while pos < len(marker.rstrip()):
+        if not (found := _regex(_MARKER_TOKEN).match(marker, pos)):
+            return None
+        kind = found.lastgroup
+        text = found[kind]
+        if kind == "value" and text[0] not in "'\"" and text not in MARKER_VARIABLES:
+            return None
+        tokens.append((kind, text))
+        pos = found.end()
+    return tokens
+
+
+@functools.cache
+def valid_marker(marker: str) -> bool:
+    """Whether marker is a PEP 508 environment marker expression."""
+    tokens = _marker_tokens(marker)
+    if not tokens:
+        return False
+    pos = 0
+
+    def expression() -> bool:
+        nonlocal pos
+        if not comparison():
+            return False
+        while pos < len(tokens) and tokens[pos][0] == "bool":
+            pos += 1
+            if not comparison():
+                return False
+        return True
+
+    def comparison() -> bool:
+        nonlocal pos
+        if tokens[pos : pos + 1] == [("paren", "(")]:
+            pos += 1
+            if not expression() or tokens[pos : pos + 1] != [("paren", ")")]:
+                return False
+            pos += 1
+            return True
+        kinds = [kind for kind, _ in tokens[pos : pos + 3]]
+        pos += 3
+        return kinds == ["value", "op", "value"]
+
+    return expression() and pos == len(tokens)
+
+
+@functools.cache
+def valid_requirement(requirement: str) -> bool:
+    """Whether requirement is a valid PEP 508 requirement string.
+
+    The results are cached, most requirements recur in many projects of a run.
+    """
+    if not (found := _regex(_PEP508).fullmatch(requirement)):
+        return False
+    return found["marker"] is None or valid_marker(found["marker"])
+
+
+@functools.cache
+def valid_specifier(specifier: str) -> bool:
+    """Whether specifier is a valid PEP 440 version specifier set."""
+    return _regex(_SPECIFIER_SET).fullmatch(specifier) is not None
+
+
+def validate(new_toml: tk.TOMLDocument) -> list[str]:
+    """Return an error for every invalid requirement or requires-python."""
+    project = new_toml.get("project", {})
+    requirements = [("project.dependencies", project.get("dependencies", []))]
+    for extra, deps in project.get("optional-dependencies", {}).items():
+        requirements.append((f"project.optional-dependencies.{extra}", deps))
+    for group, deps in new_toml.get("dependency-groups", {}).items():
+        requirements.append((f"dependency-groups.{group}", deps))
+    errors = []
+    for key, deps in requirements:
+        for requirement in deps:
+            # include-group tables are not requirements
+            if isinstance(requirement, str) and not valid_requirement(requirement):
+                errors.append(f"{key}: {requirement!r} is not a valid requirement")
+    python = project.get("requires-python")
+    if python is not None and not valid_specifier(python):
+        errors.append(f"project.requires-python: {python!r} is not a valid specifier")
+    return errors
+
+
+_profile: list[dict] | None = None
+_profile_memory = True
+_profile_stack: list[dict] = []
+
+
+@contextlib.contextmanager
+def profiling(enabled: bool = True, memory: bool = True) -> Iterator[list[dict] | None]:
+    """Record the wall time and peak memory of every stage run in this context.
+
+    Without memory the peak memory is not traced (and recorded as 0), which
+    would slow the stages down, for timing them only.
+    """
+    global _profile, _profile_memory
+    if not enabled:
+        yield None
         return
+    import tracemalloc
 
-    dry_run = args.n
-    project_dir = project_file.parent
-    backup_file = project_dir / f"{project_file.name}.org"
-    if dry_run:
-        output_file = Path(project_dir / "pyproject_temp_uv.toml")
-        print(f"Dry_run enabled. Output file: {output_file}")
-    else:
-        print(f"Replacing {project_file}\nBackup file : {backup_file}")
-        output_file = project_file
+    _profile = []
+    _profile_memory = memory
+    if memory:
+        tracemalloc.start()
+    try:
+        yield _profile
+    finally:
+        if memory:
+            tracemalloc.stop()
+        _profile = None
+        _profile_memory = True
 
-    new_toml = tk.document()
-    new_toml["project"] = tk.table()
 
-    poetry_section_specific(new_toml, org_toml, dir=project_dir)
-    build_system(new_toml, org_toml)
-    tools(new_toml, org_toml)
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    if _profile is None:
+        yield
+        return
+    import tracemalloc
+
+    frame = {"peak": 0}
+    _profile_stack.append(frame)
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    timestamp = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+        _profile_stack.pop()
+        if _profile_stack:
+            _profile_stack[-1]["peak"] = max(_profile_stack[-1]["peak"], peak)
+        _profile.append(
+            {
+                "stage": name,
+                "depth": len(_profile_stack),
+                "timestamp": timestamp,
+                "duration": duration,
+                "peak_memory": peak - start_memory,
+            }
+        )
+
 
-    if not dry_run:
-        project_file.rename(backup_file)
+_OPTION_DEFAULTS = {
+    "dry_run": False,
+    "check": False,
+    "verify": False,
+    "lock": False,
+    "cache_dir": None,  # Path
+    "cache_size": 100 * 1024 * 1024,
+    "profile_file": None,  # Path
+    "trace_file": None,  # Path
+    "log_file": None,  # str, "-" for stdout
+    "fsync": "batch",
+    "archive_dir": None,  # Path
+    "index_file": None,  # Path
+    "workspace": (),  # normalized package names
+}
+# The options which influence the generated output, so cached conversions are
+# invalidated when they change.
+CACHE_KEY_OPTIONS = ("workspace",)
+
+
+class Options(
+    namedtuple("Options", _OPTION_DEFAULTS, defaults=_OPTION_DEFAULTS.values())
+):
+    """Conversion settings shared by the single file and batch modes."""
+
+    __slots__ = ()
+
+    @property
+    def writes(self) -> bool:
+        return not (self.check or self.verify)
+
+    @property
+    def profiling(self) -> bool:
+        return bool(self.profile_file or self.trace_file)
+
+    @property
+    def fsync_each(self) -> bool:
+        """Whether every written file is synced, rather than all at the end."""
+        return self.fsync == "always"
+
+
+class ConversionResult:
+    """What processing one file did, as reported by the (worker) process."""
+
+    def __init__(
+        self,
+        path: Path,
+        outcome: str,
+        output_file: Path | None = None,
+        messages: list[str] | None = None,
+        cached: bool = False,
+        profile: list[dict] | None = None,
+        warnings: list[str] | None = None,
+        unconverted: list[str] | None = None,
+        output_hash: str | None = None,
+        duration: float = 0.0,
+        error: str | None = None,
+        index_record: dict | None = None,
+        unsynced: list[Path] | None = None,
+    ) -> None:
+        self.path = path
+        self.outcome = outcome
+        self.output_file = output_file
+        self.messages = messages or []
+        self.cached = cached
+        self.profile = profile
+        self.pid = os.getpid()
+        self.warnings = warnings or []
+        self.unconverted = unconverted or []
+        self.output_hash = output_hash
+        self.duration = duration
+        self.error = error
+        self.index_record = index_record
+        # Files the (worker) process wrote, for the parent to sync, see sync_outputs.
+        self.unsynced = unsynced or []
+
+    def __repr__(self) -> str:
+        return f"ConversionResult({str(self.path)!r}, {self.outcome!r})"
+
+
+SKIP_DIRS = {".git", ".hg", ".svn", ".venv", "venv", "node_modules", "__pycache__"}
+
+
+FSYNC_POLICIES = ("always", "batch", "never")
+# Files written in a batch run before they are synced, so the list of files to
+# sync stays bounded however many projects there are.
+SYNC_BATCH_SIZE = 256
+# The files written by this process and not synced yet, see sync_outputs.
+_unsynced: list[Path] = []
+
+
+@contextlib.contextmanager
+def atomic_file(
+    path: Path, fsync: bool | None = None, mode: int | None = None
+) -> Iterator[io.BufferedWriter]:
+    """Open a file that replaces path, so readers see either the old or the new content.
+
+    The data is written to a temporary file in the same directory, which is moved
+    in place with os.replace when the block exits without an exception. With fsync
+    the file and directory are synced first, when it is False path is recorded to
+    be synced by sync_outputs, when None (a cache file) it is not synced at all.
+    The file gets mode (as for a backup, the mode of the original), otherwise the
+    mode of path or, for a new file, the default one.
+    """
+    import tempfile
+
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_name, mode)
+        else:
+            with contextlib.suppress(OSError):
+                os.chmod(tmp_name, path.stat().st_mode)
+            if not path.exists():
+                os.chmod(tmp_name, 0o666 & ~_umask())
+        os.replace(tmp_name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_name)
+        raise
+    if fsync:
+        _fsync_directory(path.parent)
+    elif fsync is not None:
+        _unsynced.append(path)
+
+
+def _fsync_directory(directory: Path) -> None:
+    """Sync the entries of directory, where the platform supports it."""
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def atomic_write(
+    path: Path, data: bytes, fsync: bool | None = None, mode: int | None = None
+) -> None:
+    """Replace path with data, see atomic_file."""
+    with atomic_file(path, fsync, mode) as f:
+        f.write(data)
+
+
+@functools.cache
+def _umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def unsynced_files() -> list[Path]:
+    """Return and forget the files this process wrote without syncing them."""
+    files = _unsynced[:]
+    del _unsynced[: len(files)]
+    return files
+
+
+def sync_outputs(fsync: str, files: Iterable[Path]) -> None:
+    """Sync the written files and their directories at once, for the "batch" policy.
+
+    Only the given files are synced, not everything the system has to write back.
+    """
+    if fsync != "batch":
+        return
+    files = set(files)
+    for path in sorted(files):
+        with contextlib.suppress(FileNotFoundError):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    for directory in sorted({path.parent for path in files}):
+        _fsync_directory(directory)
 
-    output_file.write_text(tk.dumps(new_toml))
+
+def default_cache_dir() -> Path:
+    from pathlib import Path
+
+    if cache_dir := os.environ.get("CONVERT_POETRY2UV_CACHE_DIR"):
+        return Path(cache_dir)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "convert_poetry2uv"
+
+
+@functools.cache
+def converter_fingerprint() -> str:
+    """Identify the converter, so a new release or local change busts the cache."""
+    import hashlib
+    import importlib.metadata
+    from pathlib import Path
+
+    try:
+        version = importlib.metadata.version("convert-poetry2uv")
+    except importlib.metadata.PackageNotFoundError:
+        version = "unknown"
+    digest = hashlib.sha256(Path(__file__).read_bytes())
+    for key, func in sorted(RULES.items()):
+        digest.update(f"{key}={func.__module__}.{func.__qualname__}".encode())
+    return f"{version}-{digest.hexdigest()[:16]}"
+
+
+def cache_key(source: bytes, options: Options) -> str:
+    import hashlib
+
+    digest = hashlib.sha256(converter_fingerprint().encode())
+    for name in CACHE_KEY_OPTIONS:
+        digest.update(f"{name}={getattr(options, name)!r}".encode())
+    digest.update(source)
+    return digest.hexdigest()
+
+
+def cache_lookup(cache_dir: Path, key: str, project_dir: Path) -> dict | None:
+    entry_file = cache_dir / key[:2] / f"{key}.json"
+    try:
+        entry = json.loads(entry_file.read_text())
+    except (OSError, ValueError):
+        return None
+    if license := entry.get("license"):
+        name, exists = license
+        if project_dir.joinpath(name).exists() != exists:
+            return None
+    with contextlib.suppress(OSError):
+        os.utime(entry_file)
+    return entry
+
+
+def cache_store(cache_dir: Path, key: str, entry: dict) -> None:
+    entry_file = cache_dir / key[:2] / f"{key}.json"
+    try:
+        entry_file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(entry_file, json.dumps(entry).encode())
+    except OSError as exc:
+        warn(f"Unable to write cache entry {entry_file}: {exc}")
+
+
+# Seconds between the cache prunes of single file runs, see prune_cache_if_due.
+PRUNE_INTERVAL = 24 * 60 * 60
+
+
+def prune_cache(cache_dir: Path, max_size: int) -> None:
+    """Remove the least recently used cache entries until below max_size bytes."""
+    entries = []
+    total = 0
+    with contextlib.suppress(OSError):
+        for entry_file in cache_dir.glob("*/*.json"):
+            stat = entry_file.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry_file))
+            total += stat.st_size
+    for _, size, entry_file in sorted(entries):
+        if total <= max_size:
+            break
+        with contextlib.suppress(OSError):
+            entry_file.unlink()
+        total -= size
+    with contextlib.suppress(OSError):
+        cache_dir.joinpath("pruned").touch()
+
+
+def prune_cache_if_due(cache_dir: Path, max_size: int) -> None:
+    """prune_cache, unless it ran less than PRUNE_INTERVAL ago.
+
+    A single file run stats one marker file instead of every cache entry.
+    """
+    with contextlib.suppress(OSError):
+        if time.time() - cache_dir.joinpath("pruned").stat().st_mtime < PRUNE_INTERVAL:
+            return
+    prune_cache(cache_dir, max_size)
+
+
+def find_projects(patterns: Iterable[str]) -> Iterator[Path]:
+    """Yield every pyproject.toml found in the given files, directories or globs."""
+    from pathlib import Path
+
+    for pattern in patterns:
+        matches = (
+            glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        )
+        for match in sorted(matches):
+            path = Path(match)
+            if not path.is_dir():
+                yield path
+                continue
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+                if "pyproject.toml" in files:
+                    yield Path(root, "pyproject.toml")
+
+
+PROJECT_FILES = ("pyproject.toml", "poetry.lock")
+
+
+def _git(args: list[str], cwd: Path | str = ".") -> list[str]:
+    """Run git and return the NUL separated paths it prints."""
+    import subprocess
+
+    try:
+        completed = subprocess.run(
+            ["git", *args], cwd=cwd, capture_output=True, text=True, check=True
+        )
+    except FileNotFoundError:
+        raise ValueError("git is not installed") from None
+    except subprocess.CalledProcessError as exc:
+        raise ValueError(f"git {args[0]} failed: {exc.stderr.strip()}") from None
+    return [path for path in completed.stdout.split("\0") if path]
+
+
+def changed_projects(patterns: Iterable[str], ref: str) -> Iterator[Path]:
+    """Yield the pyproject.toml of every project changed since the git ref.
+
+    A project has changed when its pyproject.toml, poetry.lock or a LICENSE file
+    differs from ref, in a commit, the index or the working tree, or is untracked.
+    With "REF...", the merge-base of REF and HEAD is compared with the working
+    tree (git diff REF... itself would leave out uncommitted changes). Only
+    paths matching the patterns (as git pathspecs) are considered.
+    """
+    from pathlib import Path
+
+    pathspecs = ["--", *patterns]
+    toplevel = Path(_git(["rev-parse", "--show-toplevel"])[0].strip())
+    if ref.endswith("...") and ref != "...":
+        ref = _git(["merge-base", ref[:-3], "HEAD"])[0].strip()
+    changed = _git(["diff", "--name-only", "-z", ref, *pathspecs])
+    changed += _git(
+        ["ls-files", "--others", "--exclude-standard", "--full-name", "-z"] + pathspecs
+    )
+    project_dirs = set()
+    for name in changed:
+        path = Path(name)
+        if SKIP_DIRS.intersection(path.parts[:-1]):
+            continue
+        if is_project_file(path.name):
+            project_dirs.add(path.parent)
+    for project_dir in sorted(project_dirs):
+        project_file = toplevel / project_dir / "pyproject.toml"
+        if project_file.exists():
+            yield Path(os.path.relpath(project_file))
+
+
+def convert_document(
+    org_toml: tk.TOMLDocument,
+    project_dir: Path,
+    files: frozenset[str] | None = None,
+    workspace: tuple[str, ...] = (),
+) -> tk.TOMLDocument:
+    new_toml = tk.document()
+    new_toml["project"] = tk.table()
+
+    Conversion(new_toml, org_toml, project_dir, files, workspace).run()
+    with stage("build_system"):
+        build_system(new_toml, org_toml)
+    with stage("tools"):
+        tools(new_toml, org_toml)
+    return new_toml
+
+
+def _license_reference(new_toml: tk.TOMLDocument) -> list | None:
+    """Return the license file the output depends on and whether it exists."""
+    if not (license := new_toml["project"].get("license")):
+        return None
+    return [license.get("file") or license.get("text"), "file" in license]
+
+
+def process_project(project_file: Path, options: Options) -> ConversionResult:
+    """Check or convert one project, recording duration, warnings and profile."""
+    start = time.perf_counter()
+    with profiling(options.profiling) as records, collect_warnings() as warnings:
+        try:
+            if is_archive(project_file):
+                result = convert_archive(project_file, options)
+            elif options.check:
+                result = check_project(project_file, options)
+            elif options.verify:
+                result = verify_project(project_file, options)
+            else:
+                result = convert_project(project_file, options)
+        except Exception as exc:
+            print(f"{type(exc).__name__}: {exc}")
+            result = ConversionResult(project_file, "failed", error=str(exc))
+    result.profile = records
+    result.warnings = warnings
+    result.duration = time.perf_counter() - start
+    return result
+
+
+def conversion_entry(
+    text: str,
+    project_dir: Path,
+    files: frozenset[str] | None = None,
+    workspace: tuple[str, ...] = (),
+    index: bool = False,
+) -> dict:
+    """Convert text into the output and the facts it depends on, as cached.
+
+    files, the names in project_dir if known, saves looking up the license file.
+    workspace holds the package names of the uv workspace members, see
+    parse_packages. The index_record is only made with index, see converted_result.
+    """
+    with stage("split"):
+        split = SplitDocument.split(text)
+    with stage("tk.loads"):
+        org_toml = tk.loads(text if split is None else split.converted)
+    if not org_toml.get("tool", {}).get("poetry"):
+        return {"skipped": True}
+    unconverted = sorted(org_toml["tool"]["poetry"].keys() - POETRY_KEYS)
+    with collect_warnings() as warnings, stage("convert"):
+        new_toml = convert_document(org_toml, project_dir, files, workspace)
+    with stage("validate"):
+        if errors := validate(new_toml):
+            raise ValueError("Invalid output, " + "; ".join(errors))
+    record = None
+    if index:
+        with stage("index_record"):
+            record = index_record(org_toml["tool"]["poetry"].unwrap())
+    with stage("format"):
+        output = format_toml(new_toml)
+        if split is not None:
+            output = split.join(output)
+    return {
+        "output": output,
+        "license": _license_reference(new_toml),
+        "warnings": warnings,
+        "unconverted": unconverted,
+        "index_record": record,
+    }
+
+
+def convert(
+    text: str, project_dir: Path | str = ".", warnings: list[str] | None = None
+) -> str:
+    """Convert the text of a poetry pyproject.toml to the uv equivalent.
+
+    Nothing is written or printed, project_dir is only used to find the license
+    file. The warnings of the conversion are appended to warnings, if given.
+    Raises ValueError when the text has no poetry section.
+    """
+    from pathlib import Path
+
+    with collect_warnings(echo=False) as collected:
+        entry = conversion_entry(text, Path(project_dir))
+    if warnings is not None:
+        warnings.extend(collected)
+    if entry.get("skipped"):
+        raise ValueError("Poetry section not found")
+    return entry["output"]
+
+
+def pipe(filename: str, project_dir: Path | None = None) -> None:
+    """Convert filename, or stdin for "-", and write the result to stdout.
+
+    Nothing is written to disk, not even to the cache, and all messages go to
+    stderr, so the output can be piped into other tools. The license file is
+    looked up in project_dir, the directory of filename by default.
+    """
+    from pathlib import Path
+
+    if project_dir is None:
+        project_dir = Path(".") if filename == "-" else Path(filename).parent
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if filename == "-":
+                text = sys.stdin.read()
+            else:
+                text = Path(filename).read_text()
+            entry = conversion_entry(text, project_dir)
+        except Exception as exc:
+            raise SystemExit(f"{type(exc).__name__}: {exc}") from None
+    if entry.get("skipped"):
+        raise SystemExit(
+            "Poetry section not found, are you certain this is a poetry project?"
+        )
+    sys.stdout.write(entry["output"])
+
+
+def may_be_poetry(source: bytes) -> bool:
+    """Cheap test, without parsing, that rules out most non-poetry projects."""
+    return b"poetry" in source
+
+
+def convert_project(project_file: Path, options: Options) -> ConversionResult:
+    if not project_file.exists():
+        print(f"File {project_file} not found")
+        return ConversionResult(project_file, "missing")
+    with stage("read"):
+        source = project_file.read_bytes()
+    project_dir = project_file.parent
+
+    entry = key = None
+    if not may_be_poetry(source):
+        entry = {"skipped": True}
+    elif options.cache_dir:
+        with stage("cache_lookup"):
+            key = cache_key(source, options)
+            entry = cache_lookup(options.cache_dir, key, project_dir)
+    cached = entry is not None and key is not None
+    if entry is None:
+        entry = conversion_entry(
+            source.decode(),
+            project_dir,
+            None,
+            options.workspace,
+            options.index_file is not None,
+        )
+        if key:
+            with stage("cache_store"):
+                cache_store(options.cache_dir, key, entry)
+    for warning in entry.get("warnings", []) if cached else []:
+        warn(warning)
+
+    if entry.get("skipped"):
+        print("Poetry section not found, are you certain this is a poetry project?")
+        return ConversionResult(project_file, "skipped", cached=cached)
+
+    backup_file, output_file = output_files(project_file, options)
+    if options.dry_run:
+        print(f"Dry_run enabled. Output file: {output_file}")
+    else:
+        print(f"Replacing {project_file}\nBackup file : {backup_file}")
+    with stage("write"):
+        write_outputs(project_file, source, entry["output"], options)
+    if options.lock and (lock_file := project_dir / "poetry.lock").exists():
+        import tomllib
+
+        lock_output = lock_output_file(project_dir, options)
+        with stage("lock"):
+            translated = convert_lock(
+                lock_file,
+                tomllib.loads(entry["output"]),
+                lock_output,
+                options.fsync_each,
+            )
+        if translated:
+            print(f"Lock file translated: {lock_output}")
+    index_source = source if options.index_file else None
+    return converted_result(project_file, output_file, entry, cached, index_source)
+
+
+def output_files(project_file: Path, options: Options) -> tuple[Path, Path]:
+    """Return the backup and the output file of converting project_file."""
+    project_dir = project_file.parent
+    backup_file = project_dir / f"{project_file.name}.org"
+    if options.dry_run:
+        return backup_file, project_dir / "pyproject_temp_uv.toml"
+    return backup_file, project_file
+
+
+def lock_output_file(project_dir: Path, options: Options) -> Path:
+    return project_dir / ("uv_temp.lock" if options.dry_run else "uv.lock")
+
+
+def write_outputs(
+    project_file: Path, source: bytes, output: str, options: Options
+) -> Path:
+    """Write the backup (unless dry run) and the output, return the output file."""
+    backup_file, output_file = output_files(project_file, options)
+    if not options.dry_run:
+        mode = project_file.stat().st_mode
+        atomic_write(backup_file, source, options.fsync_each, mode)
+    atomic_write(output_file, output.encode(), options.fsync_each)
+    return output_file
+
+
+def converted_result(
+    project_file: Path,
+    output_file: Path,
+    entry: dict,
+    cached: bool,
+    index_source: bytes | None = None,
+) -> ConversionResult:
+    """Report a conversion, with its index_record when index_source is given.
+
+    A cache entry stored by a run without the dependency index has no
+    index_record, it is then made from index_source, the original text.
+    """
+    import hashlib
+
+    record = entry.get("index_record")
+    if record is None and index_source is not None:
+        import tomllib
+
+        record = index_record(tomllib.loads(index_source.decode())["tool"]["poetry"])
+    return ConversionResult(
+        project_file,
+        "converted",
+        output_file,
+        cached=cached,
+        unconverted=entry["unconverted"],
+        output_hash=hashlib.sha256(entry["output"].encode()).hexdigest(),
+        index_record=record,
+    )
+
+
+TAR_COMPRESSIONS = {".tar.gz": "gz", ".tgz": "gz", ".tar.bz2": "bz2", ".tar.xz": "xz"}
+ARCHIVE_SUFFIXES = (*TAR_COMPRESSIONS, ".tar", ".zip")
+# The outcomes of the projects in an archive, the worst gives the archive's.
+ARCHIVE_OUTCOMES = (
+    "skipped",
+    "ok",
+    "converted",
+    "unsupported",
+    "failed",
+)
+
+
+def is_archive(path: Path) -> bool:
+    return path.name.endswith(ARCHIVE_SUFFIXES)
+
+
+def _archive_suffix(archive: Path) -> str:
+    return next(suffix for suffix in ARCHIVE_SUFFIXES if archive.name.endswith(suffix))
+
+
+def is_safe_member(name: str) -> bool:
+    """Whether an archive member name stays inside the directory it is written to."""
+    import posixpath
+
+    path = posixpath.normpath(name.replace("\\", "/"))
+    # A drive letter, as in C:/pyproject.toml, is absolute on Windows.
+    return not (
+        posixpath.isabs(path)
+        or path == ".."
+        or path.startswith("../")
+        or path[1:2] == ":"
+    )
+
+
+def archive_projects(archive: Path) -> tuple[dict[str, bytes], dict[str, set[str]]]:
+    """Read the pyproject.toml members of an archive and the names per directory.
+
+    Tar archives are read as a stream. Only the pyproject.toml members are read,
+    the other members are skipped. Their names are enough to find license files.
+    Members with an absolute name or one leading out of the archive are skipped.
+    """
+    import posixpath
+
+    sources: dict[str, bytes] = {}
+    names: dict[str, set[str]] = {}
+
+    def add(name: str, read: Callable[[], bytes]) -> None:
+        if not is_safe_member(name):
+            warn(f"Member {name!r} is outside the archive, it is skipped")
+            return
+        directory, base = posixpath.split(name)
+        names.setdefault(directory, set()).add(base)
+        if base == "pyproject.toml":
+            sources[name] = read()
+
+    if archive.name.endswith(".zip"):
+        import zipfile
+
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    add(info.filename, functools.partial(zf.read, info))
+    else:
+        import tarfile
+
+        with tarfile.open(archive, "r|*") as tf:
+            for member in tf:
+                if member.isfile():
+                    add(member.name, tf.extractfile(member).read)
+    return sources, names
+
+
+def _rewrite_tar(archive: Path, f, replacements: dict[str, bytes]) -> None:
+    import copy
+    import tarfile
+
+    compression = TAR_COMPRESSIONS.get(_archive_suffix(archive), "")
+    with (
+        tarfile.open(archive, "r|*") as source,
+        tarfile.open(fileobj=f, mode=f"w|{compression}") as target,
+    ):
+        for member in source:
+            if member.name in replacements:
+                data = replacements[member.name]
+                member = copy.copy(member)
+                member.size = len(data)
+                member.pax_headers = {
+                    k: v for k, v in member.pax_headers.items() if k != "size"
+                }
+                target.addfile(member, io.BytesIO(data))
+            elif member.isfile():
+                target.addfile(member, source.extractfile(member))
+            else:
+                target.addfile(member)
+
+
+def _rewrite_zip(archive: Path, f, replacements: dict[str, bytes]) -> None:
+    import copy
+    import shutil
+    import zipfile
+
+    with zipfile.ZipFile(archive) as source, zipfile.ZipFile(f, "w") as target:
+        target.comment = source.comment
+        for info in source.infolist():
+            # Writing updates the offsets in the info, which belongs to source.
+            new_info = copy.copy(info)
+            if info.filename in replacements:
+                target.writestr(new_info, replacements[info.filename])
+            elif info.is_dir():
+                target.writestr(new_info, b"")
+            else:
+                with source.open(info) as src, target.open(new_info, "w") as dst:
+                    shutil.copyfileobj(src, dst)
+
+
+def archive_output_file(archive: Path, options: Options) -> Path:
+    """Return the rewritten archive, beside the original with -n."""
+    if not options.dry_run:
+        return archive
+    suffix = _archive_suffix(archive)
+    return archive.with_name(f"{archive.name[: -len(suffix)]}_temp_uv{suffix}")
+
+
+def archive_files(names: dict[str, set[str]], directory: str) -> frozenset[str]:
+    """Return the paths relative to directory of the archive members below it."""
+    prefix = f"{directory}/" if directory else ""
+    return frozenset(
+        f"{parent}/{name}"[len(prefix) :] if parent else name
+        for parent, bases in names.items()
+        if parent == directory or parent.startswith(prefix)
+        for name in bases
+    )
+
+
+def write_archive_outputs(
+    archive: Path, outputs: dict[str, str], options: Options
+) -> Path:
+    """Write converted members to options.archive_dir, or rewrite the archive.
+
+    The members are written to <archive_dir>/<archive name>/<member>. The
+    archive is rewritten member by member, without -n the original is kept
+    as <archive>.org.
+    """
+    if options.archive_dir:
+        suffix = _archive_suffix(archive)
+        output_dir = options.archive_dir / archive.name[: -len(suffix)]
+        for member, output in outputs.items():
+            output_file = output_dir.joinpath(member)
+            if not is_safe_member(member) or not output_file.resolve().is_relative_to(
+                output_dir.resolve()
+            ):
+                raise ValueError(f"Member {member!r} is outside {output_dir}")
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(output_file, output.encode(), options.fsync_each)
+        return output_dir
+    replacements = {member: output.encode() for member, output in outputs.items()}
+    output_file = archive_output_file(archive, options)
+    if not options.dry_run:
+        backup_archive(archive, options)
+    rewrite = _rewrite_zip if archive.name.endswith(".zip") else _rewrite_tar
+    with atomic_file(output_file, options.fsync_each) as f:
+        rewrite(archive, f, replacements)
+    return output_file
+
+
+def backup_archive(archive: Path, options: Options) -> None:
+    """Keep archive as <archive>.org, unless it already has a backup.
+
+    The backup is a hard link where possible, otherwise a copy. It is complete
+    before the archive is replaced, so the original is never missing.
+    """
+    backup_file = archive.with_name(f"{archive.name}.org")
+    if backup_file.exists():
+        warn(f"Backup file {backup_file} exists, it is kept")
+        return
+    try:
+        os.link(archive, backup_file)
+    except OSError:
+        import shutil
+
+        with (
+            archive.open("rb") as src,
+            atomic_file(backup_file, options.fsync_each, archive.stat().st_mode) as dst,
+        ):
+            shutil.copyfileobj(src, dst)
+
+
+def convert_archive(archive: Path, options: Options) -> ConversionResult:
+    """Check or convert the pyproject.toml files in a .tar(.gz) or .zip archive.
+
+    The result holds the outcome of each project in its messages, its own
+    outcome is the worst of them. The cache is not used, nor is poetry.lock.
+    """
+    if options.verify:
+        raise ValueError("--verify does not support archives")
+    if not archive.exists():
+        print(f"File {archive} not found")
+        return ConversionResult(archive, "missing")
+    import posixpath
+
+    with stage("read"):
+        sources, names = archive_projects(archive)
+    outcomes: dict[str, str] = {}
+    outputs: dict[str, str] = {}
+    unconverted: set[str] = set()
+    for member, source in sorted(sources.items()):
+        print(f"{archive}: {member}")
+        directory = posixpath.dirname(member)
+        try:
+            if options.check:
+                outcomes[member] = check_source(source)
+                continue
+            entry = {"skipped": True}
+            if may_be_poetry(source):
+                files = archive_files(names, directory)
+                # Not a directory on disk, only files finds the license file.
+                project_dir = archive.joinpath(directory)
+                entry = conversion_entry(source.decode(), project_dir, files)
+        except Exception as exc:
+            print(f"{type(exc).__name__}: {exc}")
+            outcomes[member] = "failed"
+            continue
+        if entry.get("skipped"):
+            outcomes[member] = "skipped"
+            continue
+        outcomes[member] = "converted"
+        outputs[member] = entry["output"]
+        unconverted.update(entry["unconverted"])
+    if not sources:
+        print(f"No pyproject.toml found in {archive}")
+    outcome = max(outcomes.values(), default="skipped", key=ARCHIVE_OUTCOMES.index)
+    result = ConversionResult(
+        archive,
+        outcome,
+        messages=[f"{member}: {outcome}" for member, outcome in outcomes.items()],
+        unconverted=sorted(unconverted),
+    )
+    if outputs and options.writes:
+        import hashlib
+
+        with stage("write"):
+            result.output_file = write_archive_outputs(archive, outputs, options)
+        print(f"Converted {len(outputs)} project(s) into {result.output_file}")
+        digest = hashlib.sha256()
+        for member, output in outputs.items():
+            digest.update(f"{member}\0{output}\0".encode())
+        result.output_hash = digest.hexdigest()
+    return result
+
+
+PYPI_SIMPLE = "https://pypi.org/simple"
+PYPI_FILES = "https://files.pythonhosted.org/packages"
+_NAME_SEPARATORS = r"[-_.]+"
+_BARE_KEY = r"^[A-Za-z0-9_-]+$"
+_REQUIREMENT = (
+    r"^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[(?P<extras>[^\]]*)\])?"
+    r"\s*(?P<specifier>[^;]*?)\s*(?:;\s*(?P<marker>.+))?$"
+)
+
+
+def normalize_name(name: str) -> str:
+    return _regex(_NAME_SEPARATORS).sub("-", name).lower()
+
+
+def parse_requirement(requirement: str) -> dict:
+    """Split a requirement string into the fields uv uses in its lock metadata."""
+    found = _regex(_REQUIREMENT).match(requirement)
+    parsed = {"name": normalize_name(found["name"])}
+    if found["extras"]:
+        parsed["extras"] = [x.strip() for x in found["extras"].split(",")]
+    if found["specifier"]:
+        parsed["specifier"] = found["specifier"]
+    if found["marker"]:
+        parsed["marker"] = found["marker"]
+    return parsed
+
+
+def _toml_value(value) -> str:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, list):
+        return f"[{', '.join(_toml_value(x) for x in value)}]"
+    if isinstance(value, dict):
+        items = (f"{_toml_key(k)} = {_toml_value(v)}" for k, v in value.items())
+        return f"{{ {', '.join(items)} }}"
+    return str(value)
+
+
+def _toml_key(key: str) -> str:
+    return key if _regex(_BARE_KEY).match(key) else json.dumps(key)
+
+
+def _toml_array(key: str, values: list) -> Iterator[str]:
+    yield f"{_toml_key(key)} = ["
+    for value in values:
+        yield f"    {_toml_value(value)},"
+    yield "]"
+
+
+FORMAT_WIDTH = 88
+FORMAT_INDENT = "    "
+# The top-level tables in the order they are written, others follow.
+TABLE_ORDER = ("project", "dependency-groups", "build-system", "tool")
+_FORMAT_ORDER = {(): TABLE_ORDER, ("project",): PROJECT_KEYS}
+
+
+def _requirement_array(path: tuple[str, ...]) -> bool:
+    """Requirement lists are written one per line, the way uv writes them."""
+    return (
+        path == ("project", "dependencies")
+        or path[:2] == ("project", "optional-dependencies")
+        or (len(path) == 2 and path[0] == "dependency-groups")
+    )
+
+
+def _trailing_comment(item) -> str:
+    comment = item.trivia.comment if isinstance(item, tk.items.Item) else ""
+    return f"  {comment}" if comment else ""
+
+
+def _format_body(table) -> list[tuple[str | None, Any, bool]]:
+    """The (key, item, dotted) entries of a table, None keys for comments."""
+    if isinstance(table, tk.items.Table | tk.items.InlineTable):
+        table = table.value
+    if not isinstance(table, tk.container.Container):
+        return [(key, tk.item(value), False) for key, value in table.items()]
+    entries = []
+    for key, item in table.body:
+        if key is not None:
+            entries.append((key.key, item, key.is_dotted()))
+        elif isinstance(item, tk.items.Comment):
+            entries.append((None, item, False))
+    return entries
+
+
+def _format_value(value) -> str:
+    """The value on a single line, keeping the spelling of strings and numbers."""
+    if isinstance(value, dict):
+        items = [f"{_toml_key(k)} = {_format_value(v)}" for k, v in value.items()]
+        return f"{{ {', '.join(items)} }}" if items else "{}"
+    if isinstance(value, list):
+        items = [text for text, _ in _array_entries(value) if text is not None]
+        return f"[{', '.join(items)}]"
+    if not isinstance(value, tk.items.Item):
+        value = tk.item(value)
+    return value.as_string()
+
+
+def _array_entries(array) -> list[tuple[str | None, str]]:
+    """The values of an array with the comments beside them, None for lone ones."""
+    if not isinstance(array, tk.items.Array):
+        return [(_format_value(value), "") for value in array]
+    entries = []
+    # The item groups hold the comments, and inline tables as items rather
+    # than the bare containers indexing the array can trip over.
+    for group in array._value:
+        value = group.value
+        if value is None or isinstance(value, tk.items.Null | tk.items.Whitespace):
+            value = None
+        else:
+            value = _format_value(value)
+        comment = group.comment.trivia.comment if group.comment else ""
+        if value is not None or comment:
+            entries.append((value, comment))
+    return entries
+
+
+def _key_value_lines(path: tuple[str, ...], key: str, value) -> list[str]:
+    comment = _trailing_comment(value)
+    line = f"{key} = {_format_value(value)}"
+    if not isinstance(value, list) or not (entries := _array_entries(value)):
+        return [line + comment]
+    expand = _requirement_array(path) or any(note for _, note in entries)
+    if not expand and len(line + comment) <= FORMAT_WIDTH:
+        return [line + comment]
+    lines = [f"{key} = ["]
+    for text, note in entries:
+        note = f"  {note}" if note and text is not None else note
+        lines.append(FORMAT_INDENT + (note if text is None else f"{text},{note}"))
+    return [*lines, f"]{comment}"]
+
+
+def _format_table(
+    table, path: tuple[str, ...], header: str | None, blocks: list[list[str]]
+) -> None:
+    """Add the blocks of a table and its sub-tables, in document order."""
+    order = _FORMAT_ORDER.get(path, ())
+    body = _format_body(table)
+    if order:
+        rank = {key: index for index, key in enumerate(order)}
+        body.sort(key=lambda entry: rank.get(entry[0], len(order)))
+    lines, tables = [], []
+    pending = [("", path, entry) for entry in body]
+    while pending:
+        prefix, base, (name, item, dotted) = pending.pop(0)
+        if name is None:
+            lines.append(item.trivia.comment)
+            continue
+        key = prefix + _toml_key(name)
+        if dotted and isinstance(item, tk.items.Table):
+            # Dotted keys stay in their table, written out as dotted keys.
+            nested = [(f"{key}.", (*base, name), e) for e in _format_body(item)]
+            pending[:0] = nested
+        elif isinstance(item, tk.items.Table | tk.items.AoT):
+            tables.append((name, item))
+        else:
+            lines.extend(_key_value_lines((*base, name), key, item))
+    comment = _trailing_comment(table) if header else ""
+    if header and (lines or comment or not tables):
+        blocks.append([header + comment, *lines])
+    elif lines:
+        blocks.append(lines)
+    for name, item in tables:
+        sub_path = (*path, name)
+        dotted_path = ".".join(_toml_key(key) for key in sub_path)
+        if isinstance(item, tk.items.AoT):
+            for element in item.body:
+                _format_table(element, sub_path, f"[[{dotted_path}]]", blocks)
+        else:
+            _format_table(item, sub_path, f"[{dotted_path}]", blocks)
+
+
+def format_toml(document: tk.TOMLDocument) -> str:
+    """Write a document in one canonical layout, whatever layout it was built in.
+
+    Tables are separated by a single blank line, top-level tables follow
+    TABLE_ORDER and [project] follows PROJECT_KEYS. Arrays are written one item
+    per line when they hold requirements or comments or do not fit FORMAT_WIDTH,
+    inline tables as { key = value }. Comments and the spelling of values are
+    kept, so the same input always gives the same bytes.
+    """
+    blocks: list[list[str]] = []
+    _format_table(document, (), None, blocks)
+    return "\n\n".join("\n".join(block) for block in blocks) + "\n"
+
+
+_TOML_SPECIAL = r"""[#"'\[\]{}\n]"""
+_KEY_PART = r"""(?:[A-Za-z0-9_-]+|"(?:[^"\\\n]|\\.)*"|'[^'\n]*')"""
+_HEADER = (
+    rf"[ \t]*(\[\[?)[ \t]*({_KEY_PART}(?:[ \t]*\.[ \t]*{_KEY_PART})*)[ \t]*(\]\]?)"
+    r"[ \t]*(?:#[^\n]*)?(?=\n|\Z)"
+)
+_LEADING_BLANK_LINES = r"\A(?:[ \t]*\n)+"
+
+
+def _header_key(header: str) -> tuple[str, ...] | None:
+    parts = []
+    for part in _regex(_KEY_PART).findall(header):
+        if part[0] == '"':
+            try:
+                part = json.loads(part)
+            except ValueError:
+                return None
+        elif part[0] == "'":
+            part = part[1:-1]
+        parts.append(part)
+    return tuple(parts)
+
+
+def _escaped(text: str, pos: int) -> bool:
+    start = pos
+    while pos > 0 and text[pos - 1] == "\\":
+        pos -= 1
+    return (start - pos) % 2 == 1
+
+
+def _string_end(text: str, pos: int) -> int | None:
+    """Return the end of the string starting at pos, None if it is not closed."""
+    quote = text[pos]
+    if text.startswith(quote * 3, pos):
+        end = pos + 3
+        while (end := text.find(quote * 3, end)) >= 0:
+            if quote == '"' and _escaped(text, end):
+                end += 1
+                continue
+            # Up to two quotes before the closing ones belong to the string.
+            run = 3
+            while run < 5 and text.startswith(quote, end + run):
+                run += 1
+            return end + run
+        return None
+    end = pos + 1
+    while (end := text.find(quote, end)) >= 0 and quote == '"' and _escaped(text, end):
+        end += 1
+    if end < 0 or "\n" in text[pos:end]:
+        return None
+    return end + 1
+
+
+def _comments_start(text: str, start: int, end: int) -> int:
+    """Return where the comment lines right at the end of text[start:end] begin."""
+    while end > start:
+        line_start = max(start, text.rfind("\n", start, end - 1) + 1)
+        if line_start == start or not text[line_start:end].lstrip().startswith("#"):
+            break
+        end = line_start
+    return end
+
+
+def toml_tables(text: str) -> list[tuple[tuple[str, ...] | None, str]] | None:
+    """Split TOML text into its tables without parsing the values.
+
+    Return (key of the table header, text of the table) pairs, None as the key
+    of the text before the first header. Comments just above a header belong to
+    its table. Return None for text the scanner does not follow, which then has
+    to be parsed in full.
+    """
+    if "\r" in text:
+        return None
+    starts: list[tuple[tuple[str, ...] | None, int]] = [(None, 0)]
+    depth = pos = 0
+    line_start = True
+    while True:
+        if line_start and depth == 0 and (header := _regex(_HEADER).match(text, pos)):
+            key = _header_key(header[2])
+            if key is None or len(header[1]) != len(header[3]):
+                return None
+            starts.append((key, pos))
+            pos = header.end()
+        if not (special := _regex(_TOML_SPECIAL).search(text, pos)):
+            break
+        pos = special.start()
+        line_start = False
+        match text[pos]:
+            case "\n":
+                pos += 1
+                line_start = True
+            case "#":
+                pos = newline if (newline := text.find("\n", pos)) >= 0 else len(text)
+            case '"' | "'":
+                if (end := _string_end(text, pos)) is None:
+                    return None
+                pos = end
+            case "[" | "{":
+                depth += 1
+                pos += 1
+            case _:
+                depth -= 1
+                pos += 1
+                if depth < 0:
+                    return None
+    if depth:
+        return None
+    cuts = [0]
+    for index in range(1, len(starts)):
+        start = starts[index][1]
+        if index > 1:
+            start = _comments_start(text, starts[index - 1][1], start)
+        cuts.append(start)
+    cuts.append(len(text))
+    return [(key, text[cuts[i] : cuts[i + 1]]) for i, (key, _) in enumerate(starts)]
+
+
+class SplitDocument:
+    """The parts of a pyproject.toml, for converting only what has to be.
+
+    Only converted, the [tool.poetry] and [build-system] tables (and [tool.uv],
+    which the conversion may add to), is parsed with tomlkit. The other
+    [tool.*] tables are passed through as text, the comments in preamble,
+    before the first table, are kept. [project], [dependency-groups] and
+    other top-level tables are replaced by the conversion.
+    """
+
+    def __init__(self, preamble: str, converted: str, passed: list[str]) -> None:
+        self.preamble = preamble
+        self.converted = converted
+        self.passed = passed
+
+    @classmethod
+    def split(cls, text: str) -> SplitDocument | None:
+        """Split text, None if it has to be parsed in full."""
+        if (tables := toml_tables(text)) is None:
+            return None
+        preamble = tables[0][1]
+        if any(
+            line.strip() and not line.lstrip().startswith("#")
+            for line in preamble.splitlines()
+        ):
+            return None
+        converted, passed = [], []
+        for key, table in tables[1:]:
+            if key[0] == "build-system" or key[:2] in (
+                ("tool", "poetry"),
+                ("tool", "uv"),
+            ):
+                converted.append(table)
+            elif key == ("tool",):
+                return None
+            elif key[0] == "tool":
+                passed.append(table)
+        return cls(preamble, "".join(converted), passed)
+
+    def join(self, output: str) -> str:
+        """The converted output with the preamble and passed tables around it."""
+        blocks = [self.preamble, output, *self.passed]
+        blocks = [
+            _regex(_LEADING_BLANK_LINES).sub("", block).rstrip() for block in blocks
+        ]
+        return "\n\n".join(block for block in blocks if block) + "\n"
+
+
+def _lock_source(package: dict) -> dict | None:
+    """Map a poetry.lock package source to its uv.lock form, None if unsupported."""
+    source = package.get("source")
+    if not source:
+        return {"registry": PYPI_SIMPLE}
+    match source.get("type"):
+        case "git":
+            url = f"{source['url']}?rev={source.get('reference', 'HEAD')}"
+            if resolved := source.get("resolved_reference"):
+                url = f"{url}#{resolved}"
+            return {"git": url}
+        case "directory":
+            kind = "editable" if package.get("develop") else "directory"
+            return {kind: source["url"]}
+        case "file":
+            return {"path": source["url"]}
+        case "url":
+            return {"url": source["url"]}
+    return None
+
+
+def _lock_distributions(package: dict, source: dict) -> Iterator[str]:
+    """Yield the sdist and wheels lines of a registry or url package."""
+    sdist = None
+    wheels = []
+    for dist in package.get("files", []):
+        filename = dist["file"]
+        if "registry" in source and filename.endswith(".whl"):
+            name, tag = filename.split("-")[0], filename.split("-")[-3]
+            url = f"{PYPI_FILES}/{tag}/{name[0]}/{name}/{filename}"
+        elif "registry" in source:
+            name = filename.split(f"-{package['version']}")[0]
+            url = f"{PYPI_FILES}/source/{name[0]}/{name}/{filename}"
+        else:
+            url = source["url"]
+        entry = {"url": url, "hash": dist["hash"]}
+        if filename.endswith(".whl"):
+            wheels.append(entry)
+        else:
+            sdist = entry
+    if sdist:
+        yield f"sdist = {_toml_value(sdist)}"
+    if wheels:
+        yield from _toml_array("wheels", wheels)
+
+
+# The name a requirement of poetry.lock extras starts with, as in "PySocks (>=1.5)".
+_EXTRA_REQUIREMENT = r"[A-Za-z0-9][A-Za-z0-9._-]*"
+
+
+def _lock_dependencies(deps: dict, index: dict[str, dict]) -> list[dict]:
+    locked = {}
+    for name, constraints in deps.items():
+        name = normalize_name(name)
+        if name not in index:
+            continue
+        if not isinstance(constraints, list):
+            constraints = [constraints]
+        markers = set()
+        extras = set()
+        for constraint in constraints:
+            if isinstance(constraint, dict):
+                if constraint.get("optional"):
+                    continue
+                markers.add(constraint.get("markers", "").replace('"', "'"))
+                extras.update(constraint.get("extras", []))
+            else:
+                markers.add("")
+        if not markers:
+            continue
+        locked[name] = {"name": name}
+        if extras:
+            locked[name]["extra"] = sorted(extras)
+        if "" not in markers:
+            locked[name]["marker"] = " or ".join(sorted(markers))
+    return [locked[name] for name in sorted(locked)]
+
+
+def _lock_extras(extras: dict, index: dict[str, dict]) -> Iterator[str]:
+    """Yield the optional-dependencies table of a package, from its poetry extras."""
+    lines = []
+    for extra, requirements in sorted(extras.items()):
+        names = {
+            normalize_name(_regex(_EXTRA_REQUIREMENT).match(r)[0]) for r in requirements
+        }
+        if deps := [{"name": name} for name in sorted(names) if name in index]:
+            lines.extend(_toml_array(extra, deps))
+    if lines:
+        yield ""
+        yield "[package.optional-dependencies]"
+        yield from lines
+
+
+def _root_package_lines(pyproject: dict, index: dict[str, dict]) -> Iterator[str]:
+    project = pyproject["project"]
+    requirements = [parse_requirement(x) for x in project.get("dependencies", [])]
+    groups = {
+        group: [parse_requirement(x) for x in deps]
+        for group, deps in pyproject.get("dependency-groups", {}).items()
+    }
+    kind = "editable" if "build-system" in pyproject else "virtual"
+    yield "[[package]]"
+    yield f"name = {_toml_value(normalize_name(project['name']))}"
+    yield f"version = {_toml_value(project['version'])}"
+    yield f"source = {_toml_value({kind: '.'})}"
+    if requirements:
+        deps = [{"name": r["name"]} for r in requirements if r["name"] in index]
+        yield from _toml_array("dependencies", deps)
+    if groups:
+        yield ""
+        yield "[package.dev-dependencies]"
+        for group, reqs in groups.items():
+            yield from _toml_array(
+                group, [{"name": r["name"]} for r in reqs if r["name"] in index]
+            )
+    yield ""
+    yield "[package.metadata]"
+    yield f"requires-dist = {_toml_value(requirements)}"
+    if groups:
+        yield ""
+        yield "[package.metadata.requires-dev]"
+        for group, reqs in groups.items():
+            yield from _toml_array(group, reqs)
+
+
+def convert_lock(
+    lock_file: Path, pyproject: dict, output_file: Path, fsync: bool = False
+) -> bool:
+    """Translate poetry.lock into uv.lock keeping its pins, hashes and sources.
+
+    Packages are indexed by normalized name once, so the translation is linear in
+    the number of locked packages. Poetry does not record the download url of
+    files on private indexes, and a package locked at several versions (for
+    different markers) needs uv's resolution forks; those lock files are reported
+    and left alone, for ``uv lock`` to resolve. The output is written as
+    atomic_file does, with fsync.
+    """
+    import tomllib
+
+    with lock_file.open("rb") as f:
+        poetry_lock = tomllib.load(f)
+    index = {}
+    for package in poetry_lock.get("package", []):
+        if (name := normalize_name(package["name"])) in index:
+            warn(
+                f"Unable to translate {lock_file}: {name} is locked at several versions"
+            )
+            return False
+        index[name] = package
+    sources = {}
+    for name, package in index.items():
+        if (source := _lock_source(package)) is None:
+            warn(f"Unable to translate {lock_file}: unsupported source for {name}")
+            return False
+        sources[name] = source
+
+    project_name = normalize_name(pyproject["project"]["name"])
+    index.pop(project_name, None)
+    with atomic_file(output_file, fsync) as binary:
+        f = io.TextIOWrapper(binary, encoding="utf-8")
+        f.write("version = 1\n")
+        if requires_python := pyproject["project"].get("requires-python"):
+            f.write(f"requires-python = {_toml_value(requires_python)}\n")
+        packages = [(name, None) for name in index]
+        packages.append((project_name, pyproject))
+        for name, root in sorted(packages, key=lambda x: x[0]):
+            f.write("\n")
+            lines = _root_package_lines(root, index) if root else None
+            if lines is None:
+                package = index[name]
+                lines = [
+                    "[[package]]",
+                    f"name = {_toml_value(name)}",
+                    f"version = {_toml_value(package['version'])}",
+                    f"source = {_toml_value(sources[name])}",
+                ]
+                if "git" not in sources[name]:
+                    lines.extend(_lock_distributions(package, sources[name]))
+                if deps := _lock_dependencies(package.get("dependencies", {}), index):
+                    lines.extend(_toml_array("dependencies", deps))
+                lines.extend(_lock_extras(package.get("extras", {}), index))
+            for line in lines:
+                f.write(f"{line}\n")
+        # Flushes, and leaves closing the file to atomic_file.
+        f.detach()
+    return True
+
+
+# The tool.poetry keys which are converted, including those of custom rules.
+POETRY_KEYS = RULES.keys()
+UNSUPPORTED_DEPENDENCY_KEYS = ("path", "url", "develop", "python")
+OUTCOME_SEVERITY = {"ok": 0, "info": 0, "unsupported": 1, "failed": 2}
+FAILED_OUTCOMES = ("failed", "missing", "unsupported", "mismatch")
+
+
+def is_git_url(url: str) -> bool:
+    return url.startswith(("git+", "git@", "git://", "ssh://")) or url.endswith(".git")
+
+
+def analyze_dependencies(
+    deps: dict,
+    section: str,
+    sources: dict[str, dict],
+    workspace: Iterable[str] = (),
+) -> Iterator[tuple[str, str]]:
+    """Yield (level, message) findings for dependencies, as parse_packages sees them."""
+    for name, version in deps.items():
+        if name == "python":
+            continue
+        where = f"{section} dependency {name!r}"
+        if isinstance(version, list):
+            yield "unsupported", f"{where}: multiple constraints are not converted"
+            continue
+        if is_workspace_dependency(name, version, workspace):
+            version = {k: v for k, v in version.items() if k not in ("path", "develop")}
+        if isinstance(version, dict):
+            for key in UNSUPPORTED_DEPENDENCY_KEYS:
+                if key in version:
+                    yield "unsupported", f"{where}: {key} is not converted"
+            if {"path", "url"} & version.keys() and not {
+                "source",
+                "git",
+            } & version.keys():
+                yield "unsupported", f"{where}: dependency is dropped"
+                continue
+            if (
+                (source := version.get("source"))
+                and source not in sources
+                and not is_pypi(source)
+            ):
+                yield "failed", f"{where}: source {source!r} is not defined"
+            version = version.get("version", "*")
+        try:
+            _, warning = translate_constraint(version)
+        except ConstraintError as exc:
+            yield "failed", f"{where}: {exc}"
+            continue
+        if warning:
+            yield "info", f"{where}: {warning}"
+
+
+def analyze(pyproject: dict, workspace: Iterable[str] = ()) -> list[tuple[str, str]]:
+    """Report what converting a (tomllib parsed) pyproject would do.
+
+    workspace holds the normalized package names of the uv workspace members.
+    """
+    poetry = pyproject["tool"]["poetry"]
+    findings = []
+    for key in ("name", "version"):
+        if key not in poetry:
+            findings.append(("failed", f"{key} is missing"))
+    if python := poetry.get("requires-python") or poetry.get("dependencies", {}).get(
+        "python"
+    ):
+        try:
+            translate_constraint(python)
+        except ConstraintError as exc:
+            findings.append(("failed", f"requires-python: {exc}"))
+    sources = {source.get("name"): source for source in poetry.get("source", [])}
+    findings.extend(
+        analyze_dependencies(poetry.get("dependencies", {}), "main", sources, workspace)
+    )
+    for group, data in poetry.get("group", {}).items():
+        findings.extend(
+            analyze_dependencies(
+                data.get("dependencies", {}), group, sources, workspace
+            )
+        )
+    for source in poetry.get("source", []):
+        if (priority := source.get("priority")) in LATE_PRIORITIES:
+            findings.append(
+                (
+                    "unsupported",
+                    f"source {source.get('name')!r}: {priority} sources are "
+                    "searched before PyPI by uv",
+                )
+            )
+    for key in sorted(poetry.keys() - POETRY_KEYS):
+        findings.append(("unsupported", f"tool.poetry.{key} is not converted"))
+    if "poetry" in pyproject.get("build-system", {}).get("build-backend", ""):
+        findings.append(("info", "poetry build system is replaced with hatchling"))
+    return findings
+
+
+def check_project(project_file: Path, options: Options) -> ConversionResult:
+    if not project_file.exists():
+        print(f"File {project_file} not found")
+        return ConversionResult(project_file, "missing")
+    outcome = check_source(project_file.read_bytes(), options.workspace)
+    return ConversionResult(project_file, outcome)
+
+
+def check_source(source: bytes, workspace: Iterable[str] = ()) -> str:
+    """Report the findings for the text of a pyproject.toml, return the outcome."""
+    if not may_be_poetry(source):
+        return "skipped"
+    import tomllib
+
+    pyproject = tomllib.loads(source.decode())
+    if not pyproject.get("tool", {}).get("poetry"):
+        return "skipped"
+    findings = analyze(pyproject, workspace)
+    for level, message in findings:
+        warn(f"{level}: {message}")
+    outcome = max(
+        (level for level, _ in findings), default="ok", key=OUTCOME_SEVERITY.get
+    )
+    return "ok" if outcome == "info" else outcome
+
+
+def _specifier(constraint: str) -> str:
+    """Return the normalized PEP 440 specifier of a poetry constraint."""
+    try:
+        constraint = translate_constraint(constraint)[0]
+    except ConstraintError:
+        pass
+    return ",".join(sorted(x.strip() for x in constraint.split(",") if x.strip()))
+
+
+def _requirement_value(extras: Iterable[str], variants: Iterable[str]) -> str:
+    extras = sorted(set(extras))
+    return (f"[{','.join(extras)}]" if extras else "") + " | ".join(sorted(variants))
+
+
+def _poetry_requirement(version) -> tuple[list[str], str]:
+    """Return the extras and the specifier/marker variant of a poetry dependency."""
+    if isinstance(version, str):
+        return [], _specifier(version)
+    if isinstance(version, list):
+        return [], f"multiple constraints {version!r}"
+    variant = _specifier(version.get("version", "*"))
+    for kind in ("path", "url"):
+        if kind in version:
+            variant = f"{kind} {version[kind]}"
+    markers = [version["markers"]] if "markers" in version else []
+    if "python" in version:
+        markers.append(f"python {version['python']}")
+    if markers:
+        variant += " ; " + " and ".join(" ".join(m.split()) for m in markers)
+    return list(version.get("extras", [])), variant
+
+
+def normalize_poetry(pyproject: dict, workspace: Iterable[str] = ()) -> dict[str, str]:
+    """Flatten what a (tomllib parsed) poetry project declares, see verify."""
+    poetry = pyproject["tool"]["poetry"]
+    normalized = {key: str(poetry[key]) for key in ("name", "version") if key in poetry}
+    if python := poetry.get("requires-python") or poetry.get("dependencies", {}).get(
+        "python"
+    ):
+        normalized["requires-python"] = _specifier(python)
+    sources = index_sources(pyproject)
+    extras = {
+        extra: {normalize_name(name) for name in names}
+        for extra, names in poetry.get("extras", {}).items()
+    }
+    sections = [("dependencies", poetry.get("dependencies", {}))]
+    sections += [
+        (f"dependency-groups.{group}", data.get("dependencies", {}))
+        for group, data in poetry.get("group", {}).items()
+    ]
+    for section, deps in sections:
+        for name, version in deps.items():
+            if name == "python":
+                continue
+            member = is_workspace_dependency(name, version, workspace)
+            if member:
+                version = {k: v for k, v in version.items() if k != "path"}
+            name = normalize_name(name)
+            dep_extras, variant = _poetry_requirement(version)
+            value = _requirement_value(dep_extras, [variant])
+            if isinstance(version, dict) and version.get("optional"):
+                keys = [
+                    f"optional-dependencies.{extra}: {name}"
+                    for extra, names in extras.items()
+                    if name in names
+                ] or [f"optional-dependencies: {name}"]
+            else:
+                keys = [f"{section}: {name}"]
+            normalized.update(dict.fromkeys(keys, value))
+            if not isinstance(version, dict):
+                continue
+            if member:
+                source = {"workspace": True}
+            elif git := version.get("git"):
+                source = {"git": git} | {
+                    key: version[key] for key in GIT_REFERENCES if key in version
+                }
+            elif index := version.get("source"):
+                url = sources.get(index, {}).get("url", "")
+                if is_pypi(index, url):
+                    continue
+                source = {"git": url} if is_git_url(url) else {"index": index}
+            else:
+                continue
+            normalized[f"tool.uv.sources: {name}"] = json.dumps(source, sort_keys=True)
+    for name, value in poetry.get("scripts", {}).items():
+        normalized[f"scripts: {name}"] = json.dumps(value, sort_keys=True)
+    for group, entry_points in poetry.get("plugins", {}).items():
+        for name, value in entry_points.items():
+            normalized[f"entry-points.{group}: {name}"] = json.dumps(value)
+    return normalized
+
+
+def normalize_uv(pyproject: dict) -> dict[str, str]:
+    """Flatten what a (tomllib parsed) uv project declares, see verify."""
+    project = pyproject.get("project", {})
+    normalized = {
+        key: str(project[key]) for key in ("name", "version") if key in project
+    }
+    if python := project.get("requires-python"):
+        normalized["requires-python"] = _specifier(python)
+    sections = [("dependencies", project.get("dependencies", []))]
+    sections += [
+        (f"optional-dependencies.{extra}", deps)
+        for extra, deps in project.get("optional-dependencies", {}).items()
+    ]
+    sections += [
+        (f"dependency-groups.{group}", deps)
+        for group, deps in pyproject.get("dependency-groups", {}).items()
+    ]
+    for section, deps in sections:
+        requirements: dict[str, tuple[set, set]] = {}
+        for requirement in deps:
+            if not isinstance(requirement, str):
+                continue
+            parsed = parse_requirement(requirement)
+            variant = _specifier(parsed.get("specifier", ""))
+            if marker := parsed.get("marker"):
+                variant += " ; " + " ".join(marker.split())
+            extras, variants = requirements.setdefault(parsed["name"], (set(), set()))
+            extras.update(parsed.get("extras", []))
+            variants.add(variant)
+        for name, (extras, variants) in requirements.items():
+            normalized[f"{section}: {name}"] = _requirement_value(extras, variants)
+    uv_sources = pyproject.get("tool", {}).get("uv", {}).get("sources", {})
+    for name, source in uv_sources.items():
+        key = f"tool.uv.sources: {normalize_name(name)}"
+        normalized[key] = json.dumps(source, sort_keys=True)
+    for name, value in project.get("scripts", {}).items():
+        normalized[f"scripts: {name}"] = json.dumps(value, sort_keys=True)
+    for group, entry_points in project.get("entry-points", {}).items():
+        for name, value in entry_points.items():
+            normalized[f"entry-points.{group}: {name}"] = json.dumps(value)
+    return normalized
+
+
+def verify(poetry: dict, uv: dict, workspace: Iterable[str] = ()) -> list[str]:
+    """Compare a poetry project with its conversion and describe the differences.
+
+    Both (tomllib parsed) documents are flattened into normalized dependencies,
+    extras, groups, sources, scripts and entry points, which must be equal.
+    Path dependencies on the workspace members are expected as workspace sources.
+    """
+    expected, found = normalize_poetry(poetry, workspace), normalize_uv(uv)
+    differences = []
+    for key in sorted(expected.keys() | found.keys()):
+        if key not in found:
+            differences.append(f"missing {key} {expected[key]}".rstrip())
+        elif key not in expected:
+            differences.append(f"added {key} {found[key]}".rstrip())
+        elif expected[key] != found[key]:
+            differences.append(f"changed {key}: {expected[key]} -> {found[key]}")
+    return differences
+
+
+def verify_project(project_file: Path, options: Options) -> ConversionResult:
+    """Verify the conversion of project_file, as written by a run with options."""
+    if options.dry_run:
+        poetry_file = project_file
+        uv_file = project_file.with_name("pyproject_temp_uv.toml")
+    else:
+        poetry_file = project_file.with_name(f"{project_file.name}.org")
+        uv_file = project_file
+    if not poetry_file.exists() or not uv_file.exists():
+        return ConversionResult(project_file, "skipped")
+    source = poetry_file.read_bytes()
+    if not may_be_poetry(source):
+        return ConversionResult(project_file, "skipped")
+    import tomllib
+
+    poetry = tomllib.loads(source.decode())
+    if not poetry.get("tool", {}).get("poetry"):
+        return ConversionResult(project_file, "skipped")
+    uv = tomllib.loads(uv_file.read_text())
+    differences = verify(poetry, uv, options.workspace)
+    outcome = "mismatch" if differences else "verified"
+    return ConversionResult(project_file, outcome, uv_file, messages=differences)
+
+
+def write_profile(
+    results: list[ConversionResult],
+    profile_file: Path | None,
+    trace_file: Path | None = None,
+) -> None:
+    """Write the stage timings as JSON, slowest files first, and as a Chrome trace."""
+    results = sorted(
+        (r for r in results if r.profile),
+        key=lambda r: sum(x["duration"] for x in r.profile if not x["depth"]),
+        reverse=True,
+    )
+    if profile_file:
+        stages: dict[str, dict] = {}
+        for result in results:
+            for record in result.profile:
+                totals = stages.setdefault(
+                    record["stage"],
+                    {"count": 0, "duration": 0.0, "max_duration": 0.0, "max_file": ""},
+                )
+                totals["count"] += 1
+                totals["duration"] += record["duration"]
+                if record["duration"] > totals["max_duration"]:
+                    totals["max_duration"] = record["duration"]
+                    totals["max_file"] = str(result.path)
+        report = {
+            "files": [
+                {
+                    "path": str(r.path),
+                    "duration": sum(x["duration"] for x in r.profile if not x["depth"]),
+                    "stages": r.profile,
+                }
+                for r in results
+            ],
+            "stages": dict(
+                sorted(stages.items(), key=lambda x: x[1]["duration"], reverse=True)
+            ),
+        }
+        profile_file.write_text(json.dumps(report, indent=2) + "\n")
+    if trace_file:
+        events = [
+            {
+                "name": record["stage"],
+                "cat": "convert",
+                "ph": "X",
+                "ts": record["timestamp"] * 1e6,
+                "dur": record["duration"] * 1e6,
+                "pid": result.pid,
+                "tid": 0,
+                "args": {
+                    "path": str(result.path),
+                    "peak_memory": record["peak_memory"],
+                },
+            }
+            for result in results
+            for record in result.profile
+        ]
+        trace_file.write_text(json.dumps({"traceEvents": events}) + "\n")
+
+
+def result_event(result: ConversionResult) -> dict:
+    return {
+        "path": str(result.path),
+        "outcome": result.outcome,
+        "output_file": result.output_file and str(result.output_file),
+        "cached": result.cached,
+        "duration": round(result.duration, 6),
+        "warnings": result.warnings,
+        "unconverted": result.unconverted,
+        "output_hash": result.output_hash,
+        "error": result.error,
+    }
+
+
+# The stdout of the "-" log, while the messages go to stderr, see log_to_stdout.
+_log_stdout: io.TextIOBase | None = None
+
+
+@contextlib.contextmanager
+def log_to_stdout(log_file: str | None) -> Iterator[None]:
+    """With the "-" log, keep stdout for the JSON lines and print to stderr.
+
+    The messages go to stderr as with pipe(), so the log can be read as a stream.
+    """
+    global _log_stdout
+
+    if log_file != "-":
+        yield
+        return
+    _log_stdout = sys.stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        _log_stdout = None
+
+
+@contextlib.contextmanager
+def open_log(log_file: str | None) -> Iterator[io.TextIOBase | None]:
+    """Open the JSON lines result log, "-" being stdout."""
+    if not log_file:
+        yield None
+    elif log_file == "-":
+        yield _log_stdout or sys.stdout
+    else:
+        with open(log_file, "a") as log:
+            yield log
+
+
+def log_result(log: io.TextIOBase | None, result: ConversionResult) -> None:
+    if log:
+        log.write(json.dumps(result_event(result)) + "\n")
+        log.flush()
+
+
+def index_record(poetry: dict) -> dict:
+    """Return the name, version and dependencies of a (plain) tool.poetry table.
+
+    Every dependency becomes a row of the dependency index: its normalized name,
+    group ("main" for the project dependencies), poetry constraint and PEP 440
+    specifier, extras, markers, whether it is optional and its source, the name
+    of a package source and the url of that source, a git repository, a path or
+    a url.
+    """
+    sources = {
+        source.get("name"): source.get("url") for source in poetry.get("source", [])
+    }
+    groups = {"main": poetry.get("dependencies", {})} | {
+        group: data.get("dependencies", {})
+        for group, data in poetry.get("group", {}).items()
+    }
+    dependencies = []
+    for group, deps in groups.items():
+        for name, version in deps.items():
+            if name == "python" or isinstance(version, list):
+                continue
+            if not isinstance(version, dict):
+                version = {"version": version}
+            constraint = version.get("version", "*")
+            source = version.get("source")
+            url = sources.get(source) if source else None
+            for kind in ("git", "path", "url"):
+                url = url or version.get(kind)
+            dependencies.append(
+                {
+                    "name": normalize_name(name),
+                    "group": group,
+                    "constraint": constraint,
+                    "specifier": _specifier(constraint),
+                    "extras": ",".join(version.get("extras", [])),
+                    "markers": version.get("markers"),
+                    "optional": bool(version.get("optional")),
+                    "source": source,
+                    "url": url,
+                }
+            )
+    return {
+        "name": poetry.get("name"),
+        "version": poetry.get("version"),
+        "dependencies": dependencies,
+    }
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT,
+    version TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dependencies (
+    project_id INTEGER NOT NULL REFERENCES projects (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    group_name TEXT NOT NULL,
+    poetry_constraint TEXT NOT NULL,
+    specifier TEXT NOT NULL,
+    extras TEXT NOT NULL,
+    markers TEXT,
+    optional INTEGER NOT NULL,
+    source TEXT,
+    url TEXT
+);
+CREATE INDEX IF NOT EXISTS projects_name ON projects (name);
+CREATE INDEX IF NOT EXISTS dependencies_project ON dependencies (project_id);
+CREATE INDEX IF NOT EXISTS dependencies_name ON dependencies (name, specifier);
+CREATE INDEX IF NOT EXISTS dependencies_source ON dependencies (source);
+CREATE INDEX IF NOT EXISTS dependencies_url ON dependencies (url);
+"""
+
+
+@contextlib.contextmanager
+def open_index(index_file: Path | None) -> Iterator[sqlite3.Connection | None]:
+    """Open the SQLite dependency index, creating it when needed.
+
+    What is recorded is committed on exit (or by the caller), together with
+    removing the projects whose pyproject.toml no longer exists.
+    """
+    if not index_file:
+        yield None
+        return
+    import sqlite3
+
+    index = sqlite3.connect(index_file)
+    try:
+        index.execute("PRAGMA foreign_keys = ON")
+        index.executescript(INDEX_SCHEMA)
+        with index:
+            yield index
+            prune_index(index)
+    finally:
+        index.close()
+
+
+def index_result(index: sqlite3.Connection | None, result: ConversionResult) -> None:
+    """Replace what the index holds on the project of result.
+
+    Only converted projects are recorded and missing ones removed: a project
+    skipped because it was converted before, or failing, keeps its rows.
+    """
+    if index is None:
+        return
+    path = os.path.abspath(result.path)
+    if result.outcome == "missing":
+        index.execute("DELETE FROM projects WHERE path = ?", (path,))
+    if not (record := result.index_record):
+        return
+    index.execute("DELETE FROM projects WHERE path = ?", (path,))
+    project_id = index.execute(
+        "INSERT INTO projects (path, name, version, updated) VALUES (?, ?, ?, ?)",
+        (path, record["name"], record["version"], time.time()),
+    ).lastrowid
+    index.executemany(
+        "INSERT INTO dependencies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                project_id,
+                dep["name"],
+                dep["group"],
+                dep["constraint"],
+                dep["specifier"],
+                dep["extras"],
+                dep["markers"],
+                dep["optional"],
+                dep["source"],
+                dep["url"],
+            )
+            for dep in record["dependencies"]
+        ],
+    )
+
+
+def prune_index(index: sqlite3.Connection) -> None:
+    """Remove the projects whose pyproject.toml no longer exists."""
+    gone = [
+        (path,)
+        for (path,) in index.execute("SELECT path FROM projects")
+        if not os.path.exists(path)
+    ]
+    index.executemany("DELETE FROM projects WHERE path = ?", gone)
+
+
+def _batch_worker(project_file: Path, options: Options) -> ConversionResult:
+    """Convert one file in a worker process, capturing its output as messages."""
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        result = process_project(project_file, options)
+    result.messages = stdout.getvalue().splitlines() + result.messages
+    result.unsynced = unsynced_files()
+    return result
+
+
+# Files handed to a worker at once, and chunks submitted per worker ahead of the
+# results being reported: memory stays bounded however many files there are.
+BATCH_CHUNK_SIZE = 8
+
+
+def _batch_chunk(project_files: tuple[Path, ...], options: Options) -> list:
+    return [_batch_worker(project_file, options) for project_file in project_files]
+
+
+def bounded_map(executor, fn, *iterables, window: int) -> Iterator:
+    """Like executor.map, but reads the iterables at most window calls ahead.
+
+    The arguments are consumed lazily and results are yielded in order, so a slow
+    consumer throttles the submission of new work.
+    """
+    import collections
+
+    pending: collections.deque = collections.deque()
+    try:
+        for args in zip(*iterables, strict=False):
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, *args))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _entry_worker(
+    text: str,
+    project_dir: Path,
+    files: frozenset[str],
+    workspace: tuple[str, ...],
+    index: bool,
+) -> dict:
+    """Convert in a worker process of the asyncio front end, without output."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return conversion_entry(text, project_dir, files, workspace, index)
+
+
+def _lock_worker(
+    lock_file: Path, output: str, lock_output: Path, fsync: bool
+) -> tuple[bool, list[str], list[Path]]:
+    import tomllib
+
+    with contextlib.redirect_stdout(io.StringIO()), collect_warnings() as warnings:
+        translated = convert_lock(lock_file, tomllib.loads(output), lock_output, fsync)
+    return translated, warnings, unsynced_files()
+
+
+async def _convert_project_async(
+    project_file: Path, options: Options, pool
+) -> ConversionResult:
+    """convert_project, with the file I/O on threads and the conversion in pool."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    if is_archive(project_file):
+        return await loop.run_in_executor(pool, _batch_worker, project_file, options)
+    project_dir = project_file.parent
+    try:
+        source = await asyncio.to_thread(project_file.read_bytes)
+    except FileNotFoundError:
+        message = f"File {project_file} not found"
+        return ConversionResult(project_file, "missing", messages=[message])
+    if not may_be_poetry(source):
+        return ConversionResult(project_file, "skipped")
+    entry = key = files = None
+    if options.cache_dir:
+        key = cache_key(source, options)
+        entry = await asyncio.to_thread(
+            cache_lookup, options.cache_dir, key, project_dir
+        )
+    cached = entry is not None
+    if entry is None:
+        files = frozenset(await asyncio.to_thread(os.listdir, project_dir))
+        entry = await loop.run_in_executor(
+            pool,
+            _entry_worker,
+            source.decode(),
+            project_dir,
+            files,
+            options.workspace,
+            options.index_file is not None,
+        )
+        if key:
+            await asyncio.to_thread(cache_store, options.cache_dir, key, entry)
+    if entry.get("skipped"):
+        return ConversionResult(project_file, "skipped", cached=cached)
+
+    output_file = await asyncio.to_thread(
+        write_outputs, project_file, source, entry["output"], options
+    )
+    index_source = source if options.index_file else None
+    result = converted_result(project_file, output_file, entry, cached, index_source)
+    result.warnings = list(entry["warnings"])
+    lock_file = project_dir / "poetry.lock"
+    if options.lock and (
+        lock_file.name in files
+        if files is not None
+        else await asyncio.to_thread(lock_file.exists)
+    ):
+        lock_output = lock_output_file(project_dir, options)
+        _, warnings, result.unsynced = await loop.run_in_executor(
+            pool,
+            _lock_worker,
+            lock_file,
+            entry["output"],
+            lock_output,
+            options.fsync_each,
+        )
+        result.warnings += warnings
+    return result
+
+
+async def _convert_async(
+    project_file: Path, options: Options, pool
+) -> ConversionResult:
+    start = time.perf_counter()
+    try:
+        result = await _convert_project_async(project_file, options, pool)
+    except Exception as exc:
+        message = f"{type(exc).__name__}: {exc}"
+        result = ConversionResult(
+            project_file, "failed", messages=[message], error=str(exc)
+        )
+    result.duration = time.perf_counter() - start
+    return result
+
+
+async def _convert_all(
+    project_files: Iterable[Path], options: Options, jobs: int, io_concurrency: int
+):
+    import asyncio
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=io_concurrency))
+    window = io_concurrency + 2 * jobs
+    project_files = iter(project_files)
+    pending: set = set()
+    # Forking while the I/O threads run could deadlock the workers.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        try:
+            # Discovery walks the (network) file system too, so it runs on a thread.
+            while project_file := await asyncio.to_thread(next, project_files, None):
+                conversion = _convert_async(project_file, options, pool)
+                pending.add(asyncio.create_task(conversion))
+                if len(pending) >= window:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        yield task.result()
+            for task in asyncio.as_completed(pending):
+                yield await task
+            pending = set()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def async_results(
+    project_files: Iterable[Path], options: Options, jobs: int, io_concurrency: int
+) -> Iterator[ConversionResult]:
+    """Convert the projects, yielding the results in the order they finish.
+
+    An asyncio event loop keeps up to io_concurrency file operations (reads,
+    directory listings, cache lookups and writes) in flight on threads, while
+    jobs worker processes do the conversions, so on a high latency (network)
+    file system the conversions do not wait for each round trip in turn.
+    """
+    import asyncio
+
+    async def next_result(results):
+        return await anext(results)
+
+    with asyncio.Runner() as runner:
+        results = _convert_all(project_files, options, jobs, io_concurrency)
+        try:
+            while True:
+                try:
+                    yield runner.run(next_result(results))
+                except StopAsyncIteration:
+                    return
+        finally:
+            runner.run(results.aclose())
+
+
+def batch(
+    patterns: Iterable[str],
+    options: Options,
+    jobs: int | None = None,
+    since: str | None = None,
+    io_concurrency: int | None = None,
+) -> Counter:
+    """Convert all poetry projects matching the patterns on a pool of processes.
+
+    With since, only the projects changed since that git ref are converted.
+    With io_concurrency, the file I/O is overlapped with the conversions, see
+    async_results.
+    """
+    start = time.perf_counter()
+    if since:
+        project_files = changed_projects(patterns, since)
+    else:
+        project_files = find_projects(patterns)
+    jobs = jobs or os.cpu_count() or 1
+    summary: Counter = Counter()
+    failures = []
+    profiled = []
+    unsynced = []
+    cache_hits = 0
+    with contextlib.ExitStack() as stack:
+        if io_concurrency:
+            results = stack.enter_context(
+                contextlib.closing(
+                    async_results(project_files, options, jobs, io_concurrency)
+                )
+            )
+        elif jobs == 1:
+            results = map(_batch_worker, project_files, itertools.repeat(options))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            chunks = bounded_map(
+                executor,
+                _batch_chunk,
+                itertools.batched(project_files, BATCH_CHUNK_SIZE),
+                itertools.repeat(options),
+                window=jobs * 2,
+            )
+            results = itertools.chain.from_iterable(chunks)
+        log = stack.enter_context(open_log(options.log_file))
+        index = stack.enter_context(open_index(options.index_file))
+        for result in results:
+            log_result(log, result)
+            index_result(index, result)
+            summary[result.outcome] += 1
+            cache_hits += result.cached
+            unsynced += result.unsynced
+            if len(unsynced) >= SYNC_BATCH_SIZE:
+                sync_outputs(options.fsync, unsynced + unsynced_files())
+                unsynced = []
+            if result.profile:
+                profiled.append(result)
+            if result.outcome in FAILED_OUTCOMES:
+                failures.append(result)
+    if options.cache_dir:
+        prune_cache(options.cache_dir, options.cache_size)
+    if options.profiling:
+        write_profile(profiled, options.profile_file, options.trace_file)
+    if options.writes:
+        sync_outputs(options.fsync, unsynced + unsynced_files())
+
+    elapsed = time.perf_counter() - start
+    total = sum(summary.values())
+    for result in failures:
+        print(f"{result.outcome.upper()}: {result.path}")
+        for message in result.messages:
+            print(f"    {message}")
+    counts = ", ".join(
+        f"{outcome}: {count}" for outcome, count in sorted(summary.items())
+    )
+    print(f"Processed {total} files in {elapsed:.2f}s using {jobs} workers ({counts})")
+    if options.cache_dir and options.writes:
+        print(f"Cache hits: {cache_hits}/{total}")
+    return summary
+
+
+def workspace_index(patterns: Iterable[str]) -> dict[str, Path]:
+    """Map the normalized name of every project found to its directory.
+
+    Poetry projects and projects converted before, with a [project] name, are
+    indexed, so the workspace can be built again after a partial conversion.
+    """
+    import tomllib
+
+    index: dict[str, Path] = {}
+    for project_file in find_projects(patterns):
+        if is_archive(project_file) or not project_file.exists():
+            continue
+        pyproject = tomllib.loads(project_file.read_text())
+        poetry = pyproject.get("tool", {}).get("poetry", {})
+        if not (name := poetry.get("name") or pyproject.get("project", {}).get("name")):
+            continue
+        if (key := normalize_name(name)) in index:
+            raise ValueError(
+                f"Package {name!r} is defined in both {index[key]} and "
+                f"{project_file.parent}"
+            )
+        index[key] = project_file.parent
+    return index
+
+
+def workspace_members(root: Path, index: dict[str, Path]) -> list[str]:
+    """Return the directories of the indexed projects relative to root."""
+    from pathlib import Path
+
+    members = set()
+    for directory in index.values():
+        relative = Path(os.path.relpath(directory, root))
+        if relative.parts[:1] == ("..",):
+            raise ValueError(f"Project {directory} is outside the workspace {root}")
+        if relative != Path("."):
+            members.add(relative.as_posix())
+    return sorted(members)
+
+
+def write_workspace_root(root: Path, members: list[str], options: Options) -> Path:
+    """Write [tool.uv.workspace] members into the pyproject.toml of root.
+
+    The (converted) root project is extended, otherwise a virtual workspace
+    root is created. An existing root file is backed up as for a conversion,
+    unless it already has a backup.
+    """
+    root_file = root / "pyproject.toml"
+    backup_file, output_file = output_files(root_file, options)
+    source_file = output_file if output_file.exists() else root_file
+    source = source_file.read_text() if source_file.exists() else ""
+    document = tk.loads(source)
+    if document.get("tool", {}).get("poetry"):
+        raise ValueError(f"{source_file} was not converted, see the errors above")
+    uv_table(document, "workspace")["members"] = members
+    if not options.dry_run and root_file.exists() and not backup_file.exists():
+        atomic_write(
+            backup_file,
+            root_file.read_bytes(),
+            options.fsync_each,
+            root_file.stat().st_mode,
+        )
+    atomic_write(output_file, format_toml(document).encode(), options.fsync_each)
+    return output_file
+
+
+def handle_request(request: dict) -> dict:
+    """Answer one conversion request of the server, see serve()."""
+    from pathlib import Path
+
+    response = {"id": request.get("id")}
+    with collect_warnings() as warnings, contextlib.redirect_stdout(io.StringIO()):
+        try:
+            if path := request.get("path"):
+                text = Path(path).read_text()
+                project_dir = request.get("project_dir", Path(path).parent)
+            else:
+                text = request["text"]
+                project_dir = request.get("project_dir", ".")
+            response["output"] = convert(text, project_dir)
+        except Exception as exc:
+            response["error"] = f"{type(exc).__name__}: {exc}"
+    response["warnings"] = warnings
+    return response
+
+
+def _serve_lines(lines: Iterable[str], write, lock: threading.Lock) -> None:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as exc:
+            response = {"id": None, "error": f"Invalid request: {exc}"}
+        else:
+            with lock:
+                response = handle_request(request)
+        write(json.dumps(response) + "\n")
+
+
+def serve(socket_path: Path | None = None) -> None:
+    """Answer conversion requests until stdin is closed or the server is stopped.
+
+    Requests and responses are JSON lines, on stdin/stdout or on a Unix socket.
+    A request holds the ``text`` of a pyproject.toml (and optionally its
+    ``project_dir``) or the ``path`` of one to read, plus an optional ``id``.
+    The response holds the ``id``, the converted ``output`` or an ``error``,
+    and the ``warnings``. Nothing is written to disk.
+    """
+    import socketserver
+    import threading
+
+    lock = threading.Lock()
+    if socket_path is None:
+        stdout = sys.stdout
+
+        def write(data: str) -> None:
+            stdout.write(data)
+            stdout.flush()
+
+        _serve_lines(sys.stdin, write, lock)
+        return
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            lines = (line.decode() for line in self.rfile)
+            _serve_lines(lines, lambda data: self.wfile.write(data.encode()), lock)
+
+    socket_path.unlink(missing_ok=True)
+    with socketserver.ThreadingUnixStreamServer(str(socket_path), Handler) as server:
+        print(f"Serving on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+WATCH_DEBOUNCE = 0.2
+WATCH_POLL_INTERVAL = 1.0
+
+
+def is_project_file(name: str) -> bool:
+    """Whether a file of this name influences the conversion of its project."""
+    return name in PROJECT_FILES or name.upper().startswith("LICENSE")
+
+
+class InotifyWatcher:
+    """Wait for changes in directories with Linux inotify, costing nothing idle."""
+
+    # IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    MASK = 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+    IN_Q_OVERFLOW = 0x4000
+
+    def __init__(self, dirs: Iterable[Path], relevant: Callable[[str], bool]):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.relevant = relevant
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: dict[int, Path] = {}
+        for directory in dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                self.close()
+                raise OSError(errno, f"inotify_add_watch {directory} failed")
+            self.dirs[wd] = directory
+
+    def wait(self, timeout: float | None) -> set[Path]:
+        """Return the relevant changed paths, or an empty set after timeout."""
+        import select
+        import struct
+
+        changed: set[Path] = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16 : offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                changed.update(d / "pyproject.toml" for d in self.dirs.values())
+            elif wd in self.dirs and self.relevant(name):
+                changed.add(self.dirs[wd] / name)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Wait for changes in directories by comparing stats at an interval.
+
+    A directory is only listed again when its mtime changed, otherwise only the
+    relevant files it holds are stat'ed.
+    """
+
+    def __init__(
+        self,
+        dirs: Iterable[Path],
+        relevant: Callable[[str], bool],
+        interval: float = WATCH_POLL_INTERVAL,
+    ):
+        self.relevant = relevant
+        self.interval = interval
+        self.snapshots = {directory: self._scan(directory) for directory in dirs}
+
+    def _stat(self, path: Path) -> tuple | None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _scan(self, directory: Path) -> tuple[tuple | None, dict[str, tuple]]:
+        try:
+            names = [e.name for e in os.scandir(directory) if self.relevant(e.name)]
+        except FileNotFoundError:
+            names = []
+        files = {name: self._stat(directory / name) for name in names}
+        return self._stat(directory), files
+
+    def _poll(self, directory: Path) -> set[Path]:
+        dir_stat, files = self.snapshots[directory]
+        if self._stat(directory) != dir_stat:
+            snapshot = self._scan(directory)
+        else:
+            snapshot = dir_stat, {name: self._stat(directory / name) for name in files}
+        self.snapshots[directory] = snapshot
+        new_files = snapshot[1]
+        return {
+            directory / name
+            for name in files.keys() | new_files.keys()
+            if files.get(name) != new_files.get(name)
+        }
+
+    def wait(self, timeout: float | None) -> set[Path]:
+        """Return the relevant changed paths, or an empty set after timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+            time.sleep(max(delay, 0))
+            changed = set().union(*map(self._poll, self.snapshots))
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(
+    dirs: Iterable[Path], relevant: Callable[[str], bool], polling: bool = False
+) -> InotifyWatcher | PollingWatcher:
+    """Watch with inotify where it is available, otherwise by polling."""
+    dirs = list(dirs)
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(dirs, relevant)
+        except (OSError, AttributeError) as exc:
+            print(f"inotify is not available ({exc}), polling for changes")
+    return PollingWatcher(dirs, relevant)
+
+
+def watch_changes(
+    watcher: InotifyWatcher | PollingWatcher, debounce: float = WATCH_DEBOUNCE
+) -> Iterator[set[Path]]:
+    """Yield the changed paths, once a burst of changes has been quiet for a while."""
+    while True:
+        changed = watcher.wait(None)
+        while changed and (more := watcher.wait(debounce)):
+            changed |= more
+        if changed:
+            yield changed
+
+
+def _affects(project_file: Path, name: str) -> bool:
+    return name == project_file.name or (
+        name != "pyproject.toml" and is_project_file(name)
+    )
+
+
+def watch(project_files: list[Path], options: Options, polling: bool = False) -> None:
+    """Convert projects again whenever one of their files changes, until Ctrl-C."""
+    projects: dict[Path, list[Path]] = {}
+    for project_file in project_files:
+        projects.setdefault(project_file.parent, []).append(project_file)
+    names = {project_file.name for project_file in project_files}
+    watcher = open_watcher(
+        projects, lambda name: name in names or is_project_file(name), polling
+    )
+    kind = "inotify" if isinstance(watcher, InotifyWatcher) else "polling"
+    print(f"Watching {len(project_files)} projects ({kind}), press Ctrl-C to stop")
+    try:
+        with open_log(options.log_file) as log, open_index(options.index_file) as index:
+            for changed in watch_changes(watcher):
+                affected = {
+                    project_file: None
+                    for path in sorted(changed)
+                    for project_file in projects.get(path.parent, [])
+                    if _affects(project_file, path.name)
+                }
+                unsynced = []
+                for project_file in affected:
+                    result = _batch_worker(project_file, options)
+                    unsynced += result.unsynced
+                    log_result(log, result)
+                    index_result(index, result)
+                    print(f"{result.outcome}: {project_file} ({result.duration:.2f}s)")
+                    for message in result.warnings + [result.error or ""]:
+                        if message:
+                            print(f"    {message}")
+                if options.writes:
+                    sync_outputs(options.fsync, unsynced)
+                if index:
+                    index.commit()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def is_batch(args: argparse.Namespace) -> bool:
+    from pathlib import Path
+
+    return (
+        bool(args.paths)
+        or bool(args.since)
+        or glob.has_magic(args.filename)
+        or Path(args.filename).is_dir()
+    )
+
+
+# Options which make no difference for a single file that is not a poetry project.
+QUICK_SKIP_OPTIONS = ("-n", "--no-cache", "--lock")
+
+
+def quick_skip(argv: list[str]) -> bool:
+    """Skip a single non-poetry file before the arguments are even parsed.
+
+    A no-op run on a non-poetry project then imports neither argparse nor re
+    (which argparse imports). Anything else is left to the argument parser.
+    """
+    paths = [arg for arg in argv if arg not in QUICK_SKIP_OPTIONS]
+    if len(paths) != 1 or paths[0].startswith("-") or any(c in paths[0] for c in "*?["):
+        return False
+    if paths[0].endswith(ARCHIVE_SUFFIXES) or not os.path.isfile(paths[0]):
+        return False
+    with open(paths[0], "rb") as f:
+        if may_be_poetry(f.read()):
+            return False
+    print("Poetry section not found, are you certain this is a poetry project?")
+    return True
+
+
+def main() -> None:
+    if quick_skip(sys.argv[1:]):
+        return
+    args = argparser()
+    if args.serve:
+        serve(args.socket)
+        return
+    if args.stdout:
+        pipe(args.filename, args.project_dir)
+        return
+    options = Options(
+        dry_run=args.n or args.watch,
+        check=args.check,
+        verify=args.verify,
+        lock=args.lock,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024,
+        profile_file=args.profile,
+        trace_file=args.trace,
+        log_file=args.log,
+        fsync=args.fsync,
+        archive_dir=args.archive_output,
+        index_file=args.index_db,
+    )
+    with log_to_stdout(options.log_file):
+        run(args, options)
+
+
+def run(args, options: Options) -> None:
+    """Check, verify or convert the file or paths given on the command line."""
+    from pathlib import Path
+
+    if is_batch(args):
+        patterns = [args.filename, *args.paths]
+        try:
+            if args.workspace:
+                index = workspace_index(patterns)
+                members = workspace_members(Path(args.filename), index)
+                options = options._replace(workspace=tuple(sorted(index)))
+            summary = batch(
+                patterns,
+                options,
+                jobs=args.jobs,
+                since=args.since,
+                io_concurrency=args.io_concurrency,
+            )
+            if args.workspace and options.writes:
+                root_file = write_workspace_root(Path(args.filename), members, options)
+                sync_outputs(options.fsync, unsynced_files())
+                print(f"Workspace of {len(members)} members written to {root_file}")
+        except ValueError as exc:
+            raise SystemExit(f"Error: {exc}") from None
+        if args.watch:
+            watch(list(find_projects(patterns)), options, polling=args.poll)
+            return
+        if options.check and (summary["failed"] or summary["unsupported"]):
+            raise SystemExit(1)
+        if options.verify and (summary["failed"] or summary["mismatch"]):
+            raise SystemExit(1)
+        return
+    result = process_project(Path(args.filename), options)
+    if options.writes:
+        sync_outputs(options.fsync, unsynced_files())
+    with open_log(options.log_file) as log:
+        log_result(log, result)
+    with open_index(options.index_file) as index:
+        index_result(index, result)
+    if options.profiling:
+        write_profile([result], options.profile_file, options.trace_file)
+    if options.cache_dir and options.writes and not result.cached:
+        prune_cache_if_due(options.cache_dir, options.cache_size)
+    if not options.writes:
+        print(f"{result.outcome.upper()}: {result.path}")
+        for message in result.messages:
+            print(f"    {message}")
+    if args.watch:
+        watch([Path(args.filename)], options, polling=args.poll)
+        return
+    if result.outcome in ("failed", "unsupported", "mismatch"):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
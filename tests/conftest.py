@@ -4,6 +4,13 @@ import pytest
 import tomlkit
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    cache_dir = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("CONVERT_POETRY2UV_CACHE_DIR", str(cache_dir))
+    return cache_dir
+
+
 @pytest.fixture
 def org_toml():
     return {
@@ -65,11 +72,19 @@ def expected_project_base():
             "name": "name of the project",
             "version": "0.1.0",
             "description": "A description",
-            "authors": ["another <email@domain.nl>", "<some@email.nl>", "user"],
-            "maintainers": ["another <email@domain.nl>", "<some@email.nl>", "user"],
-            "license": "LICENSE",
+            "authors": [
+                {"name": "another", "email": "email@domain.nl"},
+                {"email": "some@email.nl"},
+                {"name": "user"},
+            ],
+            "maintainers": [
+                {"name": "another", "email": "email@domain.nl"},
+                {"email": "some@email.nl"},
+                {"name": "user"},
+            ],
+            "license": {"text": "LICENSE"},
             "readme": "README.md",
-            "requires-python": ">=3.12",
+            "requires-python": ">=3.12,<4.0",
             "keywords": ["packaging", "poetry"],
             "classifiers": [
                 "Topic :: Software Development :: Build Tools",
@@ -77,13 +92,5 @@ def expected_project_base():
             ],
             "urls": {"Bug Tracker": "https://github.com/python-poetry/poetry/issues"},
             "scripts": {"script_name": "dir.file:app"},
-            "dependencies": {
-                "python": "^3.12",
-                "pytest": "*",
-                "pytest-cov": "*",
-                "pytest-mock": "*",
-                "ruff": "*",
-                "jira": "^3.8.0",
-            },
         }
     }
@@ -0,0 +1,36 @@
+import importlib
+import json
+from pathlib import Path
+
+import tomlkit
+
+import convert_poetry2uv
+from benchmarks.generate_pyproject import generate_pyproject
+
+
+def test_generate_pyproject(tmp_path):
+    text = generate_pyproject(dependencies=5, groups=3, extras=2, sources=2)
+    new_toml = convert_poetry2uv.convert_document(tomlkit.loads(text), tmp_path)
+    assert len(new_toml["project"]["dependencies"]) == 7
+    assert len(new_toml["dependency-groups"]) == 3
+    assert len(new_toml["project"]["optional-dependencies"]) == 2
+    assert len(new_toml["tool"]["uv"]["sources"]) == 2
+    assert len(new_toml["tool"]["ruff"]) == 21
+
+
+def test_benchmark(mocker, monkeypatch, tmp_path):
+    monkeypatch.syspath_prepend(Path(__file__).parent.parent / "benchmarks")
+    benchmark = importlib.import_module("benchmark")
+    output = tmp_path / "benchmark.json"
+    mocker.patch(
+        "sys.argv",
+        ["benchmark.py", "-r", "1", "--shape", "small", "-o", str(output)]
+        + ["--compare", str(output)],
+    )
+    output.write_text(json.dumps({"results": {}}))
+    benchmark.main()
+    results = json.loads(output.read_text())["results"]
+    assert set(results) == {"small"}
+    assert {"split", "tk.loads", "tool.poetry.dependencies", "format", "total"} <= set(
+        results["small"]
+    )
@@ -1,4 +1,18 @@
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
 import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import tomllib
+import zipfile
 from pathlib import Path
 
 import pytest
@@ -6,22 +20,68 @@ import tomlkit
 
 import convert_poetry2uv
 
+# The tool.poetry keys copied into [project] as they are, or nearly so.
+PROJECT_BASE_KEYS = set(convert_poetry2uv.PROJECT_KEYS) - {"dependencies"}
+
+
+def run_rules(new_toml, org_toml, *keys, project_dir="."):
+    """Apply the conversion rules of keys only, as Conversion.run does."""
+    convert_poetry2uv.Conversion(new_toml, org_toml, project_dir).run(keys)
+
 
 @pytest.mark.parametrize(
     "key, value",
     [
-        ("^3.6", ">=3.6"),
+        ("^3.6", ">=3.6,<4.0"),
         ("*", ""),
-        ("^1.2.3", ">=1.2.3"),
-        ("~1.2.3", ">=1.2.3"),
-        ("~1.*", ">=1"),
-        ("~1.2.*", ">=1.2")
+        ("^1.2.3", ">=1.2.3,<2.0.0"),
+        ("^0.2.3", ">=0.2.3,<0.3.0"),
+        ("^0.0.3", ">=0.0.3,<0.0.4"),
+        ("^0", ">=0,<1"),
+        ("~1.2.3", ">=1.2.3,<1.3.0"),
+        ("~1", ">=1,<2"),
+        ("~1.*", ">=1,<2"),
+        ("~1.2.*", ">=1.2,<1.3"),
+        ("1.2.*", "==1.2.*"),
+        ("1.2.3", "==1.2.3"),
+        ("==1.2.3", "==1.2.3"),
+        ("!=1.2.3", "!=1.2.3"),
+        ("~=1.4.2", "~=1.4.2"),
+        (">=1,<2", ">=1,<2"),
+        (">= 1.2 < 2", ">=1.2,<2"),
+        ("^1.2,!=1.5", ">=1.2,<2.0,!=1.5"),
+        (">=1.2.3a1", ">=1.2.3a1"),
+        ("^1.0 || ^2.0", ">=1.0,<3.0"),
     ],
 )
 def test_version_conversion(key, value):
     assert convert_poetry2uv.version_conversion(key) == value
 
 
+@pytest.mark.parametrize("version", ["latest", "1.*.2", ">=1.*", "", "^1 ||"])
+def test_version_conversion_error(version):
+    with pytest.raises(convert_poetry2uv.ConstraintError):
+        convert_poetry2uv.version_conversion(version)
+
+
+@pytest.mark.parametrize(
+    "version, expected, gap",
+    [
+        ("^1.0 || ^3.0", ">=1.0,<4.0", True),
+        (">=1.2,>=1.0 || ^3", ">=1.2", False),
+        (">=1.0,>=1.2 || ^3", ">=1.2", False),
+        (">1.2,>=1.2 || ^3", ">1.2", False),
+        ("<1.5,^1.0 || ^1.7", ">=1.0,<2.0", True),
+        ("^1.0,<1.5 || ^1.7", ">=1.0,<2.0", True),
+        ("^1.7 || <1.5,^1.0", ">=1.0,<2.0", True),
+        ("^1.0,<=1.7 || ^1.7", ">=1.0,<2.0", False),
+    ],
+)
+def test_version_conversion_or_tightest_bounds(capsys, version, expected, gap):
+    assert convert_poetry2uv.version_conversion(version) == expected
+    assert ("gap between the alternatives" in capsys.readouterr().out) == gap
+
+
 @pytest.mark.parametrize(
     "key, name, email",
     [
@@ -31,12 +91,12 @@ def test_version_conversion(key, value):
         (["maintainers", "another one", "just@checking.com"]),
     ],
 )
-def test_authors_maintainers(key, name, email):
+def test_authors_maintainers(pyproject_empty_base, key, name, email):
     authors = [f"{name} <{email}>"]
-    in_dict = {"project": {key: authors}}
+    org_toml = {"tool": {"poetry": {key: authors}}}
     expected = {"project": {key: [{"name": name, "email": email}]}}
-    convert_poetry2uv.authors_maintainers(in_dict)
-    assert in_dict == expected
+    run_rules(pyproject_empty_base, org_toml, key)
+    assert pyproject_empty_base == expected
 
 
 @pytest.mark.parametrize(
@@ -63,11 +123,11 @@ def test_authors_maintainers(key, name, email):
         ),
     ],
 )
-def test_multiple_authors(authors, author_string):
-    in_dict = {"project": {"authors": authors}}
+def test_multiple_authors(pyproject_empty_base, authors, author_string):
+    org_toml = {"tool": {"poetry": {"authors": authors}}}
     expected = {"project": {"authors": author_string}}
-    convert_poetry2uv.authors_maintainers(in_dict)
-    assert in_dict == expected
+    run_rules(pyproject_empty_base, org_toml, "authors")
+    assert pyproject_empty_base == expected
 
 
 def test_no_python_in_deps(org_toml):
@@ -78,8 +138,10 @@ def test_no_python_in_deps(org_toml):
 
 
 def test_dependencies(pyproject_empty_base, org_toml):
-    expected = {"project": {"dependencies": ["pytest", "pytest-cov", "jira>=3.8.0"]}}
-    convert_poetry2uv.dependencies(pyproject_empty_base, org_toml)
+    expected = {
+        "project": {"dependencies": ["pytest", "pytest-cov", "jira>=3.8.0,<4.0.0"]}
+    }
+    run_rules(pyproject_empty_base, org_toml, "dependencies")
     assert pyproject_empty_base == expected
 
 
@@ -87,10 +149,10 @@ def test_optional_dependencies(pyproject_empty_base, org_toml_optional):
     expected = {
         "project": {
             "dependencies": ["pytest", "pytest-cov"],
-            "optional-dependencies": {"JIRA": ["jira>=3.8.0"]},
+            "optional-dependencies": {"JIRA": ["jira>=3.8.0,<4.0.0"]},
         }
     }
-    convert_poetry2uv.dependencies(pyproject_empty_base, org_toml_optional)
+    run_rules(pyproject_empty_base, org_toml_optional, "dependencies")
     assert pyproject_empty_base == expected
 
 
@@ -106,9 +168,9 @@ def test_extras_dependencies():
     deps = in_dict["tool"]["poetry"]["dependencies"]
     expected = [
         "pytest",
-        "pandas[computation]>=2.2.1",
-        "pandas[performance]>=2.2.1",
-        "fastapi[all]>=0.92.0",
+        "pandas[computation]>=2.2.1,<3.0.0",
+        "pandas[performance]>=2.2.1,<3.0.0",
+        "fastapi[all]>=0.92.0,<0.93.0",
     ]
     uv_deps, _, _ = convert_poetry2uv.parse_packages(deps)
     assert uv_deps == expected
@@ -117,9 +179,9 @@ def test_extras_dependencies():
 def test_dev_dependencies(pyproject_empty_base, org_toml):
     expected = {
         "project": {},
-        "dependency-groups": {"dev": ["mypy>=1.0.1"]},
+        "dependency-groups": {"dev": ["mypy>=1.0.1,<2.0.0"]},
     }
-    convert_poetry2uv.group_dependencies(pyproject_empty_base, org_toml)
+    run_rules(pyproject_empty_base, org_toml, "group")
     assert pyproject_empty_base == expected
 
 
@@ -139,10 +201,10 @@ def test_dev_dependencies_optional(pyproject_empty_base):
             }
         }
     }
-    convert_poetry2uv.group_dependencies(pyproject_empty_base, in_dict)
+    run_rules(pyproject_empty_base, in_dict, "group")
     expected = {
-        "project": {"optional-dependencies": {"JIRA": ["jira>=3.8.0"]}},
-        "dependency-groups": {"dev": ["mypy>=1.0.1"]},
+        "project": {"optional-dependencies": {"JIRA": ["jira>=3.8.0,<4.0.0"]}},
+        "dependency-groups": {"dev": ["mypy>=1.0.1,<2.0.0"]},
     }
     assert pyproject_empty_base == expected
 
@@ -157,8 +219,11 @@ def test_dev_extras_dependencies(pyproject_empty_base):
     fastapi = {version="^0.92.0", extras=["all"]}
     """
     in_dict = tomlkit.loads(in_txt)
-    convert_poetry2uv.group_dependencies(pyproject_empty_base, in_dict)
-    expected = {"project": {}, "dependency-groups": {"dev": ["fastapi[all]>=0.92.0"]}}
+    run_rules(pyproject_empty_base, in_dict, "group")
+    expected = {
+        "project": {},
+        "dependency-groups": {"dev": ["fastapi[all]>=0.92.0,<0.93.0"]},
+    }
     assert pyproject_empty_base == expected
 
 
@@ -174,26 +239,26 @@ def test_doc_dependencies(pyproject_empty_base, org_toml):
     org_toml["tool"]["poetry"]["group"]["doc"] = {"dependencies": {"mkdocs": "*"}}
     expected = {
         "project": {},
-        "dependency-groups": {"dev": ["mypy>=1.0.1"], "doc": ["mkdocs"]},
+        "dependency-groups": {"dev": ["mypy>=1.0.1,<2.0.0"], "doc": ["mkdocs"]},
     }
-    convert_poetry2uv.group_dependencies(pyproject_empty_base, org_toml)
+    run_rules(pyproject_empty_base, org_toml, "group")
     assert pyproject_empty_base == expected
 
 
-def test_project_license(tmp_path):
-    in_dict = {"project": {"license": "MIT"}}
+def test_project_license(pyproject_empty_base, tmp_path):
+    org_toml = {"tool": {"poetry": {"license": "MIT"}}}
     expected = {"project": {"license": {"text": "MIT"}}}
-    convert_poetry2uv.project_license(in_dict, tmp_path)
-    assert in_dict == expected
+    run_rules(pyproject_empty_base, org_toml, "license", project_dir=tmp_path)
+    assert pyproject_empty_base == expected
 
 
-def test_project_license_file(tmp_path):
+def test_project_license_file(pyproject_empty_base, tmp_path):
     license_name = "license_file_name"
-    in_dict = {"project": {"license": license_name}}
+    org_toml = {"tool": {"poetry": {"license": license_name}}}
     tmp_path.joinpath(license_name).touch()
     expected = {"project": {"license": {"file": license_name}}}
-    convert_poetry2uv.project_license(in_dict, tmp_path)
-    assert in_dict == expected
+    run_rules(pyproject_empty_base, org_toml, "license", project_dir=tmp_path)
+    assert pyproject_empty_base == expected
 
 
 def test_build_system():
@@ -224,14 +289,179 @@ def test_poetry_sources(pyproject_empty_base):
     url = "http://example.com/simple"
     """
     in_dict = tomlkit.loads(in_txt)
-    convert_poetry2uv.dependencies(pyproject_empty_base, in_dict)
+    run_rules(pyproject_empty_base, in_dict, "dependencies")
     expected = {
-        "project": {"dependencies": ["requests>=2.13.0"]},
-        "tool": {"uv": {"sources": {"requests": {"git": "http://example.com/simple"}}}},
+        "project": {"dependencies": ["requests>=2.13.0,<3.0.0"]},
+        "tool": {"uv": {"sources": {"requests": {"index": "private"}}}},
     }
     assert pyproject_empty_base == expected
 
 
+def test_poetry_sources_index(pyproject_empty_base, capsys):
+    in_txt = """
+    [[tool.poetry.source]]
+    name = "private"
+    url = "http://example.com/simple"
+    priority = "explicit"
+
+    [[tool.poetry.source]]
+    name = "mirror"
+    url = "http://mirror.com/simple"
+    priority = "default"
+
+    [[tool.poetry.source]]
+    name = "supplemental"
+    url = "http://supplemental.com/simple"
+    priority = "supplemental"
+    """
+    run_rules(pyproject_empty_base, tomlkit.loads(in_txt), "source")
+    expected = {
+        "project": {},
+        "tool": {
+            "uv": {
+                "index": [
+                    {
+                        "name": "private",
+                        "url": "http://example.com/simple",
+                        "explicit": True,
+                    },
+                    {
+                        "name": "mirror",
+                        "url": "http://mirror.com/simple",
+                        "default": True,
+                    },
+                    {"name": "supplemental", "url": "http://supplemental.com/simple"},
+                ]
+            }
+        },
+    }
+    assert pyproject_empty_base == expected
+    assert "supplemental sources are searched before PyPI" in capsys.readouterr().out
+    findings = convert_poetry2uv.analyze(tomllib.loads(in_txt))
+    assert (
+        "unsupported",
+        "source 'supplemental': supplemental sources are searched before PyPI by uv",
+    ) in findings
+
+
+@pytest.mark.parametrize(
+    "sources, defaults",
+    [
+        # Primary sources disable PyPI, the last one replaces it.
+        ([("a", None), ("b", "primary"), ("c", "explicit")], ["b"]),
+        ([("a", "primary"), ("PyPI", None)], []),
+        ([("a", "explicit"), ("b", "supplemental")], []),
+        ([("a", None), ("b", "default")], ["b"]),
+        ([("git", None)], []),
+    ],
+)
+def test_poetry_sources_primary(pyproject_empty_base, sources, defaults):
+    poetry = {"tool": {"poetry": {"name": "x", "version": "1", "source": []}}}
+    for name, priority in sources:
+        source = {"name": name}
+        if name == "git":
+            source["url"] = "https://github.com/example/repo.git"
+        elif name != "PyPI":
+            source["url"] = f"http://{name}.com/simple"
+        if priority:
+            source["priority"] = priority
+        poetry["tool"]["poetry"]["source"].append(source)
+    new_toml = convert_poetry2uv.convert_document(tomlkit.item(poetry), ".")
+    indexes = new_toml.get("tool", {}).get("uv", {}).get("index", [])
+    assert [index["name"] for index in indexes if index.get("default")] == defaults
+
+
+def test_poetry_git_dependencies(pyproject_empty_base):
+    in_txt = """
+    [tool.poetry.dependencies]
+    flask = { git = "https://github.com/pallets/flask.git", branch = "main" }
+    numpy = { git = "https://github.com/numpy/numpy.git", tag = "v0.13.2" }
+    httpx = { git = "https://github.com/encode/httpx.git", rev = "abc123", extras = ["http2"] }
+    """
+    run_rules(pyproject_empty_base, tomlkit.loads(in_txt), "dependencies")
+    expected = {
+        "project": {"dependencies": ["flask", "numpy", "httpx[http2]"]},
+        "tool": {
+            "uv": {
+                "sources": {
+                    "flask": {
+                        "git": "https://github.com/pallets/flask.git",
+                        "branch": "main",
+                    },
+                    "numpy": {
+                        "git": "https://github.com/numpy/numpy.git",
+                        "tag": "v0.13.2",
+                    },
+                    "httpx": {
+                        "git": "https://github.com/encode/httpx.git",
+                        "rev": "abc123",
+                    },
+                }
+            }
+        },
+    }
+    assert pyproject_empty_base == expected
+
+
+def test_poetry_undefined_source(pyproject_empty_base):
+    in_txt = """
+    [tool.poetry.dependencies]
+    requests = { version = "^2.13.0", source = "private" }
+    """
+    with pytest.raises(ValueError, match="'private' of 'requests' is not defined"):
+        run_rules(pyproject_empty_base, tomlkit.loads(in_txt), "dependencies")
+
+
+def test_poetry_pypi_source(pyproject_empty_base):
+    in_txt = """
+    [tool.poetry.dependencies]
+    requests = { version = "^2.13.0", source = "pypi" }
+    flask = { version = "^3.0", source = "private" }
+
+    [[tool.poetry.source]]
+    name = "PyPI"
+    priority = "primary"
+
+    [[tool.poetry.source]]
+    name = "private"
+    url = "http://example.com/simple"
+    """
+    in_dict = tomlkit.loads(in_txt)
+    run_rules(pyproject_empty_base, in_dict, "dependencies")
+    run_rules(pyproject_empty_base, in_dict, "source")
+    assert pyproject_empty_base["tool"]["uv"] == {
+        "sources": {"flask": {"index": "private"}},
+        "index": [{"name": "private", "url": "http://example.com/simple"}],
+    }
+    pyproject = tomllib.loads(in_txt)
+    pyproject["tool"]["poetry"] |= {"name": "x", "version": "1"}
+    assert convert_poetry2uv.analyze(pyproject) == []
+    uv = tomllib.loads(tomlkit.dumps(pyproject_empty_base))
+    uv["project"] |= {"name": "x", "version": "1"}
+    assert convert_poetry2uv.verify(pyproject, uv) == []
+
+
+def test_tools_keep_uv_sources(pyproject_empty_base):
+    in_txt = """
+    [tool.poetry.dependencies]
+    requests = { version = "^2.13.0", source = "private" }
+
+    [[tool.poetry.source]]
+    name = "private"
+    url = "http://example.com/simple"
+
+    [tool.uv]
+    package = true
+    """
+    in_dict = tomlkit.loads(in_txt)
+    run_rules(pyproject_empty_base, in_dict, "dependencies")
+    convert_poetry2uv.tools(pyproject_empty_base, in_dict)
+    assert pyproject_empty_base["tool"]["uv"] == {
+        "sources": {"requests": {"index": "private"}},
+        "package": True,
+    }
+
+
 def test_normal_and_dev_poetry_sources(pyproject_empty_base):
     in_txt = """
     [tool.poetry.group.dev.dependencies]
@@ -249,15 +479,18 @@ def test_normal_and_dev_poetry_sources(pyproject_empty_base):
     url = "http://other.com/simple"
     """
     in_dict = tomlkit.loads(in_txt)
-    convert_poetry2uv.group_dependencies(pyproject_empty_base, in_dict)
+    run_rules(pyproject_empty_base, in_dict, "group")
     expected = {
         "project": {},
-        "dependency-groups": {"dev": ["requests>=2.13.0"], "doc": ["httpx>=1.13.0"]},
+        "dependency-groups": {
+            "dev": ["requests>=2.13.0,<3.0.0"],
+            "doc": ["httpx>=1.13.0,<2.0.0"],
+        },
         "tool": {
             "uv": {
                 "sources": {
-                    "requests": {"git": "http://example.com/simple"},
-                    "httpx": {"git": "http://other.com/simple"},
+                    "requests": {"index": "private"},
+                    "httpx": {"index": "other"},
                 }
             }
         },
@@ -268,7 +501,7 @@ def test_normal_and_dev_poetry_sources(pyproject_empty_base):
 def test_project_base(toml_obj, pyproject_empty_base):
     org_toml = toml_obj("tests/files/poetry_pyproject.toml")
     new_toml = pyproject_empty_base
-    convert_poetry2uv.project_base(new_toml, org_toml)
+    run_rules(new_toml, org_toml, *PROJECT_BASE_KEYS)
     expected = {
         "project": {
             "name": "name of the project",
@@ -278,7 +511,7 @@ def test_project_base(toml_obj, pyproject_empty_base):
             "maintainers": ["another <email@domain.nl>", "<some@email.nl>", "user"],
             "license": "LICENSE",
             "readme": "README.md",
-            "requires-python": ">=3.12",
+            "requires-python": ">=3.12,<4.0",
             "scripts": {"script_name": "dir.file:app"},
             "dependencies": {
                 "python": "^3.12",
@@ -296,7 +529,7 @@ def test_project_base(toml_obj, pyproject_empty_base):
 def test_project_base(toml_obj, pyproject_empty_base, expected_project_base):
     org_toml = toml_obj("tests/files/poetry_pyproject.toml")
     new_toml = pyproject_empty_base
-    convert_poetry2uv.project_base(new_toml, org_toml)
+    run_rules(new_toml, org_toml, *PROJECT_BASE_KEYS)
     assert new_toml == expected_project_base
 
 
@@ -305,15 +538,43 @@ def test_project_base_require_python(
 ):
     org_toml = toml_obj("tests/files/poetry_pyproject.toml")
     org_toml["tool"]["poetry"]["requires-python"] = "^3.10"
-    expected_project_base["project"]["requires-python"] = ">=3.10"
+    expected_project_base["project"]["requires-python"] = ">=3.10,<4.0"
     new_toml = pyproject_empty_base
-    convert_poetry2uv.project_base(new_toml, org_toml)
+    run_rules(new_toml, org_toml, *PROJECT_BASE_KEYS)
     assert new_toml == expected_project_base
 
 
+def test_custom_rule(monkeypatch):
+    def packages_rule(conversion, key, value):
+        packages = [package["include"] for package in value]
+        wheel = convert_poetry2uv.uv_table(conversion.new_toml, "build-backend")
+        wheel["module-name"] = packages
+
+    monkeypatch.setitem(convert_poetry2uv.RULES, "packages", packages_rule)
+    in_txt = """
+    [tool.poetry]
+    name = "x"
+    version = "1"
+    packages = [{ include = "x" }, { include = "y" }]
+    """
+    entry = convert_poetry2uv.conversion_entry(in_txt, Path("."))
+    assert tomllib.loads(entry["output"])["tool"]["uv"] == {
+        "build-backend": {"module-name": ["x", "y"]}
+    }
+    assert entry["unconverted"] == []
+
+
+def test_single_pass(mocker, toml_obj):
+    org_toml = toml_obj("tests/files/poetry_pyproject.toml")
+    spy = mocker.spy(convert_poetry2uv, "copy_rule")
+    mocker.patch.dict(convert_poetry2uv.RULES, {"name": spy, "version": spy})
+    convert_poetry2uv.convert_document(org_toml, Path("."))
+    assert [call.args[1] for call in spy.call_args_list] == ["name", "version"]
+
+
 def test_empty_group_dependencies(org_toml, pyproject_empty_base):
     del org_toml["tool"]["poetry"]["group"]
-    convert_poetry2uv.group_dependencies(pyproject_empty_base, org_toml)
+    run_rules(pyproject_empty_base, org_toml, "group")
     assert pyproject_empty_base == {"project": {}}
 
 
@@ -338,7 +599,7 @@ def test_plugins(pyproject_empty_base):
     """
     in_dict = tomlkit.loads(in_txt)
     expected = tomlkit.loads(exp_txt)
-    convert_poetry2uv.poetry_plugins(pyproject_empty_base, in_dict)
+    run_rules(pyproject_empty_base, in_dict, "plugins")
     assert pyproject_empty_base == expected
 
 
@@ -368,3 +629,1519 @@ def test_main(mocker, tmp_path):
     should_match = Path("tests/files/uv_pyproject.toml").read_text()
     generated_toml_txt = filename.read_text()
     assert generated_toml_txt == should_match
+
+
+@pytest.fixture
+def poetry_tree(tmp_path):
+    src = "tests/files/poetry_pyproject.toml"
+    for name in ("one", "two", "nested/three"):
+        tmp_path.joinpath(name).mkdir(parents=True)
+        shutil.copy(src, tmp_path.joinpath(name, "pyproject.toml"))
+    tmp_path.joinpath("uv_project").mkdir()
+    tmp_path.joinpath("uv_project", "pyproject.toml").write_text(
+        '[project]\nname = "x"\n'
+    )
+    tmp_path.joinpath(".venv", "lib").mkdir(parents=True)
+    shutil.copy(src, tmp_path.joinpath(".venv", "lib", "pyproject.toml"))
+    return tmp_path
+
+
+def test_find_projects(poetry_tree):
+    found = list(convert_poetry2uv.find_projects([str(poetry_tree)]))
+    assert [p.parent.relative_to(poetry_tree).as_posix() for p in found] == [
+        "nested/three",
+        "one",
+        "two",
+        "uv_project",
+    ]
+
+
+def test_find_projects_glob(poetry_tree):
+    found = list(convert_poetry2uv.find_projects([f"{poetry_tree}/t*/pyproject.toml"]))
+    assert found == [poetry_tree.joinpath("two", "pyproject.toml")]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_batch(poetry_tree, jobs):
+    summary = convert_poetry2uv.batch(
+        [str(poetry_tree)], convert_poetry2uv.Options(dry_run=True), jobs=jobs
+    )
+    assert summary == {"converted": 3, "skipped": 1}
+    should_match = Path("tests/files/uv_pyproject.toml").read_text()
+    for name in ("one", "two", "nested/three"):
+        output = poetry_tree.joinpath(name, "pyproject_temp_uv.toml")
+        assert output.read_text() == should_match
+    assert not poetry_tree.joinpath("uv_project", "pyproject_temp_uv.toml").exists()
+
+
+def test_bounded_map():
+    from concurrent.futures import ThreadPoolExecutor
+
+    consumed = []
+
+    def source():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = convert_poetry2uv.bounded_map(
+            executor, lambda x, y: x * y, source(), itertools.repeat(2), window=4
+        )
+        assert next(results) == 0
+        assert len(consumed) == 5
+        assert list(results) == [i * 2 for i in range(1, 100)]
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_batch_io_concurrency(poetry_tree, dry_run):
+    shutil.copy("tests/files/poetry.lock", poetry_tree / "one" / "poetry.lock")
+    options = convert_poetry2uv.Options(
+        dry_run=dry_run, lock=True, cache_dir=poetry_tree / "cache"
+    )
+    summary = convert_poetry2uv.batch(
+        [str(poetry_tree)], options, jobs=2, io_concurrency=4
+    )
+    assert summary == {"converted": 3, "skipped": 1}
+    should_match = Path("tests/files/uv_pyproject.toml").read_text()
+    output = "pyproject_temp_uv.toml" if dry_run else "pyproject.toml"
+    for name in ("one", "two", "nested/three"):
+        assert poetry_tree.joinpath(name, output).read_text() == should_match
+    lock = "uv_temp.lock" if dry_run else "uv.lock"
+    assert poetry_tree.joinpath("one", lock).exists()
+    if dry_run:
+        summary = convert_poetry2uv.batch(
+            [str(poetry_tree)], options, jobs=2, io_concurrency=4
+        )
+        assert summary == {"converted": 3, "skipped": 1}
+
+
+def test_batch_io_concurrency_overlaps_reads(mocker, poetry_tree):
+    read_bytes = Path.read_bytes
+
+    def slow_read_bytes(path):
+        time.sleep(0.2)
+        return read_bytes(path)
+
+    mocker.patch.object(Path, "read_bytes", slow_read_bytes)
+    options = convert_poetry2uv.Options(dry_run=True)
+    start = time.perf_counter()
+    summary = convert_poetry2uv.batch(
+        [str(poetry_tree)], options, jobs=1, io_concurrency=4
+    )
+    assert summary == {"converted": 3, "skipped": 1}
+    assert time.perf_counter() - start < 4 * 0.2
+
+
+def test_batch_io_concurrency_failure(tmp_path, capsys):
+    tmp_path.joinpath("pyproject.toml").write_text(
+        '[tool.poetry]\nname = "x"\nversion = "1"\n\n'
+        '[tool.poetry.dependencies]\nfoo = "latest"\n'
+    )
+    summary = convert_poetry2uv.batch(
+        [str(tmp_path)], convert_poetry2uv.Options(dry_run=True), io_concurrency=2
+    )
+    assert summary == {"failed": 1}
+    assert "ConstraintError: Unsupported version constraint" in capsys.readouterr().out
+
+
+def test_batch_failure(tmp_path, capsys):
+    tmp_path.joinpath("pyproject.toml").write_text(
+        '[tool.poetry]\nname = "x"\nversion = "1"\n\n'
+        '[tool.poetry.dependencies]\nfoo = "latest"\n'
+    )
+    summary = convert_poetry2uv.batch(
+        [str(tmp_path)], convert_poetry2uv.Options(dry_run=True), jobs=1
+    )
+    assert summary == {"failed": 1}
+    assert "FAILED" in capsys.readouterr().out
+
+
+def test_main_batch(mocker, poetry_tree):
+    mocker.patch(
+        "sys.argv",
+        ["convert_poetry2uv.py", str(poetry_tree / "one"), str(poetry_tree / "two")],
+    )
+    convert_poetry2uv.main()
+    assert poetry_tree.joinpath("one", "pyproject.toml.org").exists()
+    assert poetry_tree.joinpath("two", "pyproject.toml.org").exists()
+    assert not poetry_tree.joinpath("nested", "three", "pyproject.toml.org").exists()
+
+
+def test_index_record():
+    poetry = {
+        "name": "x",
+        "version": "1",
+        "dependencies": {
+            "python": "^3.12",
+            "Requests": {"version": "^2.28", "extras": ["socks"], "optional": True},
+            "internal": {"version": "*", "source": "private"},
+            "lib": {"git": "https://example.com/lib.git", "tag": "v1"},
+        },
+        "group": {
+            "dev": {
+                "dependencies": {
+                    "mypy": {"version": "~1.2", "markers": "os_name == 'posix'"}
+                }
+            }
+        },
+        "source": [{"name": "private", "url": "https://pypi.example.com/simple"}],
+    }
+    record = convert_poetry2uv.index_record(poetry)
+    assert record["name"] == "x"
+    assert record["version"] == "1"
+    assert record["dependencies"] == [
+        {
+            "name": "requests",
+            "group": "main",
+            "constraint": "^2.28",
+            "specifier": "<3.0,>=2.28",
+            "extras": "socks",
+            "markers": None,
+            "optional": True,
+            "source": None,
+            "url": None,
+        },
+        {
+            "name": "internal",
+            "group": "main",
+            "constraint": "*",
+            "specifier": "",
+            "extras": "",
+            "markers": None,
+            "optional": False,
+            "source": "private",
+            "url": "https://pypi.example.com/simple",
+        },
+        {
+            "name": "lib",
+            "group": "main",
+            "constraint": "*",
+            "specifier": "",
+            "extras": "",
+            "markers": None,
+            "optional": False,
+            "source": None,
+            "url": "https://example.com/lib.git",
+        },
+        {
+            "name": "mypy",
+            "group": "dev",
+            "constraint": "~1.2",
+            "specifier": "<1.3,>=1.2",
+            "extras": "",
+            "markers": "os_name == 'posix'",
+            "optional": False,
+            "source": None,
+            "url": None,
+        },
+    ]
+
+
+def index_rows(index_file, query, *parameters):
+    import sqlite3
+
+    with contextlib.closing(sqlite3.connect(index_file)) as index:
+        return index.execute(query, parameters).fetchall()
+
+
+@pytest.mark.parametrize("io_concurrency", [None, 2])
+def test_batch_index_db(poetry_tree, io_concurrency):
+    index_file = poetry_tree / "deps.sqlite"
+    options = convert_poetry2uv.Options(
+        dry_run=True, index_file=index_file, cache_dir=poetry_tree / "cache"
+    )
+    convert_poetry2uv.batch([str(poetry_tree)], options, io_concurrency=io_concurrency)
+    projects = index_rows(index_file, "SELECT path, name FROM projects ORDER BY path")
+    assert projects == [
+        (str(poetry_tree / name / "pyproject.toml"), "name of the project")
+        for name in ("nested/three", "one", "two")
+    ]
+    query = (
+        "SELECT p.path, d.group_name, d.specifier FROM dependencies d "
+        "JOIN projects p ON p.id = d.project_id WHERE d.name = ? ORDER BY p.path"
+    )
+    assert index_rows(index_file, query, "jira")[1] == (
+        str(poetry_tree / "one" / "pyproject.toml"),
+        "main",
+        "<4.0.0,>=3.8.0",
+    )
+    assert len(index_rows(index_file, query, "mypy")) == 3
+
+    # A later run replaces what changed, keeps the rest and drops removed projects.
+    two = poetry_tree / "two" / "pyproject.toml"
+    two.write_text(two.read_text().replace('jira = "^3.8.0"', 'jira = "^3.9"'))
+    shutil.rmtree(poetry_tree / "nested")
+    convert_poetry2uv.batch(
+        [str(poetry_tree / "two")], options, io_concurrency=io_concurrency
+    )
+    assert index_rows(index_file, query, "jira") == [
+        (str(poetry_tree / "one" / "pyproject.toml"), "main", "<4.0.0,>=3.8.0"),
+        (str(two), "main", "<4.0,>=3.9"),
+    ]
+    assert len(index_rows(index_file, "SELECT * FROM dependencies")) == 12
+
+
+@pytest.mark.parametrize("io_concurrency", [None, 2])
+def test_batch_index_db_cached(poetry_tree, mocker, capsys, io_concurrency):
+    cache_dir = poetry_tree / "cache"
+    options = convert_poetry2uv.Options(dry_run=True, cache_dir=cache_dir)
+    record = mocker.spy(convert_poetry2uv, "index_record")
+    convert_poetry2uv.batch([str(poetry_tree)], options, io_concurrency=io_concurrency)
+    assert not record.called
+    # The cache entries made without the index get their index_record now.
+    options = options._replace(index_file=poetry_tree / "deps.sqlite")
+    summary = convert_poetry2uv.batch(
+        [str(poetry_tree)], options, io_concurrency=io_concurrency
+    )
+    assert summary["converted"] == 3
+    assert "Cache hits: 3/4" in capsys.readouterr().out
+    assert len(index_rows(options.index_file, "SELECT * FROM projects")) == 3
+
+
+def test_main_index_db(mocker, poetry_tree):
+    index_file = poetry_tree / "deps.sqlite"
+    project_file = poetry_tree / "one" / "pyproject.toml"
+    argv = ["convert_poetry2uv.py", str(project_file), "--index-db", str(index_file)]
+    mocker.patch("sys.argv", argv)
+    convert_poetry2uv.main()
+    assert index_rows(index_file, "SELECT name, version FROM projects") == [
+        ("name of the project", "0.1.0")
+    ]
+    # Converted in place, the project is skipped next time and keeps its rows.
+    convert_poetry2uv.main()
+    assert len(index_rows(index_file, "SELECT * FROM dependencies")) == 6
+    mocker.patch("sys.argv", [*argv, "--check"])
+    with pytest.raises(SystemExit):
+        convert_poetry2uv.main()
+
+
+@pytest.fixture
+def git_tree(poetry_tree, monkeypatch):
+    def git(*args):
+        subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+            + list(args),
+            cwd=poetry_tree,
+            check=True,
+            capture_output=True,
+        )
+
+    git("init", "-q")
+    git("add", "-A")
+    git("commit", "-q", "-m", "initial")
+    monkeypatch.chdir(poetry_tree)
+    return git
+
+
+def test_changed_projects(git_tree, poetry_tree):
+    assert list(convert_poetry2uv.changed_projects(["."], "HEAD")) == []
+    with poetry_tree.joinpath("two", "pyproject.toml").open("a") as f:
+        f.write("\n")
+    poetry_tree.joinpath("nested", "three", "LICENSE").write_text("MIT")
+    poetry_tree.joinpath("one", "README.md").write_text("not a project file")
+    poetry_tree.joinpath(".venv", "lib", "poetry.lock").write_text("")
+    found = list(convert_poetry2uv.changed_projects(["."], "HEAD"))
+    assert found == [Path("nested/three/pyproject.toml"), Path("two/pyproject.toml")]
+    found = list(convert_poetry2uv.changed_projects(["nested"], "HEAD"))
+    assert found == [Path("nested/three/pyproject.toml")]
+
+    git_tree("add", "-A")
+    git_tree("commit", "-q", "-m", "change")
+    assert list(convert_poetry2uv.changed_projects(["."], "HEAD")) == []
+    found = list(convert_poetry2uv.changed_projects(["."], "HEAD~1"))
+    assert found == [Path("nested/three/pyproject.toml"), Path("two/pyproject.toml")]
+
+
+def test_changed_projects_merge_base(git_tree, poetry_tree):
+    git_tree("branch", "base")
+    git_tree("checkout", "-q", "-b", "feature")
+    with poetry_tree.joinpath("one", "pyproject.toml").open("a") as f:
+        f.write("\n")
+    git_tree("commit", "-q", "-am", "feature change")
+    git_tree("checkout", "-q", "base")
+    poetry_tree.joinpath("nested", "three", "LICENSE").write_text("MIT")
+    git_tree("add", "-A")
+    git_tree("commit", "-q", "-m", "base change")
+    git_tree("checkout", "-q", "feature")
+    with poetry_tree.joinpath("two", "pyproject.toml").open("a") as f:
+        f.write("\n")
+    found = list(convert_poetry2uv.changed_projects(["."], "base..."))
+    assert found == [Path("one/pyproject.toml"), Path("two/pyproject.toml")]
+
+
+def test_main_since(mocker, git_tree, poetry_tree):
+    poetry_tree.joinpath("one", "poetry.lock").write_text("")
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", "--since", "HEAD"])
+    convert_poetry2uv.main()
+    assert poetry_tree.joinpath("one", "pyproject.toml.org").exists()
+    assert not poetry_tree.joinpath("two", "pyproject.toml.org").exists()
+
+
+def test_main_since_unknown_ref(mocker, git_tree):
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", ".", "--since", "nope"])
+    with pytest.raises(SystemExit, match="git diff failed"):
+        convert_poetry2uv.main()
+
+
+def test_cache_hit(mocker, tmp_path):
+    shutil.copy("tests/files/poetry_pyproject.toml", tmp_path / "pyproject.toml")
+    options = convert_poetry2uv.Options(dry_run=True, cache_dir=tmp_path / "cache")
+    result = convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    assert not result.cached
+    tmp_path.joinpath("pyproject_temp_uv.toml").unlink()
+
+    loads = mocker.spy(convert_poetry2uv.tk, "loads")
+    result = convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    assert result.cached
+    assert loads.call_count == 0
+    should_match = Path("tests/files/uv_pyproject.toml").read_text()
+    assert tmp_path.joinpath("pyproject_temp_uv.toml").read_text() == should_match
+
+
+def test_cache_license_file_invalidates(tmp_path):
+    shutil.copy("tests/files/poetry_pyproject.toml", tmp_path / "pyproject.toml")
+    options = convert_poetry2uv.Options(dry_run=True, cache_dir=tmp_path / "cache")
+    convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    tmp_path.joinpath("LICENSE").touch()
+    result = convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    assert not result.cached
+    output = tmp_path.joinpath("pyproject_temp_uv.toml").read_text()
+    assert 'license = { file = "LICENSE" }' in output
+
+
+def test_cache_skipped_project(mocker, tmp_path):
+    tmp_path.joinpath("pyproject.toml").write_text('[project]\nname = "poetry-x"\n')
+    options = convert_poetry2uv.Options(cache_dir=tmp_path / "cache")
+    convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    loads = mocker.spy(convert_poetry2uv.tk, "loads")
+    result = convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    assert (result.outcome, result.cached) == ("skipped", True)
+    assert loads.call_count == 0
+
+
+def test_prune_cache(tmp_path):
+    for i in range(4):
+        entry = tmp_path.joinpath("ab", f"ab{i}.json")
+        entry.parent.mkdir(exist_ok=True)
+        entry.write_text("x" * 100)
+        os.utime(entry, (i, i))
+    convert_poetry2uv.prune_cache(tmp_path, 250)
+    assert sorted(p.name for p in tmp_path.glob("*/*.json")) == ["ab2.json", "ab3.json"]
+
+
+def test_main_prunes_cache_once_a_day(mocker, tmp_path):
+    cache_dir = tmp_path / "cache"
+    mocker.patch.dict(os.environ, {"CONVERT_POETRY2UV_CACHE_DIR": str(cache_dir)})
+    prune = mocker.spy(convert_poetry2uv, "prune_cache")
+    for name in ("one", "two"):
+        tmp_path.joinpath(name).mkdir()
+        project_file = tmp_path / name / "pyproject.toml"
+        source = Path("tests/files/poetry_pyproject.toml").read_text()
+        project_file.write_text(f"{source}# {name}\n")
+        mocker.patch("sys.argv", ["convert_poetry2uv.py", str(project_file), "-n"])
+        convert_poetry2uv.main()
+    assert prune.call_count == 1
+    day_ago = time.time() - convert_poetry2uv.PRUNE_INTERVAL
+    os.utime(cache_dir / "pruned", (day_ago, day_ago))
+    project_file.write_text(source)
+    convert_poetry2uv.main()
+    assert prune.call_count == 2
+
+
+def test_main_no_cache(mocker, tmp_path):
+    shutil.copy("tests/files/poetry_pyproject.toml", tmp_path / "pyproject.toml")
+    mocker.patch(
+        "sys.argv",
+        ["convert_poetry2uv.py", str(tmp_path / "pyproject.toml"), "-n", "--no-cache"],
+    )
+    convert_poetry2uv.main()
+    assert not any(convert_poetry2uv.default_cache_dir().glob("*/*.json"))
+
+
+def test_parse_packages_plain_dicts():
+    deps = {
+        "pinned": {"version": "^1.2"},
+        "linux": {"version": "^1.0", "markers": "sys_platform == 'linux'"},
+        "local": {"path": "../local", "develop": True},
+    }
+    with convert_poetry2uv.collect_warnings() as warnings:
+        uv_deps, _, _ = convert_poetry2uv.parse_packages(deps)
+    assert uv_deps == [
+        "pinned>=1.2,<2.0",
+        "linux>=1.0,<2.0 ; sys_platform == 'linux'",
+    ]
+    assert warnings == ["Dependency 'local': path dependencies are not converted"]
+
+
+VERIFY_POETRY = """
+[tool.poetry]
+name = "x"
+version = "1.0"
+
+[tool.poetry.dependencies]
+python = "^3.12"
+requests = { version = "^2.31", extras = ["socks", "security"] }
+pinned = { version = "~1.2" }
+linux = { version = "*", markers = "sys_platform == 'linux'" }
+jira = { version = "^3.8.0", optional = true }
+private = { version = "^1.0", source = "private" }
+httpx = { git = "https://github.com/encode/httpx.git", tag = "0.27.0" }
+local = { path = "../local" }
+
+[tool.poetry.group.test.dependencies]
+pytest = "^8.0"
+extra = { version = "^1.0", optional = true }
+
+[tool.poetry.extras]
+JIRA = ["jira"]
+all = ["jira", "extra"]
+
+[[tool.poetry.source]]
+name = "private"
+url = "https://example.com/simple"
+priority = "explicit"
+
+[tool.poetry.scripts]
+x = "x.cli:main"
+
+[tool.poetry.plugins."x.plugins"]
+one = "x.plugins:one"
+"""
+
+
+def test_verify():
+    poetry = tomllib.loads(VERIFY_POETRY)
+    uv = tomllib.loads(convert_poetry2uv.convert(VERIFY_POETRY))
+    assert convert_poetry2uv.verify(poetry, uv) == [
+        "missing dependencies: local path ../local"
+    ]
+
+    uv["project"]["dependencies"].remove("pinned>=1.2,<1.3")
+    uv["project"]["dependencies"][1] = "requests[security]>=2.0"
+    uv["project"]["optional-dependencies"]["all"] = ["jira>=3.8.0,<4.0.0"]
+    uv["project"]["scripts"]["y"] = "x.cli:other"
+    del uv["tool"]["uv"]["sources"]["httpx"]
+    assert convert_poetry2uv.verify(poetry, uv) == [
+        "missing dependencies: local path ../local",
+        "missing dependencies: pinned <1.3,>=1.2",
+        "changed dependencies: requests: [security,socks]<3.0,>=2.31 -> "
+        "[security,socks]<3.0,>=2.31 | >=2.0",
+        "missing optional-dependencies.all: extra <2.0,>=1.0",
+        'added scripts: y "x.cli:other"',
+        'missing tool.uv.sources: httpx {"git": '
+        '"https://github.com/encode/httpx.git", "tag": "0.27.0"}',
+    ]
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_batch_verify(poetry_tree, dry_run):
+    options = convert_poetry2uv.Options(dry_run=dry_run)
+    convert_poetry2uv.batch([str(poetry_tree)], options, jobs=1)
+    verify = convert_poetry2uv.Options(dry_run=dry_run, verify=True)
+    summary = convert_poetry2uv.batch([str(poetry_tree)], verify, jobs=2)
+    assert summary == {"verified": 3, "skipped": 1}
+
+    uv_file = "pyproject_temp_uv.toml" if dry_run else "pyproject.toml"
+    output = poetry_tree / "one" / uv_file
+    output.write_text(output.read_text().replace('"ruff",\n', ""))
+    summary = convert_poetry2uv.batch([str(poetry_tree)], verify, jobs=1)
+    assert summary == {"verified": 2, "mismatch": 1, "skipped": 1}
+
+
+def test_main_verify_mismatch(mocker, tmp_path, capsys):
+    tmp_path.joinpath("pyproject.toml").write_text(VERIFY_POETRY)
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", "-n", str(tmp_path)])
+    convert_poetry2uv.main()
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", "-n", "--verify", str(tmp_path)])
+    with pytest.raises(SystemExit):
+        convert_poetry2uv.main()
+    out = capsys.readouterr().out
+    assert "MISMATCH" in out
+    assert "missing dependencies: local path ../local" in out
+
+
+def test_analyze():
+    in_txt = """
+    [tool.poetry]
+    name = "x"
+    version = "1"
+    packages = [{ include = "x" }]
+
+    [tool.poetry.dependencies]
+    python = "^3.12"
+    local = { path = "../local", develop = true }
+    requests = { version = "^2.13.0", source = "private" }
+    extra = { version = "^1.0", extras = ["all"], markers = "sys_platform == 'linux'" }
+    broken = "latest"
+    alt = "^1.0 || ^3.0"
+
+    [tool.poetry.group.dev.dependencies]
+    other = { version = "^1.0", source = "missing" }
+
+    [[tool.poetry.source]]
+    name = "private"
+    url = "http://example.com/simple"
+    """
+    findings = convert_poetry2uv.analyze(tomllib.loads(in_txt))
+    assert findings == [
+        ("unsupported", "main dependency 'local': path is not converted"),
+        ("unsupported", "main dependency 'local': develop is not converted"),
+        ("unsupported", "main dependency 'local': dependency is dropped"),
+        (
+            "failed",
+            "main dependency 'broken': Unsupported version constraint: 'latest'",
+        ),
+        (
+            "info",
+            "main dependency 'alt': Version '^1.0 || ^3.0' translated to "
+            "'>=1.0,<4.0': the gap between the alternatives is included",
+        ),
+        ("failed", "dev dependency 'other': source 'missing' is not defined"),
+        ("unsupported", "tool.poetry.packages is not converted"),
+    ]
+
+
+def test_check_batch(poetry_tree, mocker, capsys):
+    poetry_tree.joinpath("two", "pyproject.toml").write_text(
+        '[tool.poetry]\nname = "x"\nversion = "1"\n\n'
+        '[tool.poetry.dependencies]\nfoo = { path = "../foo" }\n'
+    )
+    loads = mocker.spy(convert_poetry2uv.tk, "loads")
+    options = convert_poetry2uv.Options(check=True)
+    summary = convert_poetry2uv.batch([str(poetry_tree)], options, jobs=1)
+    assert summary == {"ok": 2, "unsupported": 1, "skipped": 1}
+    assert loads.call_count == 0
+    assert not list(poetry_tree.glob("**/pyproject_temp_uv.toml"))
+    assert "main dependency 'foo': path is not converted" in capsys.readouterr().out
+
+
+def test_main_check(mocker, tmp_path):
+    filename = tmp_path.joinpath("pyproject.toml")
+    filename.write_text('[tool.poetry]\nversion = "1"\n')
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", str(filename), "--check"])
+    with pytest.raises(SystemExit):
+        convert_poetry2uv.main()
+    assert not tmp_path.joinpath("pyproject.toml.org").exists()
+
+
+def test_convert_lock(tmp_path):
+    shutil.copy("tests/files/poetry_lock_pyproject.toml", tmp_path / "pyproject.toml")
+    shutil.copy("tests/files/poetry.lock", tmp_path / "poetry.lock")
+    options = convert_poetry2uv.Options(lock=True)
+    convert_poetry2uv.convert_project(tmp_path / "pyproject.toml", options)
+    should_match = Path("tests/files/uv.lock").read_text()
+    assert tmp_path.joinpath("uv.lock").read_text() == should_match
+
+
+def test_convert_lock_extras(tmp_path):
+    lock = Path("tests/files/poetry.lock").read_text()
+    lock = lock.replace(
+        'certifi = ">=2017.4.17"',
+        'certifi = {version = ">=2017.4.17", extras = ["ca"]}',
+    )
+    lock = lock.replace(
+        "[metadata]",
+        '[[package]]\nname = "PySocks"\nversion = "1.7.1"\nfiles = []\n\n[metadata]',
+    )
+    tmp_path.joinpath("poetry.lock").write_text(lock)
+    pyproject = {"project": {"name": "x", "version": "1"}}
+    output_file = tmp_path / "uv.lock"
+    assert convert_poetry2uv.convert_lock(
+        tmp_path / "poetry.lock", pyproject, output_file
+    )
+    uv_lock = tomllib.loads(output_file.read_text())
+    requests = next(p for p in uv_lock["package"] if p["name"] == "requests")
+    assert requests["dependencies"][0] == {"name": "certifi", "extra": ["ca"]}
+    assert requests["optional-dependencies"] == {"socks": [{"name": "pysocks"}]}
+
+
+def test_convert_lock_several_versions(tmp_path, capsys):
+    package = (
+        '[[package]]\nname = "numpy"\nversion = "{}"\nfiles = []\n'
+        'markers = "python_version {} \\"3.9\\""\n\n'
+    )
+    tmp_path.joinpath("poetry.lock").write_text(
+        package.format("1.24.4", "<") + package.format("2.1.0", ">=")
+    )
+    pyproject = {"project": {"name": "x", "version": "1"}}
+    output_file = tmp_path / "uv.lock"
+    assert not convert_poetry2uv.convert_lock(
+        tmp_path / "poetry.lock", pyproject, output_file
+    )
+    assert not output_file.exists()
+    assert "numpy is locked at several versions" in capsys.readouterr().out
+
+
+def test_convert_lock_private_index(tmp_path, capsys):
+    lock = Path("tests/files/poetry.lock").read_text()
+    lock = lock.replace(
+        "[package.dependencies]",
+        '[package.source]\ntype = "legacy"\nurl = "https://example.com/simple"\n'
+        'reference = "private"\n\n[package.dependencies]',
+    )
+    tmp_path.joinpath("poetry.lock").write_text(lock)
+    pyproject = {"project": {"name": "x", "version": "1"}}
+    output_file = tmp_path / "uv.lock"
+    assert not convert_poetry2uv.convert_lock(
+        tmp_path / "poetry.lock", pyproject, output_file
+    )
+    assert not output_file.exists()
+    assert "unsupported source for requests" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    "requirement, parsed",
+    [
+        ("pytest", {"name": "pytest"}),
+        ("Jira>=3.8.0,<4.0.0", {"name": "jira", "specifier": ">=3.8.0,<4.0.0"}),
+        (
+            "pandas[computation]>=2.2.1",
+            {"name": "pandas", "extras": ["computation"], "specifier": ">=2.2.1"},
+        ),
+        (
+            "colorama; sys_platform == 'win32'",
+            {"name": "colorama", "marker": "sys_platform == 'win32'"},
+        ),
+    ],
+)
+def test_parse_requirement(requirement, parsed):
+    assert convert_poetry2uv.parse_requirement(requirement) == parsed
+
+
+@pytest.mark.parametrize(
+    "requirement, valid",
+    [
+        ("pytest", True),
+        ("pandas[computation,performance]>=2.2.1,<3.0.0", True),
+        ("x==1.2.*", True),
+        ("x~=1.4.2", True),
+        ("x (>=1.0a1,!=1.5+local)", True),
+        ("x @ https://example.com/x.whl", True),
+        ("x ; python_version < '3.8'", True),
+        (
+            "x>=1 ; sys_platform == 'linux' and (extra == \"a\" or os_name in 'nt')",
+            True,
+        ),
+        ("x>=^1.2", False),
+        ("x==1.*.2", False),
+        ("x~=1", False),
+        ("x>=1,", False),
+        ("x y", False),
+        ("x ; python_version <<< '3'", False),
+        ("x ; unknown == '1'", False),
+        ("x ; (python_version < '3'", False),
+    ],
+)
+def test_valid_requirement(requirement, valid):
+    assert convert_poetry2uv.valid_requirement(requirement) is valid
+
+
+def test_validate():
+    new_toml = {
+        "project": {
+            "requires-python": "^3.12",
+            "dependencies": ["ok", "bad>=^1"],
+            "optional-dependencies": {"extra": ["ok>=1"]},
+        },
+        "dependency-groups": {"dev": ["x ; bogus", {"include-group": "docs"}]},
+    }
+    assert convert_poetry2uv.validate(new_toml) == [
+        "project.dependencies: 'bad>=^1' is not a valid requirement",
+        "dependency-groups.dev: 'x ; bogus' is not a valid requirement",
+        "project.requires-python: '^3.12' is not a valid specifier",
+    ]
+
+
+def test_invalid_output_is_not_written(tmp_path):
+    tmp_path.joinpath("pyproject.toml").write_text(
+        '[tool.poetry]\nname = "x"\nversion = "1"\n'
+        '[tool.poetry.dependencies]\nx = {version = "^1", markers = "os = 1"}\n'
+    )
+    summary = convert_poetry2uv.batch([str(tmp_path)], convert_poetry2uv.Options())
+    assert summary["failed"] == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["pyproject.toml"]
+
+
+def test_profile(poetry_tree):
+    options = convert_poetry2uv.Options(
+        dry_run=True,
+        profile_file=poetry_tree / "profile.json",
+        trace_file=poetry_tree / "trace.json",
+    )
+    convert_poetry2uv.batch([str(poetry_tree)], options, jobs=1)
+    profile = json.loads(poetry_tree.joinpath("profile.json").read_text())
+    assert len(profile["files"]) == 4
+    stages = [record["stage"] for record in profile["files"][0]["stages"]]
+    assert {"read", "tk.loads", "tool.poetry.name", "tools", "format"} <= set(stages)
+    assert profile["stages"]["tool.poetry.dependencies"]["count"] == 3
+    assert all(record["peak_memory"] > 0 for record in profile["files"][0]["stages"])
+    trace = json.loads(poetry_tree.joinpath("trace.json").read_text())
+    assert {event["ph"] for event in trace["traceEvents"]} == {"X"}
+
+
+def test_stage_without_profiling():
+    with convert_poetry2uv.stage("noop"):
+        pass
+    assert convert_poetry2uv._profile is None
+
+
+def test_log(poetry_tree):
+    poetry_tree.joinpath("two", "pyproject.toml").write_text(
+        '[tool.poetry]\nname = "x"\nversion = "1"\npackages = []\n\n'
+        '[tool.poetry.dependencies]\nfoo = "latest"\n'
+    )
+    log_file = poetry_tree / "log.jsonl"
+    options = convert_poetry2uv.Options(dry_run=True, log_file=str(log_file))
+    convert_poetry2uv.batch([str(poetry_tree)], options, jobs=1)
+    events = {
+        Path(event["path"]).parent.name: event
+        for event in map(json.loads, log_file.read_text().splitlines())
+    }
+    assert {name: event["outcome"] for name, event in events.items()} == {
+        "three": "converted",
+        "one": "converted",
+        "two": "failed",
+        "uv_project": "skipped",
+    }
+    assert events["one"]["warnings"] == [
+        "Poetry build system detected. Replaced with hatchling"
+    ]
+    output = poetry_tree.joinpath("one", "pyproject_temp_uv.toml").read_bytes()
+    assert events["one"]["output_hash"] == hashlib.sha256(output).hexdigest()
+    assert events["two"]["error"] == "Unsupported version constraint: 'latest'"
+
+
+def test_log_cached_warnings(mocker, tmp_path, capsys):
+    filename = tmp_path.joinpath("pyproject.toml")
+    filename.write_text(
+        '[tool.poetry]\nname = "x"\nversion = "1"\npackages = []\n'
+        'authors = ["(unknown)"]\n'
+    )
+    mocker.patch(
+        "sys.argv", ["convert_poetry2uv.py", str(filename), "-n", "--log", "-"]
+    )
+    convert_poetry2uv.main()
+    convert_poetry2uv.main()
+    captured = capsys.readouterr()
+    # Only the JSON lines go to stdout, the messages to stderr.
+    first, second = map(json.loads, captured.out.splitlines())
+    assert "Dry_run enabled" in captured.err
+    assert (first["cached"], second["cached"]) == (False, True)
+    assert (
+        first["warnings"]
+        == second["warnings"]
+        == ["Unknown author authors format: (unknown)"]
+    )
+    assert first["unconverted"] == second["unconverted"] == ["packages"]
+
+
+def test_log_stdout_batch(poetry_tree, mocker, capsys):
+    argv = ["convert_poetry2uv.py", str(poetry_tree), "-n", "-j", "1", "--log", "-"]
+    mocker.patch("sys.argv", argv)
+    convert_poetry2uv.main()
+    captured = capsys.readouterr()
+    assert len([json.loads(line) for line in captured.out.splitlines()]) == 4
+    assert "Processed 4 files" in captured.err
+
+
+def test_atomic_write(tmp_path):
+    target = tmp_path / "pyproject.toml"
+    target.write_text("old")
+    target.chmod(0o640)
+    convert_poetry2uv.atomic_write(target, b"new", fsync=True)
+    assert target.read_text() == "new"
+    assert target.stat().st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["pyproject.toml"]
+
+
+def test_backup_keeps_mode(tmp_path):
+    filename = tmp_path / "pyproject.toml"
+    shutil.copy("tests/files/poetry_pyproject.toml", filename)
+    filename.chmod(0o640)
+    convert_poetry2uv.convert_project(filename, convert_poetry2uv.Options())
+    assert tmp_path.joinpath("pyproject.toml.org").stat().st_mode & 0o777 == 0o640
+    assert filename.stat().st_mode & 0o777 == 0o640
+
+
+def test_interrupted_write_keeps_pyproject(mocker, tmp_path):
+    filename = tmp_path / "pyproject.toml"
+    shutil.copy("tests/files/poetry_pyproject.toml", filename)
+    original = filename.read_text()
+    replace = os.replace
+    calls = []
+
+    def interrupted_replace(src, dst):
+        calls.append(dst)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        replace(src, dst)
+
+    mocker.patch("os.replace", side_effect=interrupted_replace)
+    with pytest.raises(KeyboardInterrupt):
+        convert_poetry2uv.convert_project(filename, convert_poetry2uv.Options())
+    assert filename.read_text() == original
+    assert tmp_path.joinpath("pyproject.toml.org").read_text() == original
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "pyproject.toml",
+        "pyproject.toml.org",
+    ]
+
+
+@pytest.mark.parametrize("fsync, syncs", [("always", 2), ("batch", 2), ("never", 0)])
+@pytest.mark.parametrize("io_concurrency", [None, 2])
+def test_fsync_policy(mocker, poetry_tree, tmp_path, fsync, syncs, io_concurrency):
+    os_fsync = mocker.patch("os.fsync", wraps=os.fsync)
+    os_sync = mocker.patch("os.sync")
+    options = convert_poetry2uv.Options(
+        dry_run=True, fsync=fsync, cache_dir=tmp_path / "cache"
+    )
+    convert_poetry2uv.batch(
+        [str(poetry_tree / "n*")], options, jobs=1, io_concurrency=io_concurrency
+    )
+    # The output file and its directory, but no cache entries.
+    assert os_fsync.call_count == syncs
+    assert not os_sync.called
+    assert not convert_poetry2uv.unsynced_files()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_fsync_batch_bounded(mocker, monkeypatch, poetry_tree, jobs):
+    monkeypatch.setattr(convert_poetry2uv, "SYNC_BATCH_SIZE", 2)
+    sync_outputs = mocker.patch("convert_poetry2uv.sync_outputs")
+    options = convert_poetry2uv.Options(dry_run=True, fsync="batch", cache_dir=None)
+    convert_poetry2uv.batch([str(poetry_tree)], options, jobs=jobs)
+    synced = [list(call.args[1]) for call in sync_outputs.call_args_list]
+    # Two outputs as soon as there are two, the third at the end of the run.
+    assert [len(files) for files in synced] == [2, 1]
+    assert {path.parent for files in synced for path in files} == {
+        poetry_tree / name for name in ("one", "two", "nested/three")
+    }
+
+
+def test_sync_outputs(mocker, tmp_path):
+    os_fsync = mocker.patch("os.fsync")
+    files = [tmp_path / "a", tmp_path / "b", tmp_path / "a"]
+    for path in files:
+        convert_poetry2uv.atomic_write(path, b"data", fsync=False)
+    assert convert_poetry2uv.unsynced_files() == files
+    assert not convert_poetry2uv.unsynced_files()
+    convert_poetry2uv.sync_outputs("batch", [*files, tmp_path / "gone"])
+    # Both files, and their directory once.
+    assert os_fsync.call_count == 3
+
+
+def test_convert(tmp_path):
+    text = Path("tests/files/poetry_pyproject.toml").read_text()
+    output = convert_poetry2uv.convert(text, tmp_path)
+    assert output == Path("tests/files/uv_pyproject.toml").read_text()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_convert_warnings(capsys):
+    text = Path("tests/files/poetry_pyproject.toml").read_text()
+    warnings = []
+    convert_poetry2uv.convert(text, warnings=warnings)
+    assert "Poetry build system detected. Replaced with hatchling" in warnings
+    convert_poetry2uv.convert(text)
+    assert capsys.readouterr() == ("", "")
+
+
+def test_format_toml_canonical():
+    text = Path("tests/files/uv_pyproject.toml").read_text()
+    assert convert_poetry2uv.format_toml(tomlkit.loads(text)) == text
+    messy = text.replace("\n\n", "\n\n\n\n").replace("{ ", "{").replace(" }", "}")
+    assert convert_poetry2uv.format_toml(tomlkit.loads(messy)) == text
+
+
+def test_format_toml_layout():
+    text = """
+[tool.x]
+b = 'lit\\d'  # keep
+a.b = 1
+
+
+[[tool.x.jobs]]
+n = 0x10
+[tool.x.empty]
+
+[build-system]
+requires = ["hatchling"]
+[project]
+name = "x"
+dependencies = ["a"]
+urls = {Home="https://example.com"}
+short = [ 1,2 ]
+long = ["""
+    text += ", ".join(f'"{letter * 20}"' for letter in "abcd") + "]\n"
+    expected = """[project]
+name = "x"
+dependencies = [
+    "a",
+]
+urls = { Home = "https://example.com" }
+short = [1, 2]
+long = [
+    "aaaaaaaaaaaaaaaaaaaa",
+    "bbbbbbbbbbbbbbbbbbbb",
+    "cccccccccccccccccccc",
+    "dddddddddddddddddddd",
+]
+
+[build-system]
+requires = ["hatchling"]
+
+[tool.x]
+b = 'lit\\d'  # keep
+a.b = 1
+
+[[tool.x.jobs]]
+n = 0x10
+
+[tool.x.empty]
+"""
+    assert convert_poetry2uv.format_toml(tomlkit.loads(text)) == expected
+    assert tomllib.loads(expected) == tomlkit.loads(text).unwrap()
+
+
+def test_convert_without_tools(tmp_path):
+    text = '[tool.poetry]\nname = "x"\nversion = "1"\n'
+    output = convert_poetry2uv.convert(text, tmp_path)
+    assert output == '[project]\nname = "x"\nversion = "1"\n'
+
+
+def test_toml_tables():
+    text = """# top
+[tool.a]  # header
+s = "[x]\\\\" # "
+m = \"\"\"
+[not.a.header]
+\\\"\"\"\" \"\"
+t = { k = [
+    1,
+] }
+
+# about b
+[[ tool . "b.c" ]]
+x = '#'
+"""
+    tables = convert_poetry2uv.toml_tables(text)
+    assert [key for key, _ in tables] == [None, ("tool", "a"), ("tool", "b.c")]
+    assert "".join(table for _, table in tables) == text
+    assert tables[2][1].startswith("# about b\n")
+    assert convert_poetry2uv.toml_tables('a = "open\n[b]\n') is None
+    assert convert_poetry2uv.toml_tables("a = 1\r\n") is None
+
+
+def test_convert_passes_tool_tables_through(mocker, tmp_path):
+    black = """# black settings
+[tool.black]
+line-length=100   # wide
+select = [ "E",
+  "F" ]
+
+"""
+    text = Path("tests/files/poetry_pyproject.toml").read_text() + black
+    output = convert_poetry2uv.convert(text, tmp_path)
+    assert black.rstrip() + "\n" in output
+    mocker.patch.object(convert_poetry2uv.SplitDocument, "split", return_value=None)
+    full = convert_poetry2uv.convert(text, tmp_path)
+    assert "line-length = 100" in full
+    assert tomllib.loads(output) == tomllib.loads(full)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        'name = "x"\n[tool.poetry]\n',
+        '[tool]\nruff.line-length = 1\n[tool.poetry]\nname = "x"\n',
+        '[tool.poetry]\r\nname = "x"\r\n',
+    ],
+)
+def test_split_falls_back(text):
+    assert convert_poetry2uv.SplitDocument.split(text) is None
+
+
+def test_main_stdin(mocker, tmp_path, capsys, monkeypatch):
+    text = Path("tests/files/poetry_pyproject.toml").read_text()
+    expected = Path("tests/files/uv_pyproject.toml").read_text()
+    monkeypatch.setattr("sys.stdin", io.StringIO(text))
+    monkeypatch.chdir(tmp_path)
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", "-"])
+    convert_poetry2uv.main()
+    captured = capsys.readouterr()
+    assert captured.out == expected
+    assert "Replaced with hatchling" in captured.err
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_main_stdout_project_dir(mocker, tmp_path, capsys):
+    project_file = tmp_path / "pyproject.toml"
+    shutil.copy("tests/files/poetry_pyproject.toml", project_file)
+    license_dir = tmp_path / "licensed"
+    license_dir.mkdir()
+    license_dir.joinpath("LICENSE").touch()
+    argv = [str(project_file), "--stdout", "--project-dir", str(license_dir)]
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", *argv])
+    convert_poetry2uv.main()
+    assert 'license = { file = "LICENSE" }' in capsys.readouterr().out
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["licensed", "pyproject.toml"]
+
+
+def test_main_stdin_not_poetry(mocker, monkeypatch, capsys):
+    monkeypatch.setattr("sys.stdin", io.StringIO('[project]\nname = "x"\n'))
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", "-"])
+    with pytest.raises(SystemExit, match="Poetry section not found"):
+        convert_poetry2uv.main()
+    assert capsys.readouterr().out == ""
+
+
+def test_main_stdout_single_file_only(mocker):
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", "-", "--check"])
+    with pytest.raises(SystemExit):
+        convert_poetry2uv.main()
+
+
+def test_convert_not_poetry():
+    with pytest.raises(ValueError, match="Poetry section not found"):
+        convert_poetry2uv.convert('[project]\nname = "x"\n')
+
+
+def test_serve_stdin(mocker, capsys):
+    requests = [
+        {"id": 1, "path": "tests/files/poetry_pyproject.toml"},
+        {"id": 2, "text": '[tool.poetry]\nname = "x"\n'},
+    ]
+    stdin = io.StringIO("".join(json.dumps(r) + "\n" for r in requests) + "bad\n")
+    mocker.patch("sys.stdin", stdin)
+    convert_poetry2uv.serve()
+    first, second, third = map(json.loads, capsys.readouterr().out.splitlines())
+    assert first["output"] == Path("tests/files/uv_pyproject.toml").read_text()
+    assert first["warnings"] == [
+        "Poetry build system detected. Replaced with hatchling"
+    ]
+    assert second["id"] == 2
+    assert "version" in second["error"]
+    assert third["error"].startswith("Invalid request")
+
+
+def test_serve_socket(tmp_path):
+    socket_path = tmp_path / "convert.sock"
+    thread = threading.Thread(
+        target=convert_poetry2uv.serve, args=(socket_path,), daemon=True
+    )
+    thread.start()
+    for _ in range(100):
+        if socket_path.exists():
+            break
+        time.sleep(0.01)
+    with socket.socket(socket.AF_UNIX) as client:
+        client.connect(str(socket_path))
+        request = {"id": "a", "path": "tests/files/poetry_pyproject.toml"}
+        client.sendall(json.dumps(request).encode() + b"\n")
+        response = json.loads(client.makefile().readline())
+    assert response["id"] == "a"
+    assert response["output"] == Path("tests/files/uv_pyproject.toml").read_text()
+
+
+def test_argparser_requires_filename(mocker):
+    mocker.patch("sys.argv", ["convert_poetry2uv.py"])
+    with pytest.raises(SystemExit):
+        convert_poetry2uv.argparser()
+
+
+LAZY_MODULES = (
+    "re",
+    "dataclasses",
+    "argparse",
+    "pathlib",
+    "tomlkit",
+    "concurrent.futures",
+    "importlib.metadata",
+    "socketserver",
+    "tempfile",
+    "tarfile",
+    "sqlite3",
+    "zipfile",
+)
+
+
+def imported_modules(*args):
+    """Run python -X importtime and return {module: cumulative microseconds}."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        cwd=Path(convert_poetry2uv.__file__).parent,
+        check=True,
+    )
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_import_is_lazy():
+    modules = imported_modules("-c", "import convert_poetry2uv")
+    assert not set(LAZY_MODULES) & modules.keys()
+
+
+def test_cli_skips_non_poetry_without_heavy_imports(tmp_path, capfd):
+    project = tmp_path / "pyproject.toml"
+    project.write_text('[project]\nname = "x"\n')
+    modules = imported_modules("-m", "convert_poetry2uv", "--no-cache", str(project))
+    assert not set(LAZY_MODULES) & modules.keys()
+
+
+@pytest.mark.skipif(
+    not os.environ.get("TIMING_TESTS"), reason="wall-clock check, set TIMING_TESTS=1"
+)
+def test_cli_startup_time(tmp_path):
+    project = tmp_path / "pyproject.toml"
+    project.write_text('[project]\nname = "x"\n')
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    env["PYTHONPYCACHEPREFIX"] = str(tmp_path / "pycache")
+
+    def startup_time(*args):
+        times = []
+        for _ in range(6):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, *args],
+                check=True,
+                capture_output=True,
+                cwd=Path(convert_poetry2uv.__file__).parent,
+                env=env,
+            )
+            times.append(time.perf_counter() - start)
+        return min(times[1:])
+
+    bare = startup_time("-c", "pass")
+    assert startup_time("-m", "convert_poetry2uv", str(project)) < 2 * bare
+
+
+@pytest.mark.parametrize(
+    "polling",
+    [
+        pytest.param(
+            False,
+            marks=pytest.mark.skipif(
+                not sys.platform.startswith("linux"), reason="inotify is Linux only"
+            ),
+        ),
+        True,
+    ],
+)
+def test_watcher(tmp_path, polling):
+    project = tmp_path / "pyproject.toml"
+    project.write_text("[tool.poetry]\n")
+    relevant = convert_poetry2uv.is_project_file
+    if polling:
+        watcher = convert_poetry2uv.PollingWatcher([tmp_path], relevant, interval=0.01)
+    else:
+        watcher = convert_poetry2uv.InotifyWatcher([tmp_path], relevant)
+    try:
+        assert watcher.wait(0.05) == set()
+        tmp_path.joinpath("pyproject_temp_uv.toml").write_text("output")
+        assert watcher.wait(0.05) == set()
+        project.write_text('[tool.poetry]\nname = "x"\n')
+        os.utime(project, ns=(0, 0))
+        assert watcher.wait(2) == {project}
+        tmp_path.joinpath("LICENSE").write_text("MIT")
+        assert watcher.wait(2) == {tmp_path / "LICENSE"}
+    finally:
+        watcher.close()
+
+
+def test_watch_changes_debounce():
+    class Watcher:
+        waits = [{Path("a")}, {Path("b")}, set(), {Path("c")}, set()]
+
+        def wait(self, timeout):
+            return self.waits.pop(0)
+
+    changes = convert_poetry2uv.watch_changes(Watcher(), debounce=0)
+    assert next(changes) == {Path("a"), Path("b")}
+    assert next(changes) == {Path("c")}
+
+
+def test_watch(mocker, poetry_tree, capsys):
+    one = poetry_tree / "one" / "pyproject.toml"
+    two = poetry_tree / "two" / "pyproject.toml"
+    changes = [{one, poetry_tree / "one" / "pyproject_temp_uv.toml"}]
+    mocker.patch("convert_poetry2uv.watch_changes", return_value=iter(changes))
+    options = convert_poetry2uv.Options(dry_run=True)
+    convert_poetry2uv.watch([one, two], options, polling=True)
+    assert poetry_tree.joinpath("one", "pyproject_temp_uv.toml").exists()
+    assert not poetry_tree.joinpath("two", "pyproject_temp_uv.toml").exists()
+    out = capsys.readouterr().out
+    assert "Watching 2 projects (polling)" in out
+    assert f"converted: {one}" in out
+
+
+def make_archive(path, members):
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, data in members.items():
+                zf.writestr(name, data)
+        return
+    with tarfile.open(path, "w:gz") as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+def read_archive(path):
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as zf:
+            return {name: zf.read(name) for name in zf.namelist()}
+    with tarfile.open(path) as tf:
+        return {m.name: tf.extractfile(m).read() for m in tf.getmembers()}
+
+
+@pytest.fixture(params=["snapshot.tar.gz", "snapshot.zip"])
+def archive(request, tmp_path):
+    path = tmp_path / request.param
+    make_archive(
+        path,
+        {
+            "proj/pyproject.toml": Path(
+                "tests/files/poetry_pyproject.toml"
+            ).read_bytes(),
+            "proj/LICENSE": b"MIT",
+            "proj/src/data.bin": bytes(range(256)) * 64,
+            "other/pyproject.toml": b'[project]\nname = "other"\n',
+        },
+    )
+    return path
+
+
+def test_archive_projects(archive):
+    sources, names = convert_poetry2uv.archive_projects(archive)
+    assert sources.keys() == {"proj/pyproject.toml", "other/pyproject.toml"}
+    assert names["proj"] == {"pyproject.toml", "LICENSE"}
+    assert names["proj/src"] == {"data.bin"}
+
+
+def test_convert_archive_dry_run(archive):
+    original = read_archive(archive)
+    options = convert_poetry2uv.Options(dry_run=True)
+    result = convert_poetry2uv.convert_archive(archive, options)
+    assert result.outcome == "converted"
+    assert result.messages == [
+        "other/pyproject.toml: skipped",
+        "proj/pyproject.toml: converted",
+    ]
+    assert result.output_file.name.startswith("snapshot_temp_uv.")
+    assert read_archive(archive) == original
+    rewritten = read_archive(result.output_file)
+    output = rewritten.pop("proj/pyproject.toml").decode()
+    assert 'license = { file = "LICENSE" }' in output
+    assert tomllib.loads(output)["project"]["name"] == "name of the project"
+    del original["proj/pyproject.toml"]
+    assert rewritten == original
+
+
+def test_convert_archive_in_place(archive):
+    original = archive.read_bytes()
+    convert_poetry2uv.convert_archive(archive, convert_poetry2uv.Options())
+    assert archive.with_name(f"{archive.name}.org").read_bytes() == original
+    assert b"[tool.poetry]" not in read_archive(archive)["proj/pyproject.toml"]
+
+
+def test_convert_archive_backup_copy(archive, mocker):
+    original = archive.read_bytes()
+    archive.chmod(0o640)
+    mocker.patch("os.link", side_effect=OSError)
+    convert_poetry2uv.convert_archive(archive, convert_poetry2uv.Options())
+    backup = archive.with_name(f"{archive.name}.org")
+    assert backup.read_bytes() == original
+    assert backup.stat().st_mode & 0o777 == 0o640
+
+
+def test_convert_archive_keeps_backup(archive, capsys):
+    backup = archive.with_name(f"{archive.name}.org")
+    backup.write_bytes(b"first original")
+    convert_poetry2uv.convert_archive(archive, convert_poetry2uv.Options())
+    assert backup.read_bytes() == b"first original"
+    assert f"Backup file {backup} exists" in capsys.readouterr().out
+    assert b"[tool.poetry]" not in read_archive(archive)["proj/pyproject.toml"]
+
+
+@pytest.mark.parametrize(
+    "license", ["docs/LICENSE", "./docs/LICENSE", "src/../LICENSE"]
+)
+def test_convert_archive_nested_license(tmp_path, monkeypatch, license):
+    source = Path("tests/files/poetry_pyproject.toml").read_text()
+    source = source.replace('license = "LICENSE"', f'license = "{license}"')
+    assert license in source
+    archive = tmp_path / "snapshot.zip"
+    make_archive(
+        archive,
+        {"proj/pyproject.toml": source, "proj/docs/LICENSE": "MIT", "LICENSE": "MIT"},
+    )
+    # Only the archive members count, not the local files.
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath("proj/src").mkdir(parents=True)
+    tmp_path.joinpath("proj/LICENSE").write_text("MIT")
+    options = convert_poetry2uv.Options(dry_run=True)
+    result = convert_poetry2uv.convert_archive(archive, options)
+    output = read_archive(result.output_file)["proj/pyproject.toml"].decode()
+    expected = "text" if "src" in license else "file"
+    assert f'license = {{ {expected} = "{license}" }}' in output
+
+
+def test_convert_archive_output_dir(archive, tmp_path):
+    original = archive.read_bytes()
+    options = convert_poetry2uv.Options(archive_dir=tmp_path / "out")
+    result = convert_poetry2uv.convert_archive(archive, options)
+    assert result.output_file == tmp_path / "out" / "snapshot"
+    assert [p.name for p in result.output_file.rglob("*")] == ["proj", "pyproject.toml"]
+    output = result.output_file.joinpath("proj", "pyproject.toml").read_text()
+    assert output.startswith("[project]")
+    assert archive.read_bytes() == original
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar.gz"])
+def test_convert_archive_unsafe_members(tmp_path, capsys, suffix):
+    archive = tmp_path / f"snapshot{suffix}"
+    source = Path("tests/files/poetry_pyproject.toml").read_bytes()
+    escaped = tmp_path / "abs" / "pyproject.toml"
+    make_archive(
+        archive,
+        {
+            "../../escaped/pyproject.toml": source,
+            "proj/../../pyproject.toml": source,
+            str(escaped): source,
+            "proj/pyproject.toml": source,
+        },
+    )
+    options = convert_poetry2uv.Options(archive_dir=tmp_path / "out" / "dir")
+    result = convert_poetry2uv.convert_archive(archive, options)
+    assert result.messages == ["proj/pyproject.toml: converted"]
+    assert "'../../escaped/pyproject.toml' is outside" in capsys.readouterr().out
+    assert sorted(
+        str(p.relative_to(tmp_path)) for p in tmp_path.rglob("pyproject.toml")
+    ) == ["out/dir/snapshot/proj/pyproject.toml"]
+    assert not escaped.exists()
+
+
+def test_write_archive_outputs_stays_in_output_dir(tmp_path):
+    options = convert_poetry2uv.Options(archive_dir=tmp_path / "out")
+    for member in ("../pyproject.toml", str(tmp_path / "abs" / "pyproject.toml")):
+        with pytest.raises(ValueError, match="is outside"):
+            convert_poetry2uv.write_archive_outputs(
+                tmp_path / "snapshot.zip", {member: "x"}, options
+            )
+    assert not any(tmp_path.rglob("pyproject.toml"))
+
+
+def test_main_check_archive(mocker, archive, capsys):
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", str(archive), "--check"])
+    convert_poetry2uv.main()
+    out = capsys.readouterr().out
+    assert f"OK: {archive}" in out
+    assert "proj/pyproject.toml: ok" in out
+    assert len(list(archive.parent.iterdir())) == 1
+
+
+@pytest.mark.parametrize("io_concurrency", [None, 2])
+def test_batch_archives(poetry_tree, archive, io_concurrency):
+    patterns = [str(poetry_tree), str(archive)]
+    options = convert_poetry2uv.Options()
+    summary = convert_poetry2uv.batch(
+        patterns, options, jobs=1, io_concurrency=io_concurrency
+    )
+    assert summary["converted"] == 4
+    assert archive.with_name(f"{archive.name}.org").exists()
+
+
+@pytest.fixture
+def monorepo(tmp_path):
+    def project(directory, name, dependencies=""):
+        tmp_path.joinpath(directory).mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(directory, "pyproject.toml").write_text(
+            f'[tool.poetry]\nname = "{name}"\nversion = "1.0"\n'
+            f"[tool.poetry.dependencies]\n{dependencies}"
+        )
+
+    project("libs/core", "Core_Lib")
+    project(
+        "apps/web",
+        "web",
+        'core-lib = {path = "../../libs/core", develop = true}\n'
+        'other = {path = "../../vendor/other"}\n',
+    )
+    return tmp_path
+
+
+def test_parse_packages_workspace():
+    deps = {"core": {"path": "../core", "extras": ["a"]}, "other": {"path": "x"}}
+    uv_deps, _, sources = convert_poetry2uv.parse_packages(deps, ["core"])
+    assert uv_deps == ["core[a]"]
+    assert sources == {"core": {"workspace": True}}
+
+
+def test_main_workspace(mocker, monorepo):
+    mocker.patch("sys.argv", ["convert_poetry2uv.py", str(monorepo), "--workspace"])
+    convert_poetry2uv.main()
+    web = tomllib.loads(monorepo.joinpath("apps/web/pyproject.toml").read_text())
+    assert web["project"]["dependencies"] == ["core-lib"]
+    assert web["tool"]["uv"]["sources"] == {"core-lib": {"workspace": True}}
+    root = monorepo.joinpath("pyproject.toml").read_text()
+    assert root == '[tool.uv.workspace]\nmembers = ["apps/web", "libs/core"]\n'
+    assert not monorepo.joinpath("pyproject.toml.org").exists()
+
+
+def test_main_workspace_root_project(mocker, monorepo):
+    monorepo.joinpath("pyproject.toml").write_text(
+        '[tool.poetry]\nname = "root"\nversion = "1.0"\n'
+        '[tool.poetry.dependencies]\nweb = {path = "apps/web"}\n'
+    )
+    argv = ["convert_poetry2uv.py", str(monorepo), "--workspace", "-n"]
+    mocker.patch("sys.argv", argv)
+    convert_poetry2uv.main()
+    root = tomllib.loads(monorepo.joinpath("pyproject_temp_uv.toml").read_text())
+    assert root["project"]["dependencies"] == ["web"]
+    assert root["tool"]["uv"] == {
+        "sources": {"web": {"workspace": True}},
+        "workspace": {"members": ["apps/web", "libs/core"]},
+    }
+
+
+def test_main_workspace_check_verify(mocker, monorepo, capsys):
+    web = monorepo.joinpath("apps/web/pyproject.toml")
+    web.write_text(web.read_text().replace("other", "#other"))
+    workspace = ["convert_poetry2uv.py", str(monorepo), "--workspace"]
+    mocker.patch("sys.argv", [*workspace, "--check"])
+    convert_poetry2uv.main()
+    assert "ok: 2" in capsys.readouterr().out
+    assert not monorepo.joinpath("pyproject.toml").exists()
+    mocker.patch("sys.argv", [*workspace, "-n"])
+    convert_poetry2uv.main()
+    mocker.patch("sys.argv", [*workspace, "-n", "--verify"])
+    convert_poetry2uv.main()
+    assert "verified: 2" in capsys.readouterr().out
+
+
+def test_verify_without_workspace_reports_path(monorepo):
+    poetry = tomllib.loads(monorepo.joinpath("apps/web/pyproject.toml").read_text())
+    uv = {
+        "project": {"name": "web", "version": "1.0", "dependencies": ["core-lib"]},
+        "tool": {"uv": {"sources": {"core-lib": {"workspace": True}}}},
+    }
+    differences = convert_poetry2uv.verify(poetry, uv, ["core-lib", "web"])
+    assert differences == ["missing dependencies: other path ../../vendor/other"]
+    assert "added tool.uv.sources: core-lib" in " ".join(
+        convert_poetry2uv.verify(poetry, uv)
+    )
+
+
+def test_workspace_duplicate_names(monorepo):
+    shutil.copytree(monorepo / "libs/core", monorepo / "libs/copy")
+    with pytest.raises(ValueError, match="'Core_Lib' is defined in both"):
+        convert_poetry2uv.workspace_index([str(monorepo)])